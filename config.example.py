@@ -15,6 +15,10 @@ EMAIL_HOST_USER = 'your-email@gmail.com'
 EMAIL_HOST_PASSWORD = 'your-app-password'
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Пул SMTP соединений (необязательно, по умолчанию значения ниже)
+# EMAIL_POOL_SIZE = 5                       # одновременно открытых соединений
+# EMAIL_MAX_MESSAGES_PER_CONNECTION = 100   # писем на одно соединение
+
 # ==============================================
 # НАСТРОЙКИ SMS
 # ==============================================
@@ -38,6 +42,21 @@ SMS_SENDER = 'NotifySystem'
 # Токен бота (получите у @BotFather)
 TELEGRAM_BOT_TOKEN = 'your-bot-token'
 
+# Секрет webhook (1-256 символов: A-Z, a-z, 0-9, _ и -). Если задан, chat_id собираются
+# через webhook (manage.py telegram_webhook set <url>) вместо опроса getUpdates
+TELEGRAM_WEBHOOK_SECRET = ''
+
+# ==============================================
+# НАСТРОЙКИ CELERY
+# ==============================================
+
+# Брокер очереди задач рассылки
+CELERY_BROKER_URL = 'redis://localhost:6379/0'
+
+# True - выполнять задачи синхронно без брокера (для разработки и тестов,
+# вместе с CELERY_BROKER_URL = 'memory://')
+CELERY_TASK_ALWAYS_EAGER = False
+
 # ==============================================
 # НАСТРОЙКИ БЕЗОПАСНОСТИ
 # ==============================================
@@ -84,3 +103,9 @@ API_TIMEOUT = 30
 
 # Размер батча для массовой отправки
 BATCH_SIZE = 100
+
+# Кто выполняет пакеты рассылки: 'celery' или 'workers' (manage.py run_broadcast_workers).
+# Для нескольких воркеров нужна общая база PostgreSQL, SQLite - только для разработки
+# BROADCAST_EXECUTOR = 'celery'
+# BROADCAST_LEASE_SECONDS = 300             # аренда пакета воркером (с)
+# BROADCAST_WORKER_POLL_INTERVAL = 2.0      # пауза между проверками очереди (с)
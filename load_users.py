@@ -1,58 +1,27 @@
 import os
 import sys
 import django
-import json
 
 # Настройка Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notification_system.settings')
 django.setup()
 
-from notifications.models import NotificationUser, UserGroup
+from notifications.models import UserGroup
+from notifications.importers import detect_format, import_users_stream
 
-def load_users_from_json():
-    """Загрузка пользователей из JSON файла"""
+def load_users_from_json(file_path='users_data.json', full_snapshot=False):
+    """Загрузка пользователей из файла (JSON, NDJSON или CSV)"""
     try:
-        with open('users_data.json', 'r', encoding='utf-8') as f:
-            users_data = json.load(f)
+        # Файл читается потоково, пользователи записываются пакетами
+        with open(file_path, 'rb') as f:
+            result = import_users_stream(f, detect_format(file_path), full_snapshot=full_snapshot)
         
-        imported_count = 0
-        errors = []
-        
-        for user_data in users_data:
-            try:
-                # Получаем или создаем группу
-                group, created = UserGroup.objects.get_or_create(
-                    name=user_data['group'],
-                    defaults={'description': f'Группа {user_data["group"]}'}
-                )
-                
-                # Создаем или обновляем пользователя
-                user, created = NotificationUser.objects.update_or_create(
-                    external_id=user_data['id'],
-                    defaults={
-                        'email': user_data['email'],
-                        'phone': user_data['phone'],
-                        'telegram': user_data['telegram'],
-                        'group': group,
-                        'is_active': True,
-                    }
-                )
-                imported_count += 1
-                
-                if created:
-                    print(f"Создан пользователь {user_data['id']}: {user_data['email']}")
-                else:
-                    print(f"Обновлен пользователь {user_data['id']}: {user_data['email']}")
-                    
-            except Exception as e:
-                error_msg = f"Пользователь ID {user_data.get('id', '?')}: {str(e)}"
-                errors.append(error_msg)
-                print(f"ОШИБКА: {error_msg}")
-        
-        print(f"\nИтого: импортировано {imported_count} пользователей")
-        if errors:
-            print(f"Ошибок: {len(errors)}")
-            for error in errors[:5]:  # Показываем первые 5 ошибок
+        print(f"Создано: {result.created}, обновлено: {result.updated}, "
+              f"без изменений: {result.unchanged}, деактивировано: {result.deactivated}")
+        print(f"\nИтого: импортировано {result.imported} пользователей")
+        if result.errors:
+            print(f"Ошибок: {result.error_count}")
+            for error in result.errors[:5]:  # Показываем первые 5 ошибок
                 print(f"  - {error}")
         
         # Статистика по группам
@@ -62,7 +31,9 @@ def load_users_from_json():
             print(f"  {group.name}: {count} пользователей")
                 
     except Exception as e:
-        print(f"Ошибка загрузки JSON файла: {e}")
+        print(f"Ошибка загрузки файла: {e}")
 
 if __name__ == '__main__':
-    load_users_from_json()
+    # python load_users.py [файл] [--full-snapshot]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    load_users_from_json(*args[:1], full_snapshot='--full-snapshot' in sys.argv)
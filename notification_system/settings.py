@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,8 +51,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Статистика SQL запросов, работает только при DEBUG
+    'notifications.middleware.QueryCountMiddleware',
 ]
 
+# Порог количества SQL запросов на HTTP запрос и повторов одного шаблона для предупреждений
+QUERY_BUDGET = 30
+QUERY_DUPLICATE_THRESHOLD = 3
+
 ROOT_URLCONF = 'notification_system.urls'
 
 TEMPLATES = [
@@ -79,9 +86,27 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Сколько секунд ждать, пока другой процесс освободит блокировку записи
+        'OPTIONS': {
+            'timeout': 20,
+        },
+    }
+}
+
+
+# Cache
+# LocMemCache у каждого процесса свой; для нескольких процессов используйте
+# 'django.core.cache.backends.redis.RedisCache' с LOCATION = 'redis://localhost:6379/1'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'notifications',
     }
 }
 
+# Время жизни кэша главной панели (секунды); изменения данных сбрасывают его раньше
+DASHBOARD_CACHE_TIMEOUT = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -153,14 +178,147 @@ EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+EMAIL_TIMEOUT = 30
+
+# Пул SMTP соединений: количество одновременно открытых соединений
+# и число писем, после которого соединение переоткрывается
+try:
+    from config import EMAIL_POOL_SIZE
+except ImportError:
+    EMAIL_POOL_SIZE = 5
+try:
+    from config import EMAIL_MAX_MESSAGES_PER_CONNECTION
+except ImportError:
+    EMAIL_MAX_MESSAGES_PER_CONNECTION = 100
 
 # SMS Settings (настройте для вашего SMS провайдера)
 SMS_API_URL = 'https://sms.ru/sms/send'
 SMS_SENDER = 'NotifySystem'
+# Максимум номеров в одном запросе массовой отправки
+SMS_BATCH_SIZE = 100
+
+# HTTP клиенты провайдеров: keep-alive соединений на хост, таймауты (с),
+# повторы с экспоненциальной паузой и случайной добавкой
+HTTP_PROVIDERS = {
+    'sms': {
+        'pool_maxsize': 20,
+        'connect_timeout': 5,
+        'read_timeout': 30,
+        'retries': 3,
+    },
+    'telegram': {
+        'pool_maxsize': 30,
+        'connect_timeout': 5,
+        'read_timeout': 15,
+        'retries': 3,
+    },
+}
 
 # Telegram Bot Settings
 # Токен берётся из config.py
 
+# Ограничения Telegram: сообщений в секунду на бота и в один чат,
+# сколько раз повторять отправку после ответа 429 (retry_after).
+# Лимит на бота общий для процессов только при общем CACHES (Redis, Memcached)
+TELEGRAM_GLOBAL_RATE_LIMIT = 30
+TELEGRAM_PER_CHAT_RATE_LIMIT = 1
+TELEGRAM_MAX_RETRY_AFTER_ATTEMPTS = 3
+
+# Long polling getUpdates при сборе chat_id: сколько секунд Telegram держит запрос
+TELEGRAM_POLL_TIMEOUT = 30
+
+# Webhook вместо опроса: секрет, который Telegram передает в X-Telegram-Bot-Api-Secret-Token
+# (пустая строка - webhook выключен). Обновления обрабатываются пакетами
+# по TELEGRAM_WEBHOOK_BATCH_SIZE или раз в TELEGRAM_WEBHOOK_FLUSH_INTERVAL секунд
+try:
+    from config import TELEGRAM_WEBHOOK_SECRET
+except ImportError:
+    TELEGRAM_WEBHOOK_SECRET = ''
+TELEGRAM_WEBHOOK_BATCH_SIZE = 100
+TELEGRAM_WEBHOOK_FLUSH_INTERVAL = 1.0
+
+# Время жизни записи кэша username -> chat_id для отправки по username (с);
+# записи хранятся в CACHES, поэтому новый chat_id виден всем процессам
+TELEGRAM_CHAT_ID_CACHE_TTL = 600
+
+# Celery (фоновая отправка рассылок)
+# Для запуска без Redis укажите в config.py CELERY_BROKER_URL = 'memory://'
+# и CELERY_TASK_ALWAYS_EAGER = True — задачи будут выполняться синхронно
+try:
+    from config import CELERY_BROKER_URL, CELERY_TASK_ALWAYS_EAGER
+except ImportError:
+    CELERY_BROKER_URL = 'redis://localhost:6379/0'
+    CELERY_TASK_ALWAYS_EAGER = False
+
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TIMEZONE = TIME_ZONE
+
+# Максимум одновременных отправок по каждому каналу внутри пакета
+DELIVERY_CONCURRENCY = {
+    'email': EMAIL_POOL_SIZE,
+    'sms': 20,
+    'telegram': 25,
+}
+
+# Выключатели каналов (circuit breaker): канал с долей ошибок или медленных отправок
+# выше порога среди последних window отправок пропускается на open_seconds секунд.
+# 'default' - для всех каналов, ключи 'email', 'sms', 'telegram' - для отдельных
+CIRCUIT_BREAKERS = {
+    'default': {
+        'window': 50,
+        'min_calls': 10,
+        'failure_rate': 0.5,
+        'slow_call_seconds': 10.0,
+        'slow_call_rate': 0.5,
+        'open_seconds': 60,
+        'half_open_calls': 3,
+    },
+}
+
+# Пакетная запись NotificationLog: размер пакета и максимальный интервал между записями (с)
+NOTIFICATION_LOG_BATCH_SIZE = 500
+NOTIFICATION_LOG_FLUSH_INTERVAL = 2.0
+
+# Лог доставки (NDJSON): каталог, сжатие (None, 'gzip' или 'zstd' - нужен пакет zstandard)
+# и размер файла, после которого начинается новый
+DELIVERY_LOG_DIR = BASE_DIR / 'logs' / 'delivery'
+DELIVERY_LOG_COMPRESSION = 'gzip'
+DELIVERY_LOG_MAX_BYTES = 100 * 1024 * 1024
+
+# Количество получателей в одной задаче рассылки
+try:
+    from config import BATCH_SIZE as BROADCAST_CHUNK_SIZE
+except ImportError:
+    BROADCAST_CHUNK_SIZE = 100
+
+# Кто выполняет пакеты рассылки: 'celery' - задачи Celery, 'workers' - воркеры
+# manage.py run_broadcast_workers (можно запускать на нескольких хостах)
+try:
+    from config import BROADCAST_EXECUTOR
+except ImportError:
+    BROADCAST_EXECUTOR = 'celery'
+# Время аренды пакета воркером (продлевается, пока пакет отправляется)
+# и пауза между проверками очереди свободным воркером (с)
+try:
+    from config import BROADCAST_LEASE_SECONDS
+except ImportError:
+    BROADCAST_LEASE_SECONDS = 300
+try:
+    from config import BROADCAST_WORKER_POLL_INTERVAL
+except ImportError:
+    BROADCAST_WORKER_POLL_INTERVAL = 2.0
+
+# Через сколько секунд получатель, оставшийся в состоянии in_flight, считается
+# не отправленным (процесс упал во время отправки) и попадает в продолжение рассылки
+DELIVERY_IN_FLIGHT_TIMEOUT = 600
+
+# Код страны для телефонов без него (8XXXXXXXXXX, 10 цифр) при приведении к E.164
+PHONE_DEFAULT_COUNTRY_CODE = '7'
+
+# Импорт пользователей: сколько записей читается и записывается за один пакет
+IMPORT_BATCH_SIZE = 1000
+
 # Security Settings
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
@@ -215,3 +373,10 @@ LOGGING = {
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Тесты не пишут в logs/django.log
+if len(sys.argv) > 1 and sys.argv[1] == 'test':
+    LOGGING['handlers']['file'] = {'class': 'logging.NullHandler'}
+else:
+    # Каталог логов не хранится в репозитории
+    (BASE_DIR / 'logs').mkdir(exist_ok=True)
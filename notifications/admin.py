@@ -1,5 +1,10 @@
-from django.contrib import admin
-from .models import UserGroup, NotificationUser, NotificationMessage, NotificationLog
+from django.contrib import admin, messages
+from django.db.models import Count, Q
+from .models import (
+    UserGroup, NotificationUser, NotificationMessage, NotificationLog,
+    BroadcastChunk, MessageDelivery, MessageDeliveryStats
+)
+from .tasks import resume_broadcast
 
 
 @admin.register(UserGroup)
@@ -8,15 +13,22 @@ class UserGroupAdmin(admin.ModelAdmin):
     search_fields = ('name', 'description')
     list_filter = ('created_at',)
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            active_user_count=Count('users', filter=Q(users__is_active=True))
+        )
+    
     def user_count(self, obj):
-        return obj.users.filter(is_active=True).count()
+        return obj.active_user_count
     user_count.short_description = 'Активных пользователей'
+    user_count.admin_order_field = 'active_user_count'
 
 
 @admin.register(NotificationUser)
 class NotificationUserAdmin(admin.ModelAdmin):
     list_display = ('external_id', 'email', 'phone', 'telegram', 'group', 'is_active', 'created_at')
     list_filter = ('group', 'is_active', 'created_at')
+    list_select_related = ('group',)
     search_fields = ('email', 'phone', 'telegram', 'external_id')
     list_editable = ('is_active',)
     list_per_page = 50
@@ -38,35 +50,114 @@ class NotificationUserAdmin(admin.ModelAdmin):
 
 @admin.register(NotificationMessage)
 class NotificationMessageAdmin(admin.ModelAdmin):
-    list_display = ('title', 'created_by', 'is_sent', 'sent_at', 'created_at')
+    list_display = ('title', 'created_by', 'is_sent', 'delivery_summary', 'sent_at', 'created_at')
     list_filter = ('is_sent', 'created_at', 'sent_at', 'created_by')
+    list_select_related = ('created_by', 'delivery_stats')
     search_fields = ('title', 'content')
     filter_horizontal = ('target_groups',)
-    readonly_fields = ('created_at', 'sent_at', 'is_sent')
+    readonly_fields = ('created_at', 'sent_at', 'is_sent', 'delivery_summary', 'log_path', 'log_records')
+    actions = ['resume', 'retry_failed']
     
     fieldsets = (
         (None, {
             'fields': ('title', 'content')
         }),
         ('Настройки доставки', {
-            'fields': ('delivery_methods', 'target_groups', 'send_to_all')
+            'fields': ('delivery_methods', 'smart_order', 'target_groups', 'send_to_all')
         }),
         ('Статус', {
-            'fields': ('is_sent', 'sent_at', 'created_by', 'created_at'),
+            'fields': ('is_sent', 'sent_at', 'delivery_summary', 'created_by', 'created_at', 'log_path', 'log_records'),
             'classes': ('collapse',)
         }),
     )
     
+    def delivery_summary(self, obj):
+        stats = obj.stats
+        if not stats:
+            return '—'
+        return (
+            f"{stats.success} из {stats.total} (ошибок {stats.failed}; "
+            f"email {stats.email}, sms {stats.sms}, telegram {stats.telegram})"
+        )
+    delivery_summary.short_description = 'Доставка'
+    
+    def _resume(self, request, queryset, retry_failed):
+        resumed = 0
+        for message in queryset:
+            queued = resume_broadcast(message, retry_failed=retry_failed)
+            if queued is not None:
+                resumed += 1
+                self.message_user(request, f"{message.title}: в очереди {queued[1]} получателей")
+        if not resumed:
+            self.message_user(
+                request, 'Продолжать нечего: все получатели обработаны или рассылка еще выполняется',
+                messages.WARNING
+            )
+    
+    @admin.action(description='Продолжить рассылку (только недоставленным)')
+    def resume(self, request, queryset):
+        self._resume(request, queryset, retry_failed=False)
+    
+    @admin.action(description='Повторить неудачные доставки')
+    def retry_failed(self, request, queryset):
+        self._resume(request, queryset, retry_failed=True)
+    
     def save_model(self, request, obj, form, change):
         if not change:  # Только при создании
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
 
 
+@admin.register(MessageDeliveryStats)
+class MessageDeliveryStatsAdmin(admin.ModelAdmin):
+    list_display = ('message', 'total', 'success', 'failed', 'email', 'sms', 'telegram', 'updated_at')
+    list_select_related = ('message',)
+    search_fields = ('message__title',)
+    readonly_fields = ('message', 'total', 'success', 'failed', 'email', 'sms', 'telegram', 'updated_at')
+    
+    def has_add_permission(self, request):
+        return False  # Счетчики ведутся автоматически
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MessageDelivery)
+class MessageDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('message', 'user', 'status', 'delivery_method', 'updated_at')
+    list_filter = ('status', 'delivery_method')
+    list_select_related = ('message', 'user')
+    search_fields = ('message__title', 'user__email')
+    readonly_fields = ('message', 'user', 'status', 'delivery_method', 'updated_at')
+    
+    def has_add_permission(self, request):
+        return False  # Состояние ведется рассылкой
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(BroadcastChunk)
+class BroadcastChunkAdmin(admin.ModelAdmin):
+    list_display = ('message', 'index', 'status', 'lease_owner', 'lease_expires_at', 'attempts', 'updated_at')
+    list_filter = ('status',)
+    list_select_related = ('message',)
+    search_fields = ('message__title', 'lease_owner')
+    exclude = ('user_ids',)
+    readonly_fields = ('message', 'index', 'status', 'lease_owner', 'lease_expires_at', 'attempts', 'updated_at')
+    
+    def has_add_permission(self, request):
+        return False  # Пакеты создаются при постановке рассылки в очередь
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(NotificationLog)
 class NotificationLogAdmin(admin.ModelAdmin):
     list_display = ('user', 'message_title', 'delivery_method', 'status', 'sent_at')
     list_filter = ('delivery_method', 'status', 'sent_at')
+    list_select_related = ('user', 'message')
     search_fields = ('user__email', 'user__phone', 'user__telegram', 'message__title')
     readonly_fields = ('message', 'user', 'delivery_method', 'status', 'error_message', 'sent_at')
     list_per_page = 100
@@ -7,8 +7,13 @@ class NotificationsConfig(AppConfig):
     
     def ready(self):
         """Запускается при готовности приложения"""
+        # Инвалидация кэша главной панели
+        from . import signals  # noqa: F401
+        
         # Запускаем сбор chat_id только если это основной процесс Django
+        # и chat_id не приходят через webhook (Telegram не отдает getUpdates при webhook)
         import os
-        if os.environ.get('RUN_MAIN') == 'true':
+        from django.conf import settings
+        if os.environ.get('RUN_MAIN') == 'true' and not getattr(settings, 'TELEGRAM_WEBHOOK_SECRET', ''):
             from .services import telegram_collector
             telegram_collector.start_collecting()
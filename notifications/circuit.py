@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CIRCUIT_SETTINGS = {
+    # Сколько последних отправок учитывается и минимум для решения
+    'window': 50,
+    'min_calls': 10,
+    # Доля неудачных или медленных отправок, при которой канал отключается
+    'failure_rate': 0.5,
+    'slow_call_seconds': 10.0,
+    'slow_call_rate': 0.5,
+    # Через сколько секунд пробовать канал снова и сколько пробных отправок нужно
+    'open_seconds': 60,
+    'half_open_calls': 3,
+}
+
+
+class ProviderError(str):
+    """
+    Текст ошибки провайдера канала: исключение, таймаут, разрыв соединения,
+    ответ 5xx или 429. Только такие ошибки учитываются выключателем; ошибки
+    получателя (нет chat_id, номер отклонен, адрес не существует) - нет.
+    """
+
+
+def call_outcome(success: bool, error: str) -> Optional[bool]:
+    """Результат отправки для выключателя: True, False (сбой провайдера) или None (не учитывается)"""
+    if success:
+        return True
+    return False if isinstance(error, ProviderError) else None
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель канала доставки (closed / open / half-open)
+
+    closed - отправки идут, результаты последних window отправок
+    копятся. Если среди них доля неудачных или медленных (дольше
+    slow_call_seconds) превысила порог, канал переходит в open, и отправки
+    в него не выполняются: fallback сразу переходит к следующему способу.
+    Через open_seconds канал переходит в half-open и пропускает
+    half_open_calls пробных отправок: если все успешны - closed,
+    при первой неудаче - снова open.
+
+    Переходы записываются в таблицу ChannelCircuitState, поэтому их видят
+    все процессы (воркеры Celery, воркеры рассылок, веб-интерфейс): канал,
+    отключенный одним процессом, остальные не трогают до конца open_seconds.
+    Окно последних отправок у каждого процесса свое. Переходы пишутся в лог.
+
+    Методы обращаются к базе, поэтому из асинхронного кода их вызывают в
+    потоке пула (см. NotificationDeliveryService.send_many).
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    # Как часто перечитывать общее состояние из базы (секунды)
+    SYNC_INTERVAL = 1.0
+
+    def __init__(self, name: str, **options):
+        self.name = name
+        config = {**DEFAULT_CIRCUIT_SETTINGS, **options}
+        self.min_calls = config['min_calls']
+        self.failure_rate = config['failure_rate']
+        self.slow_call_seconds = config['slow_call_seconds']
+        self.slow_call_rate = config['slow_call_rate']
+        self.open_seconds = config['open_seconds']
+        self.half_open_calls = config['half_open_calls']
+
+        self._calls = deque(maxlen=config['window'])
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_until = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._synced_at = 0.0
+
+    def _sync(self, force: bool = False):
+        """Принять состояние, выставленное другим процессом"""
+        from .models import ChannelCircuitState
+
+        now = time.monotonic()
+        if not force and now - self._synced_at < self.SYNC_INTERVAL:
+            return
+        self._synced_at = now
+
+        try:
+            shared = ChannelCircuitState.objects.filter(channel=self.name).first()
+        except DatabaseError as e:
+            logger.warning(f"Канал {self.name}: не удалось прочитать состояние выключателя: {e}")
+            return
+        if not shared or shared.state == self._state:
+            return
+        if shared.state == self.OPEN:
+            self._state = self.OPEN
+            self._opened_until = shared.opened_until.timestamp() if shared.opened_until else 0.0
+        elif shared.state == self.CLOSED:
+            self._state = self.CLOSED
+            self._calls.clear()
+
+    def _transition(self, state: str, reason: str = ''):
+        from .models import ChannelCircuitState
+
+        previous, self._state = self._state, state
+        if state == self.OPEN:
+            self._opened_until = time.time() + self.open_seconds
+        if state == self.HALF_OPEN:
+            self._probes_started = self._probes_succeeded = 0
+        if state == self.CLOSED:
+            self._calls.clear()
+
+        opened_until = None
+        if state == self.OPEN:
+            opened_until = datetime.fromtimestamp(self._opened_until, tz=dt_timezone.utc)
+        try:
+            ChannelCircuitState.objects.update_or_create(
+                channel=self.name,
+                defaults={'state': state, 'reason': reason[:200], 'opened_until': opened_until},
+            )
+        except DatabaseError as e:
+            # Состояние процесса уже изменено, остальные узнают о переходе позже
+            logger.error(f"Канал {self.name}: не удалось сохранить состояние выключателя: {e}")
+        # Свой переход не нужно перечитывать из базы
+        self._synced_at = time.monotonic()
+
+        log = logger.warning if state == self.OPEN else logger.info
+        log(f"Канал {self.name}: {previous} -> {state}{f' ({reason})' if reason else ''}")
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправлять через канал"""
+        with self._lock:
+            self._sync()
+
+            if self._state == self.OPEN:
+                if time.time() < self._opened_until:
+                    return False
+                self._transition(self.HALF_OPEN, 'пробные отправки')
+
+            if self._state == self.HALF_OPEN:
+                if self._probes_started >= self.half_open_calls:
+                    return False
+                self._probes_started += 1
+
+            return True
+
+    def is_open(self) -> bool:
+        """Канал отключен (в отличие от allow() не занимает пробную отправку)"""
+        with self._lock:
+            self._sync()
+            return self._state == self.OPEN and time.time() < self._opened_until
+
+    def record(self, success: Optional[bool], duration: float):
+        """
+        Учесть результат отправки
+
+        success=None - отправка не показала состояние канала (ошибка получателя):
+        она не считается ни удачной, ни неудачной, а в half-open освобождает
+        занятую пробную отправку.
+        """
+        with self._lock:
+            if success is None:
+                if self._state == self.HALF_OPEN and self._probes_started > self._probes_succeeded:
+                    self._probes_started -= 1
+                return
+
+            slow = duration >= self.slow_call_seconds
+
+            if self._state == self.HALF_OPEN:
+                if not success or slow:
+                    self._transition(self.OPEN, 'пробная отправка не удалась')
+                    return
+                self._probes_succeeded += 1
+                if self._probes_succeeded >= self.half_open_calls:
+                    self._transition(self.CLOSED, 'пробные отправки успешны')
+                return
+
+            if self._state != self.CLOSED:
+                return
+
+            self._calls.append((success, slow))
+            if len(self._calls) < self.min_calls:
+                return
+
+            failure_rate = sum(1 for ok, _ in self._calls if not ok) / len(self._calls)
+            slow_rate = sum(1 for _, is_slow in self._calls if is_slow) / len(self._calls)
+            if failure_rate >= self.failure_rate:
+                self._transition(self.OPEN, f'ошибок {failure_rate:.0%} из {len(self._calls)} отправок')
+            elif slow_rate >= self.slow_call_rate:
+                self._transition(self.OPEN, f'медленных {slow_rate:.0%} из {len(self._calls)} отправок')
+
+    def reset(self):
+        """Вернуть канал в closed (например, после ручной проверки провайдера)"""
+        with self._lock:
+            self._transition(self.CLOSED, 'сброшен вручную')
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._sync(force=True)
+            return self._state
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(channel: str) -> CircuitBreaker:
+    """Выключатель канала (один на процесс, настройки из settings.CIRCUIT_BREAKERS)"""
+    with _breakers_lock:
+        if channel not in _breakers:
+            config = getattr(settings, 'CIRCUIT_BREAKERS', {})
+            options = {**config.get('default', {}), **config.get(channel, {})}
+            _breakers[channel] = CircuitBreaker(channel, **options)
+        return _breakers[channel]
+
+
+def get_channel_states(channels) -> Dict[str, Dict]:
+    """Состояние выключателей каналов для интерфейса (один запрос к базе)"""
+    from .models import ChannelCircuitState
+
+    shared = {row.channel: row for row in ChannelCircuitState.objects.filter(channel__in=channels)}
+    now = timezone.now()
+    states = {}
+    for channel in channels:
+        row = shared.get(channel)
+        state = {
+            'state': row.state if row else CircuitBreaker.CLOSED,
+            'reason': row.reason if row else '',
+            'changed_at': row.changed_at if row else None,
+        }
+        if state['state'] == CircuitBreaker.OPEN and (not row.opened_until or row.opened_until <= now):
+            # Срок отключения истек: следующая отправка будет пробной
+            state['state'] = CircuitBreaker.HALF_OPEN
+        states[channel] = state
+    return states
@@ -0,0 +1,130 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+
+from .models import MessageDeliveryStats, NotificationLog, NotificationMessage, NotificationUser, UserGroup
+
+
+class DashboardCache:
+    """
+    Кэш данных главной панели с инвалидацией по разделам
+
+    Каждый раздел (users, groups, messages, logs) хранится под ключом с номером
+    версии. Инвалидация увеличивает версию, поэтому значение, вычисленное
+    параллельно со сбросом, записывается под старым ключом и не читается.
+    Внутри batch() инвалидации копятся и выполняются один раз на выходе:
+
+        with dashboard_cache.batch():
+            for user in users:
+                user.save()  # сигналы не сбрасывают кэш на каждого пользователя
+    """
+
+    SECTIONS = ('users', 'groups', 'messages', 'logs')
+
+    def __init__(self, prefix: str = 'dashboard'):
+        self.prefix = prefix
+        self._local = threading.local()
+
+    @property
+    def timeout(self) -> int:
+        return getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 60)
+
+    def _version_key(self, section: str) -> str:
+        return f"{self.prefix}:{section}:version"
+
+    def _versions(self) -> Dict[str, int]:
+        keys = {section: self._version_key(section) for section in self.SECTIONS}
+        stored = cache.get_many(keys.values())
+        versions = {}
+        for section, key in keys.items():
+            if key not in stored:
+                cache.add(key, 1, None)
+            versions[section] = stored.get(key, 1)
+        return versions
+
+    def get_sections(self, loaders: Dict[str, Callable[[], Dict]]) -> Dict:
+        """
+        Данные разделов одним словарем
+
+        Args:
+            loaders: {раздел: функция, возвращающая словарь значений раздела} -
+                вызывается только для разделов, которых нет в кэше
+        """
+        versions = self._versions()
+        keys = {section: f"{self.prefix}:{section}:{versions[section]}" for section in loaders}
+        cached = cache.get_many(keys.values())
+
+        context = {}
+        missing = {}
+        for section, key in keys.items():
+            if key in cached:
+                context.update(cached[key])
+            else:
+                missing[key] = loaders[section]()
+                context.update(missing[key])
+
+        if missing:
+            cache.set_many(missing, self.timeout)
+        return context
+
+    def invalidate(self, *sections: str):
+        """Сбросить разделы (по умолчанию все)"""
+        sections = sections or self.SECTIONS
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.update(sections)
+            return
+
+        for section in sections:
+            try:
+                cache.incr(self._version_key(section))
+            except ValueError:
+                # Версии нет в кэше - нет и значений раздела
+                pass
+
+    @contextmanager
+    def batch(self):
+        """Отложить инвалидации до выхода из блока (блоки можно вкладывать)"""
+        if getattr(self._local, 'pending', None) is not None:
+            yield
+            return
+
+        self._local.pending = set()
+        try:
+            yield
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            if pending:
+                self.invalidate(*pending)
+
+
+dashboard_cache = DashboardCache()
+
+
+def get_dashboard_context() -> Dict:
+    """Показатели и последние записи для главной панели"""
+    return dashboard_cache.get_sections({
+        'users': lambda: {
+            'total_users': NotificationUser.objects.filter(is_active=True).count(),
+        },
+        'groups': lambda: {
+            'total_groups': UserGroup.objects.count(),
+        },
+        'messages': lambda: {
+            'total_messages': NotificationMessage.objects.count(),
+            # Итоги доставки из счетчиков, без агрегации логов
+            'delivery_totals': MessageDeliveryStats.objects.aggregate(
+                total=models.Sum('total'), success=models.Sum('success'), failed=models.Sum('failed')
+            ),
+            'recent_messages': list(
+                NotificationMessage.objects.select_related('created_by', 'delivery_stats')[:5]
+            ),
+        },
+        'logs': lambda: {
+            'recent_logs': list(NotificationLog.objects.select_related('user', 'message')[:10]),
+        },
+    })
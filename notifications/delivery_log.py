@@ -0,0 +1,222 @@
+import gzip
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import transaction
+
+from .dashboard import dashboard_cache
+from .models import MessageDeliveryStats, NotificationLog
+
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationLogBuffer:
+    """
+    Буфер записей NotificationLog с пакетной записью через bulk_create
+
+    Записи сбрасываются в базу, когда накопилось batch_size штук или с момента
+    последней записи прошло flush_interval секунд; вместе с ними обновляются
+    счетчики MessageDeliveryStats. При выходе из контекстного
+    менеджера (в том числе по исключению) буфер сбрасывается полностью.
+    Буфер потокобезопасен.
+
+        with NotificationLogBuffer() as log_buffer:
+            log_buffer.add(message=message, user=user, delivery_method='email', status='success')
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None):
+        self.batch_size = batch_size or getattr(settings, 'NOTIFICATION_LOG_BATCH_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'NOTIFICATION_LOG_FLUSH_INTERVAL', 2.0)
+        self._pending: List[NotificationLog] = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.written = 0
+
+    def add(self, **fields):
+        """Добавить запись лога"""
+        self.add_log(NotificationLog(**fields))
+
+    def add_log(self, log: NotificationLog):
+        with self._lock:
+            self._pending.append(log)
+            due = (
+                len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """Записать накопленные записи в базу. Returns количество записанных"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+
+        if not batch:
+            return 0
+
+        try:
+            # Логи и счетчики сообщения записываются вместе; счетчики - первыми,
+            # пока в базе только прежние логи получателей
+            with transaction.atomic():
+                MessageDeliveryStats.add_logs(batch)
+                NotificationLog.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            # Возвращаем записи в буфер, чтобы не потерять их при повторном сбросе
+            with self._lock:
+                self._pending = batch + self._pending
+            raise
+
+        # bulk_create не вызывает сигналы: кэш главной панели сбрасывается на пакет
+        dashboard_cache.invalidate('messages', 'logs')
+        self.written += len(batch)
+        return len(batch)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.flush()
+        except Exception as e:
+            if exc_type is None:
+                raise
+            logger.error(f"Ошибка записи логов уведомлений: {e}")
+        return False
+
+
+# Значение по умолчанию "взять из settings" (None означает лог без сжатия)
+_FROM_SETTINGS = object()
+
+
+class DeliveryLogWriter:
+    """
+    Append-only NDJSON лог доставки
+
+    Каждая запись пишется в файл сразу, одной строкой JSON, поэтому память не
+    растет с числом получателей. Файлы можно сжимать (gzip или zstd, если
+    установлен пакет zstandard) и ротировать по размеру. Каждый поток
+    пишет в свои файлы part_<хост>-<pid>-<поток>_<номер>, так что параллельные
+    задачи одной рассылки не мешают друг другу, в том числе воркеры на разных
+    машинах с общим каталогом логов (pid на них может совпадать).
+
+        with DeliveryLogWriter(message.log_path) as log_file:
+            log_file.write({'user_id': 1, 'status': 'success'})
+    """
+
+    EXTENSIONS = {
+        None: '.ndjson',
+        'gzip': '.ndjson.gz',
+        'zstd': '.ndjson.zst',
+    }
+
+    def __init__(self, directory: str, compression=_FROM_SETTINGS, max_bytes: int = None):
+        if compression is _FROM_SETTINGS:
+            compression = getattr(settings, 'DELIVERY_LOG_COMPRESSION', 'gzip')
+        if compression == 'zstd' and not _zstd_available():
+            logger.warning("Пакет zstandard не установлен, лог доставки сжимается gzip")
+            compression = 'gzip'
+        if compression not in self.EXTENSIONS:
+            raise ValueError(f"Неизвестный формат сжатия лога: {compression}")
+
+        self.directory = directory
+        self.compression = compression
+        self.max_bytes = max_bytes or getattr(settings, 'DELIVERY_LOG_MAX_BYTES', 100 * 1024 * 1024)
+        self.prefix = f"part_{_host_name()}-{os.getpid()}-{threading.get_ident()}"
+        self.records = 0
+        self._raw = None
+        self._stream = None
+        self._part = None
+        self._lock = threading.Lock()
+
+    @property
+    def extension(self) -> str:
+        return self.EXTENSIONS[self.compression]
+
+    def _part_path(self, part: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}_{part:04d}{self.extension}")
+
+    def _last_part(self) -> int:
+        """Номер последнего файла этого процесса, чтобы дописывать в него"""
+        pattern = re.compile(re.escape(self.prefix) + r'_(\d+)' + re.escape(self.extension) + '$')
+        parts = [
+            int(match.group(1))
+            for match in map(pattern.match, os.listdir(self.directory))
+            if match
+        ]
+        return max(parts, default=0)
+
+    def _open(self, part: int):
+        self._part = part
+        self._raw = open(self._part_path(part), 'ab')
+        if self.compression == 'gzip':
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='ab')
+        elif self.compression == 'zstd':
+            import zstandard
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+
+    def _close_stream(self):
+        if self._stream is not None and self._stream is not self._raw:
+            self._stream.close()
+        if self._raw is not None:
+            self._raw.close()
+        self._stream = self._raw = None
+
+    def _rotate_if_needed(self):
+        if self._raw.tell() >= self.max_bytes:
+            self._close_stream()
+            self._open(self._part + 1)
+
+    def write(self, record: Dict):
+        """Дописать запись в лог"""
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            if self._stream is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._open(self._last_part())
+            self._stream.write(line.encode('utf-8'))
+            self.records += 1
+            self._rotate_if_needed()
+
+    def close(self):
+        with self._lock:
+            self._close_stream()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _host_name() -> str:
+    """Имя машины, пригодное для имени файла"""
+    return re.sub(r'[^A-Za-z0-9.-]', '-', socket.gethostname()) or 'localhost'
+
+
+def _zstd_available() -> bool:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def delivery_log_path(message_id: int) -> str:
+    """Каталог лога доставки сообщения"""
+    base_dir = getattr(settings, 'DELIVERY_LOG_DIR', os.path.join('logs', 'delivery'))
+    return os.path.join(str(base_dir), f"message_{message_id}")
@@ -1,7 +1,7 @@
 from django import forms
 from django.core.exceptions import ValidationError
 from .models import NotificationUser, UserGroup, NotificationMessage
-import json
+from .importers import ImportFormatError, detect_format
 import re
 
 
@@ -108,7 +108,7 @@ class NotificationMessageForm(forms.ModelForm):
     
     class Meta:
         model = NotificationMessage
-        fields = ['title', 'content', 'target_groups', 'send_to_all', 'delivery_methods']
+        fields = ['title', 'content', 'target_groups', 'send_to_all', 'delivery_methods', 'smart_order']
         widgets = {
             'title': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -122,11 +122,18 @@ class NotificationMessageForm(forms.ModelForm):
             'send_to_all': forms.CheckboxInput(attrs={
                 'class': 'form-check-input'
             }),
+            'smart_order': forms.CheckboxInput(attrs={
+                'class': 'form-check-input'
+            }),
         }
         labels = {
             'title': 'Тема сообщения',
             'content': 'Текст сообщения',
             'send_to_all': 'Отправить всем пользователям',
+            'smart_order': 'Умный порядок способов доставки',
+        }
+        help_texts = {
+            'smart_order': 'Каждому пользователю сначала пробовать способ, который чаще срабатывал для него раньше',
         }
     
     def clean(self):
@@ -152,41 +159,28 @@ class NotificationMessageForm(forms.ModelForm):
 
 class JsonUploadForm(forms.Form):
     json_file = forms.FileField(
-        label='JSON файл с пользователями',
+        label='Файл с пользователями (JSON, NDJSON или CSV)',
         widget=forms.FileInput(attrs={
             'class': 'form-control',
-            'accept': '.json'
+            'accept': '.json,.ndjson,.jsonl,.csv'
         })
     )
     
+    full_snapshot = forms.BooleanField(
+        label='Полный снимок: деактивировать пользователей, которых нет в файле',
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    
     def clean_json_file(self):
+        # Содержимое проверяется построчно при импорте: файл может быть
+        # слишком большим, чтобы разбирать его здесь целиком
         file = self.cleaned_data.get('json_file')
         if file:
-            if not file.name.endswith('.json'):
-                raise ValidationError('Файл должен иметь расширение .json')
-            
             try:
-                content = file.read().decode('utf-8')
-                file.seek(0)  # Сбрасываем указатель файла
-                data = json.loads(content)
-                
-                if not isinstance(data, list):
-                    raise ValidationError('JSON файл должен содержать массив пользователей')
-                
-                # Проверяем структуру данных
-                required_fields = ['id', 'email', 'phone', 'telegram', 'group']
-                for i, user in enumerate(data):
-                    if not isinstance(user, dict):
-                        raise ValidationError(f'Элемент {i+1} должен быть объектом')
-                    
-                    for field in required_fields:
-                        if field not in user:
-                            raise ValidationError(f'Элемент {i+1}: отсутствует поле "{field}"')
-                
-            except json.JSONDecodeError:
-                raise ValidationError('Неверный формат JSON файла')
-            except UnicodeDecodeError:
-                raise ValidationError('Файл должен быть в кодировке UTF-8')
+                detect_format(file.name)
+            except ImportFormatError as e:
+                raise ValidationError(str(e))
         
         return file
 
@@ -0,0 +1,97 @@
+import threading
+from typing import Dict
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Настройки HTTP клиента по умолчанию; переопределяются в settings.HTTP_PROVIDERS
+DEFAULT_PROVIDER_SETTINGS = {
+    'pool_connections': 4,      # количество хостов с собственным пулом
+    'pool_maxsize': 10,         # keep-alive соединений на хост
+    'connect_timeout': 5,
+    'read_timeout': 30,
+    'retries': 3,
+    'backoff_factor': 0.5,      # 0.5, 1, 2... секунд между повторами
+    'backoff_jitter': 0.5,      # случайная добавка к паузе, секунд
+}
+
+# Статусы, после которых безопасно повторить идемпотентный запрос
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter с таймаутом по умолчанию для всех запросов"""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def get_provider_settings(provider: str) -> Dict:
+    """Настройки HTTP клиента для провайдера"""
+    overrides = getattr(settings, 'HTTP_PROVIDERS', {}).get(provider, {})
+    return {**DEFAULT_PROVIDER_SETTINGS, **overrides}
+
+
+def build_session(provider: str) -> requests.Session:
+    """
+    Создать сессию requests с пулом keep-alive соединений
+
+    Ошибки соединения повторяются для любых запросов (запрос не дошел до
+    сервера), ошибки чтения и 5xx - только для идемпотентных GET, чтобы не
+    отправить одно сообщение дважды. Пауза между повторами растет
+    экспоненциально со случайной добавкой.
+    """
+    config = get_provider_settings(provider)
+
+    retry = Retry(
+        total=config['retries'],
+        connect=config['retries'],
+        read=config['retries'],
+        status=config['retries'],
+        backoff_factor=config['backoff_factor'],
+        backoff_jitter=config['backoff_jitter'],
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=config['pool_connections'],
+        pool_maxsize=config['pool_maxsize'],
+        max_retries=retry,
+        timeout=(config['connect_timeout'], config['read_timeout']),
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_http_session(provider: str) -> requests.Session:
+    """Общая для процесса сессия провайдера ('sms', 'telegram')"""
+    with _sessions_lock:
+        session = _sessions.get(provider)
+        if session is None:
+            session = _sessions[provider] = build_session(provider)
+        return session
+
+
+def close_http_sessions():
+    """Закрыть все сессии и их соединения"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
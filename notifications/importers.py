@@ -0,0 +1,427 @@
+import codecs
+import csv
+import json
+import logging
+import os
+import uuid
+from typing import Dict, Iterator, List
+
+from django.conf import settings
+from django.db import transaction
+
+from .dashboard import dashboard_cache
+from .models import NotificationUser, UserGroup
+
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = ['id', 'email', 'phone', 'telegram', 'group']
+
+MAX_LENGTHS = {
+    'email': NotificationUser._meta.get_field('email').max_length,
+    'phone': NotificationUser._meta.get_field('phone').max_length,
+    'telegram': NotificationUser._meta.get_field('telegram').max_length,
+    'group': UserGroup._meta.get_field('name').max_length,
+}
+
+# Расширения файлов и соответствующие форматы
+FORMATS = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+}
+
+
+class ImportFormatError(ValueError):
+    """Файл импорта нельзя разобрать"""
+
+
+class ImportResult:
+    """Итоги импорта пользователей"""
+
+    # Сколько сообщений об ошибках хранить
+    MAX_ERRORS = 100
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.deactivated = 0
+        self.error_count = 0
+        self.errors: List[str] = []
+        # Файл прочитан не до конца
+        self.aborted = False
+
+    @property
+    def imported(self) -> int:
+        return self.created + self.updated + self.unchanged
+
+    def add_error(self, error: str, count: int = 1):
+        self.error_count += count
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append(error)
+
+    def summary(self) -> str:
+        return (
+            f'создано {self.created}, обновлено {self.updated}, без изменений {self.unchanged}, '
+            f'деактивировано {self.deactivated}'
+        )
+
+
+def detect_format(file_name: str) -> str:
+    """Формат файла по расширению: 'json', 'ndjson' или 'csv'"""
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in FORMATS:
+        raise ImportFormatError(
+            f'Неподдерживаемый формат файла. Допустимые расширения: {", ".join(FORMATS)}'
+        )
+    return FORMATS[extension]
+
+
+def iter_json_array(stream, chunk_size: int = 64 * 1024, max_item_size: int = 1024 * 1024) -> Iterator:
+    """
+    Потоково разобрать JSON массив, возвращая элементы по одному
+
+    В памяти хранится только текущий фрагмент файла, а не весь массив.
+    Элемент длиннее max_item_size символов считается ошибкой формата:
+    иначе испорченный элемент заставил бы дочитать в память весь файл.
+
+    Raises:
+        ImportFormatError (ValueError): файл не является корректным JSON массивом
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    started = False
+    expect_comma = False
+    after_comma = False
+
+    while True:
+        # Пропускаем пробелы, при необходимости дочитываем файл
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                raise ImportFormatError('Неожиданный конец JSON файла')
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        char = buffer[pos]
+        if not started:
+            if char != '[':
+                raise ImportFormatError('JSON файл должен содержать массив пользователей')
+            started = True
+            pos += 1
+            continue
+
+        if char == ']':
+            if after_comma:
+                raise ImportFormatError('Неверный формат JSON файла: лишняя запятая перед "]"')
+            return
+
+        if expect_comma:
+            if char != ',':
+                raise ImportFormatError('Неверный формат JSON файла')
+            expect_comma = False
+            after_comma = True
+            pos += 1
+            continue
+
+        if char == ',':
+            raise ImportFormatError('Неверный формат JSON файла: пропущен элемент массива')
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            item, end = None, None
+
+        # Элемент может быть обрезан границей фрагмента - дочитываем
+        if end is None or (end >= len(buffer) and not eof):
+            if eof:
+                raise ImportFormatError('Неверный формат JSON файла')
+            if len(buffer) - pos > max_item_size:
+                raise ImportFormatError(f'Неверный формат JSON файла: элемент длиннее {max_item_size} символов')
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        yield item
+        pos = end
+        expect_comma = True
+        after_comma = False
+
+
+def iter_ndjson(stream) -> Iterator:
+    """Разобрать NDJSON: один JSON объект на строку"""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            # Битая строка не прерывает импорт, а попадает в ошибки
+            yield ImportFormatError(f'Строка {line_number}: неверный JSON')
+
+
+def iter_csv(stream) -> Iterator:
+    """Разобрать CSV с заголовком id,email,phone,telegram,group"""
+    reader = csv.DictReader(stream)
+    missing = [field for field in REQUIRED_FIELDS if field not in (reader.fieldnames or [])]
+    if missing:
+        raise ImportFormatError(f'В CSV отсутствуют колонки: {", ".join(missing)}')
+    yield from reader
+
+
+def iter_records(fileobj, file_format: str) -> Iterator:
+    """Потоково читать записи из бинарного файла в формате json/ndjson/csv"""
+    stream = codecs.getreader('utf-8-sig')(fileobj)
+
+    if file_format == 'json':
+        return iter_json_array(stream)
+    elif file_format == 'ndjson':
+        return iter_ndjson(stream)
+    elif file_format == 'csv':
+        return iter_csv(stream)
+    raise ImportFormatError(f'Неизвестный формат: {file_format}')
+
+
+def validate_record(record) -> Dict:
+    """Проверить запись пользователя и привести поля к нужным типам"""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError('запись должна быть объектом')
+
+    for field in REQUIRED_FIELDS:
+        if record.get(field) in (None, ''):
+            raise ValueError(f'отсутствует поле "{field}"')
+
+    try:
+        external_id = int(record['id'])
+    except (TypeError, ValueError):
+        raise ValueError('поле "id" должно быть числом')
+
+    cleaned = {
+        'id': external_id,
+        'email': str(record['email']).strip(),
+        'phone': str(record['phone']).strip(),
+        'telegram': str(record['telegram']).strip(),
+        'group': str(record['group']).strip(),
+    }
+
+    # Длины проверяем заранее: одна слишком длинная строка сорвала бы запись всего пакета
+    for field, max_length in MAX_LENGTHS.items():
+        if len(cleaned[field]) > max_length:
+            raise ValueError(f'поле "{field}" длиннее {max_length} символов')
+
+    return cleaned
+
+
+class UserImporter:
+    """
+    Пакетная запись импортируемых пользователей
+
+    На пакет выполняется постоянное число запросов независимо от его размера:
+    недостающие группы создаются одним bulk_create, существующие пользователи
+    пакета выбираются одним запросом по external_id, а запись идет одним
+    upsert (bulk_create с update_conflicts).
+
+    Записываются только новые и изменившиеся пользователи: изменения
+    определяются сравнением отпечатка полей (NotificationUser.import_hash).
+    При full_snapshot каждый пользователь из файла помечается в базе
+    идентификатором импорта (NotificationUser.import_run), и после импорта
+    одним UPDATE деактивируются активные пользователи без этой пометки.
+    Память не зависит от числа пользователей в файле.
+    """
+
+    UPDATE_FIELDS = [
+        'email', 'phone', 'phone_e164', 'telegram', 'telegram_username',
+        'group', 'is_active', 'import_hash', 'updated_at',
+    ]
+
+    # Сколько пропущенных записей копить до отдельного UPDATE пометки
+    SEEN_BATCH_SIZE = 1000
+
+    def __init__(self, result: ImportResult = None, full_snapshot: bool = False):
+        self.result = result or ImportResult()
+        self.full_snapshot = full_snapshot
+        self.run_id = uuid.uuid4().hex if full_snapshot else ''
+        # Пользователи из файла, еще не помеченные run_id (записи с ошибками)
+        self.pending_seen: List[int] = []
+        # Все группы загружаются один раз на импорт
+        self.groups: Dict[str, UserGroup] = {group.name: group for group in UserGroup.objects.all()}
+
+    def _ensure_groups(self, names):
+        missing = set(names) - self.groups.keys()
+        if not missing:
+            return
+
+        UserGroup.objects.bulk_create(
+            [UserGroup(name=name, description=f'Группа {name}') for name in missing],
+            ignore_conflicts=True,
+        )
+        # ignore_conflicts не возвращает id, поэтому перечитываем созданные группы
+        self.groups.update({group.name: group for group in UserGroup.objects.filter(name__in=missing)})
+
+    def mark_seen(self, external_id: int):
+        """
+        Пользователь есть в файле, но не записывается (нужно для full_snapshot)
+        
+        Пометка попадает в базу вместе со следующим пакетом или в deactivate_missing.
+        """
+        if self.full_snapshot:
+            self.pending_seen.append(external_id)
+            if len(self.pending_seen) >= self.SEEN_BATCH_SIZE:
+                self._stamp_seen(self.pending_seen)
+                self.pending_seen = []
+
+    def _stamp_seen(self, external_ids):
+        """Пометить пользователей текущим импортом одним UPDATE"""
+        external_ids = list(external_ids)
+        if self.full_snapshot and external_ids:
+            NotificationUser.objects.filter(external_id__in=external_ids).update(import_run=self.run_id)
+
+    def import_batch(self, rows: List[Dict]):
+        """Записать пакет проверенных записей (см. validate_record)"""
+        # Повторы external_id внутри пакета: побеждает последняя запись
+        rows_by_id = {row['id']: row for row in rows}
+        seen_ids, self.pending_seen = self.pending_seen, []
+        update_fields = self.UPDATE_FIELDS + ['import_run'] if self.full_snapshot else self.UPDATE_FIELDS
+
+        try:
+            with transaction.atomic():
+                self._ensure_groups(row['group'] for row in rows_by_id.values())
+
+                existing = {
+                    external_id: (import_hash, is_active)
+                    for external_id, import_hash, is_active in
+                    NotificationUser.objects.filter(external_id__in=list(rows_by_id))
+                    .values_list('external_id', 'import_hash', 'is_active')
+                }
+
+                to_write = []
+                unchanged = 0
+                for row in rows_by_id.values():
+                    group = self.groups[row['group']]
+                    import_hash = NotificationUser.make_import_hash(
+                        row['email'], row['phone'], row['telegram'], group.id
+                    )
+                    if existing.get(row['id']) == (import_hash, True):
+                        unchanged += 1
+                        seen_ids.append(row['id'])
+                        continue
+
+                    to_write.append(NotificationUser(
+                        external_id=row['id'],
+                        email=row['email'],
+                        phone=row['phone'],
+                        phone_e164=NotificationUser.normalize_phone(row['phone']),
+                        telegram=row['telegram'],
+                        telegram_username=NotificationUser.normalize_telegram(row['telegram']),
+                        group=group,
+                        is_active=True,
+                        import_hash=import_hash,
+                        import_run=self.run_id,
+                    ))
+
+                if to_write:
+                    NotificationUser.objects.bulk_create(
+                        to_write,
+                        update_conflicts=True,
+                        unique_fields=['external_id'],
+                        update_fields=update_fields,
+                    )
+                # Записанные пользователи помечены через import_run, остальные - отдельно
+                self._stamp_seen(seen_ids)
+        except Exception as e:
+            # Группы, созданные в откатанной транзакции, больше не существуют
+            self.groups = {group.name: group for group in UserGroup.objects.all()}
+            ids = list(rows_by_id)
+            self.result.add_error(
+                f'Пакет пользователей ID {ids[0]}..{ids[-1]} не записан: {str(e)}', count=len(ids)
+            )
+            # Пользователи пакета есть в файле: деактивировать их нельзя
+            self._stamp_seen(seen_ids + ids)
+            return
+
+        created = sum(1 for user in to_write if user.external_id not in existing)
+        self.result.created += created
+        self.result.updated += len(to_write) - created
+        self.result.unchanged += unchanged
+
+    def deactivate_missing(self, batch_size: int = 1000):
+        """Деактивировать активных пользователей, которых не было в файле"""
+        if not self.full_snapshot:
+            return
+        if self.result.aborted:
+            # По обрезанному файлу нельзя судить, кого в снимке нет
+            self.result.add_error('Файл прочитан не полностью, деактивация пропущена')
+            return
+
+        seen_ids, self.pending_seen = self.pending_seen, []
+        for start in range(0, len(seen_ids), batch_size):
+            self._stamp_seen(seen_ids[start:start + batch_size])
+
+        self.result.deactivated += NotificationUser.objects.filter(
+            is_active=True
+        ).exclude(import_run=self.run_id).update(is_active=False)
+
+
+def import_users_stream(fileobj, file_format: str, batch_size: int = None,
+                        full_snapshot: bool = False) -> ImportResult:
+    """
+    Импортировать пользователей из файла, не загружая его целиком в память
+
+    Записи проверяются по одной и записываются в базу пакетами по batch_size,
+    поэтому расход памяти зависит от размера пакета, а не от размера файла.
+    Если файл поврежден, уже прочитанные записи сохраняются, а ошибка
+    попадает в результат.
+
+    Args:
+        full_snapshot: файл содержит всех пользователей - отсутствующие в нем
+            будут деактивированы
+    """
+    batch_size = batch_size or getattr(settings, 'IMPORT_BATCH_SIZE', 1000)
+    importer = UserImporter(full_snapshot=full_snapshot)
+    result = importer.result
+    batch: List[Dict] = []
+
+    try:
+        for number, record in enumerate(iter_records(fileobj, file_format), start=1):
+            try:
+                batch.append(validate_record(record))
+            except ValueError as e:
+                result.add_error(f'Запись {number}: {e}')
+                # Пользователь с ошибкой в данных все равно есть в снимке
+                if isinstance(record, dict) and str(record.get('id', '')).isdigit():
+                    importer.mark_seen(int(record['id']))
+                continue
+
+            if len(batch) >= batch_size:
+                importer.import_batch(batch)
+                batch = []
+    except ImportFormatError as e:
+        # Файл поврежден: сохраняем уже прочитанное и прекращаем импорт
+        result.add_error(str(e))
+        result.aborted = True
+    except UnicodeDecodeError:
+        result.add_error('Файл должен быть в кодировке UTF-8')
+        result.aborted = True
+
+    if batch:
+        importer.import_batch(batch)
+
+    importer.deactivate_missing(batch_size)
+    # Пакетная запись не вызывает сигналы: кэш главной панели сбрасывается один раз на импорт
+    dashboard_cache.invalidate('users', 'groups')
+
+    logger.info(f"Импорт пользователей: {result.summary()}, ошибок {result.error_count}")
+    return result
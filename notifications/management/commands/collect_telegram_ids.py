@@ -1,4 +1,4 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from notifications.services import telegram_collector
 import time
 
@@ -16,9 +16,11 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         if options['once']:
             self.stdout.write("Выполняется однократный сбор chat_id...")
-            telegram_collector._process_updates()
+            count = telegram_collector._process_updates()
+            if count is None:
+                raise CommandError('Не удалось получить обновления Telegram, подробности в логе')
             self.stdout.write(
-                self.style.SUCCESS('Сбор chat_id завершен')
+                self.style.SUCCESS(f'Сбор chat_id завершен, обработано обновлений: {count}')
             )
         else:
             self.stdout.write("Запуск постоянного сбора chat_id...")
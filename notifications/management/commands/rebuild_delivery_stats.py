@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from notifications.models import MessageDeliveryStats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать счетчики доставки сообщений по логам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'message_ids',
+            nargs='*',
+            type=int,
+            help='ID сообщений (по умолчанию все)',
+        )
+
+    def handle(self, *args, **options):
+        message_ids = options['message_ids'] or None
+        count = MessageDeliveryStats.rebuild(message_ids)
+        self.stdout.write(
+            self.style.SUCCESS(f'Счетчики пересчитаны для {count} сообщений')
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from notifications.models import NotificationMessage
+from notifications.tasks import resume_broadcast
+
+
+class Command(BaseCommand):
+    help = 'Продолжить прерванную рассылку: отправить только тем, кому сообщение еще не доставлено'
+
+    def add_arguments(self, parser):
+        parser.add_argument('message_id', type=int, help='ID сообщения')
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Повторить и неудачные доставки',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            message = NotificationMessage.objects.get(id=options['message_id'])
+        except NotificationMessage.DoesNotExist:
+            raise CommandError(f"Сообщение {options['message_id']} не найдено")
+
+        progress = message.get_delivery_progress()
+        self.stdout.write(
+            f"Доставлено {progress['done']}, не доставлено {progress['failed']}, "
+            f"ожидает {progress['pending']}, отправляется {progress['in_flight']}"
+        )
+
+        queued = resume_broadcast(message, retry_failed=options['retry_failed'])
+        if queued is None:
+            self.stdout.write('Продолжать нечего или рассылка еще выполняется')
+            return
+
+        chunks_count, total_count = queued
+        self.stdout.write(
+            self.style.SUCCESS(f'В очередь поставлено {total_count} получателей, {chunks_count} пакетов')
+        )
@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import signal
+import socket
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from notifications.workers import BroadcastWorker
+
+
+def _run_worker(name, options):
+    worker = BroadcastWorker(
+        name=name,
+        message_id=options['message'],
+        lease_seconds=options['lease_seconds'],
+        poll_interval=options['poll_interval'],
+    )
+    # Ctrl+C и SIGTERM останавливают воркер после текущего пакета
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: worker.stop())
+    return worker.run(exit_when_idle=options['exit_when_idle'])
+
+
+class Command(BaseCommand):
+    help = 'Запустить воркеры рассылок, разбирающие пакеты получателей из базы'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Количество процессов-воркеров (по умолчанию 1)',
+        )
+        parser.add_argument(
+            '--message',
+            type=int,
+            help='Обрабатывать только пакеты этого сообщения',
+        )
+        parser.add_argument(
+            '--exit-when-idle',
+            action='store_true',
+            help='Завершиться, когда свободных пакетов не останется',
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            type=int,
+            help='Время аренды пакета (по умолчанию BROADCAST_LEASE_SECONDS)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            help='Пауза между проверками очереди (по умолчанию BROADCAST_WORKER_POLL_INTERVAL)',
+        )
+
+    def handle(self, *args, **options):
+        count = options['workers']
+        if count < 1:
+            raise CommandError('Количество воркеров должно быть положительным')
+
+        options = {
+            key: options[key]
+            for key in ('message', 'exit_when_idle', 'lease_seconds', 'poll_interval')
+        }
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        if count == 1:
+            processed = _run_worker(f"{prefix}-0", options)
+            self.stdout.write(self.style.SUCCESS(f'Обработано пакетов: {processed}'))
+            return
+
+        # Дочерние процессы открывают свои соединения с базой
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=_run_worker, args=(f"{prefix}-{index}", options), daemon=False)
+            for index in range(count)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f'Запущено воркеров: {count}')
+
+        for process in processes:
+            while process.is_alive():
+                try:
+                    process.join()
+                except KeyboardInterrupt:
+                    # Ctrl+C получают и воркеры: ждем, пока они завершат текущие пакеты
+                    self.stdout.write('Остановка воркеров после текущих пакетов...')
+
+        failed = sum(1 for process in processes if process.exitcode)
+        if failed:
+            raise CommandError(f'Воркеров завершилось с ошибкой: {failed}')
+        self.stdout.write(self.style.SUCCESS('Воркеры остановлены'))
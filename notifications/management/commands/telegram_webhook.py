@@ -0,0 +1,66 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from notifications.http_client import get_http_session
+
+
+class Command(BaseCommand):
+    help = 'Зарегистрировать, удалить или показать webhook Telegram бота'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'action',
+            choices=['set', 'delete', 'info'],
+            help='set - зарегистрировать webhook, delete - удалить, info - показать текущий',
+        )
+        parser.add_argument(
+            'url',
+            nargs='?',
+            help='Публичный HTTPS адрес webhook, например https://example.com/telegram/webhook/',
+        )
+        parser.add_argument(
+            '--drop-pending',
+            action='store_true',
+            help='Отбросить накопленные Telegram обновления',
+        )
+
+    def _call(self, method, **params):
+        token = getattr(settings, 'TELEGRAM_BOT_TOKEN', '')
+        if not token:
+            raise CommandError('TELEGRAM_BOT_TOKEN не задан')
+
+        response = get_http_session('telegram').post(
+            f"https://api.telegram.org/bot{token}/{method}", json=params
+        )
+        data = response.json()
+        if not data.get('ok'):
+            raise CommandError(f"{method}: {data.get('description', 'неизвестная ошибка')}")
+        return data.get('result')
+
+    def handle(self, *args, **options):
+        action = options['action']
+
+        if action == 'set':
+            secret = getattr(settings, 'TELEGRAM_WEBHOOK_SECRET', '')
+            if not options['url']:
+                raise CommandError('Укажите адрес webhook')
+            if not secret:
+                raise CommandError('TELEGRAM_WEBHOOK_SECRET не задан в config.py')
+
+            self._call(
+                'setWebhook',
+                url=options['url'],
+                secret_token=secret,
+                allowed_updates=['message'],
+                drop_pending_updates=options['drop_pending'],
+            )
+            self.stdout.write(self.style.SUCCESS(f"Webhook зарегистрирован: {options['url']}"))
+
+        elif action == 'delete':
+            self._call('deleteWebhook', drop_pending_updates=options['drop_pending'])
+            self.stdout.write(self.style.SUCCESS('Webhook удален, можно снова использовать опрос getUpdates'))
+
+        else:
+            info = self._call('getWebhookInfo')
+            self.stdout.write(json.dumps(info, ensure_ascii=False, indent=2))
@@ -0,0 +1,115 @@
+import logging
+import re
+import time
+from collections import Counter
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# Списки параметров IN (%s, %s, ...) разной длины считаются одним шаблоном
+_IN_PARAMS = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+
+def sql_pattern(sql: str) -> str:
+    """Шаблон запроса без значений параметров"""
+    return _IN_PARAMS.sub('(%s...)', sql)
+
+
+class QueryRecorder:
+    """
+    Запись SQL запросов ко всем базам данных внутри блока
+
+    Работает и при DEBUG = False: запросы перехватываются через
+    connection.execute_wrapper, а не читаются из connection.queries.
+
+        with QueryRecorder() as recorder:
+            ...
+        recorder.count, recorder.duration, recorder.duplicates()
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.queries: List[Dict] = []
+        self._wrappers = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': params,
+                'duration': time.perf_counter() - start,
+            })
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def duration(self) -> float:
+        """Суммарное время запросов, секунды"""
+        return sum(query['duration'] for query in self.queries)
+
+    def duplicates(self, threshold: int = 2) -> Dict[str, int]:
+        """Шаблоны запросов, выполненные threshold и более раз (признак N+1)"""
+        patterns = Counter(sql_pattern(query['sql']) for query in self.queries)
+        return {pattern: count for pattern, count in patterns.items() if count >= threshold}
+
+    def __enter__(self):
+        aliases = [self.using] if self.using else list(connections)
+        for alias in aliases:
+            wrapper = connections[alias].execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        while self._wrappers:
+            self._wrappers.pop().__exit__(exc_type, exc, tb)
+        return False
+
+
+class QueryCountMiddleware:
+    """
+    Отладочная статистика SQL запросов на каждый запрос
+
+    Включается только при DEBUG. Пишет в лог количество и время запросов,
+    предупреждает о превышении QUERY_BUDGET и о повторяющихся шаблонах
+    запросов (QUERY_DUPLICATE_THRESHOLD и более раз), добавляет заголовки
+    X-Query-Count и X-Query-Duration.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.budget = getattr(settings, 'QUERY_BUDGET', 30)
+        self.duplicate_threshold = getattr(settings, 'QUERY_DUPLICATE_THRESHOLD', 3)
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(recorder.count)
+        response['X-Query-Duration'] = f"{recorder.duration * 1000:.1f}ms"
+
+        logger.debug(
+            f"{request.method} {request.path}: {recorder.count} запросов, "
+            f"{recorder.duration * 1000:.1f} мс"
+        )
+        if recorder.count > self.budget:
+            logger.warning(
+                f"{request.method} {request.path}: {recorder.count} запросов "
+                f"при бюджете {self.budget}"
+            )
+        for pattern, count in recorder.duplicates(self.duplicate_threshold).items():
+            logger.warning(f"{request.method} {request.path}: запрос повторен {count} раз: {pattern}")
+
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_notificationuser_telegram_chat_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationmessage',
+            name='chunks_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notificationmessage',
+            name='chunks_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:39
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def fill_import_hash(apps, schema_editor):
+    NotificationUser = apps.get_model('notifications', 'NotificationUser')
+    last_id = 0
+    while True:
+        users = list(
+            NotificationUser.objects.filter(id__gt=last_id).order_by('id')
+            .only('id', 'email', 'phone', 'telegram', 'group_id')[:1000]
+        )
+        if not users:
+            break
+        for user in users:
+            payload = json.dumps([user.email, user.phone, user.telegram, user.group_id], ensure_ascii=False)
+            user.import_hash = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        NotificationUser.objects.bulk_update(users, ['import_hash'])
+        last_id = users[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_notificationmessage_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationuser',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_import_hash, migrations.RunPython.noop),
+    ]
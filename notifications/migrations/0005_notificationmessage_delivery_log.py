@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_notificationuser_import_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationmessage',
+            name='log_path',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='notificationmessage',
+            name='log_records',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
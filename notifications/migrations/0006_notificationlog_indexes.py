@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_notificationmessage_delivery_log'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['sent_at', 'id'], name='notif_log_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['status', 'sent_at', 'id'], name='notif_log_status_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['delivery_method', 'sent_at', 'id'], name='notif_log_method_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['message', 'status'], name='notif_log_message_status_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:43
+
+from django.db import migrations, models
+
+
+def fill_telegram_username(apps, schema_editor):
+    NotificationUser = apps.get_model('notifications', 'NotificationUser')
+    last_id = 0
+    while True:
+        users = list(
+            NotificationUser.objects.filter(id__gt=last_id).order_by('id').only('id', 'telegram')[:1000]
+        )
+        if not users:
+            break
+        for user in users:
+            user.telegram_username = (user.telegram or '').strip().lstrip('@').lower()
+        NotificationUser.objects.bulk_update(users, ['telegram_username'])
+        last_id = users[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0006_notificationlog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationuser',
+            name='telegram_username',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(fill_telegram_username, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notificationuser',
+            index=models.Index(fields=['group', 'is_active'], name='notif_user_group_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationuser',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id'], name='notif_user_active_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_delivery_stats(apps, schema_editor):
+    NotificationLog = apps.get_model('notifications', 'NotificationLog')
+    MessageDeliveryStats = apps.get_model('notifications', 'MessageDeliveryStats')
+    rows = NotificationLog.objects.values('message_id').order_by('message_id').annotate(
+        total=models.Count('id'),
+        success=models.Count('id', filter=models.Q(status='success')),
+        failed=models.Count('id', filter=models.Q(status='failed')),
+        email=models.Count('id', filter=models.Q(delivery_method='email')),
+        sms=models.Count('id', filter=models.Q(delivery_method='sms')),
+        telegram=models.Count('id', filter=models.Q(delivery_method='telegram')),
+    )
+    MessageDeliveryStats.objects.bulk_create(
+        [MessageDeliveryStats(**row) for row in rows], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0007_notificationuser_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageDeliveryStats',
+            fields=[
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='delivery_stats', serialize=False, to='notifications.notificationmessage')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('success', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('email', models.PositiveIntegerField(default=0)),
+                ('sms', models.PositiveIntegerField(default=0)),
+                ('telegram', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Статистика доставки',
+                'verbose_name_plural': 'Статистика доставки',
+            },
+        ),
+        migrations.RunPython(fill_delivery_stats, migrations.RunPython.noop),
+    ]
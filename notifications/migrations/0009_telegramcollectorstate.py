@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0008_messagedeliverystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramCollectorState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_update_id', models.BigIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Состояние сбора Telegram',
+                'verbose_name_plural': 'Состояние сбора Telegram',
+            },
+        ),
+    ]
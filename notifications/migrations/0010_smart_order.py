@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_channel_preferences(apps, schema_editor):
+    """Успешные доставки из логов (неудачные попытки в логах не различаются по каналам)"""
+    NotificationLog = apps.get_model('notifications', 'NotificationLog')
+    UserChannelPreference = apps.get_model('notifications', 'UserChannelPreference')
+    preferences = {}
+    rows = (
+        NotificationLog.objects.filter(status='success', delivery_method__in=['email', 'sms', 'telegram'])
+        .values('user_id', 'delivery_method').order_by('user_id').annotate(count=models.Count('id'))
+    )
+    for row in rows.iterator():
+        preference = preferences.setdefault(row['user_id'], UserChannelPreference(user_id=row['user_id']))
+        setattr(preference, f"{row['delivery_method']}_success", row['count'])
+    UserChannelPreference.objects.bulk_create(preferences.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0009_telegramcollectorstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserChannelPreference',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='channel_preference', serialize=False, to='notifications.notificationuser')),
+                ('email_success', models.PositiveIntegerField(default=0)),
+                ('email_failed', models.PositiveIntegerField(default=0)),
+                ('sms_success', models.PositiveIntegerField(default=0)),
+                ('sms_failed', models.PositiveIntegerField(default=0)),
+                ('telegram_success', models.PositiveIntegerField(default=0)),
+                ('telegram_failed', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Каналы пользователя',
+                'verbose_name_plural': 'Каналы пользователей',
+            },
+        ),
+        migrations.AddField(
+            model_name='notificationmessage',
+            name='smart_order',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(fill_channel_preferences, migrations.RunPython.noop),
+    ]
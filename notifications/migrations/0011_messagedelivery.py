@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0010_smart_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('in_flight', 'Отправляется'), ('done', 'Доставлено'), ('failed', 'Не доставлено')], default='pending', max_length=20)),
+                ('delivery_method', models.CharField(blank=True, max_length=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='notifications.notificationmessage')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='notifications.notificationuser')),
+            ],
+            options={
+                'verbose_name': 'Доставка сообщения',
+                'verbose_name_plural': 'Доставки сообщений',
+                'indexes': [models.Index(fields=['message', 'status', 'user'], name='notif_delivery_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('message', 'user'), name='notif_delivery_unique')],
+            },
+        ),
+    ]
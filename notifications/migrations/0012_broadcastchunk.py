@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0011_messagedelivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BroadcastChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('user_ids', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('leased', 'В работе'), ('done', 'Обработан')], default='pending', max_length=20)),
+                ('lease_owner', models.CharField(blank=True, max_length=200)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='notifications.notificationmessage')),
+            ],
+            options={
+                'verbose_name': 'Пакет рассылки',
+                'verbose_name_plural': 'Пакеты рассылок',
+                'indexes': [models.Index(fields=['status', 'lease_expires_at'], name='notif_chunk_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('message', 'index'), name='notif_chunk_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:00
+
+from django.db import migrations, models
+
+
+# Код страны для номеров без него на момент миграции (PHONE_DEFAULT_COUNTRY_CODE)
+DEFAULT_COUNTRY_CODE = '7'
+
+
+def normalize_phone(phone):
+    """Копия NotificationUser.normalize_phone на момент миграции"""
+    phone = (phone or '').strip()
+    digits = ''.join(ch for ch in phone if ch.isdigit())
+    if not digits:
+        return ''
+    if phone.startswith('+'):
+        # Уже в международном формате
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif len(digits) == 11 and digits.startswith('8') and DEFAULT_COUNTRY_CODE == '7':
+        digits = f"7{digits[1:]}"
+    elif len(digits) == 10:
+        digits = f"{DEFAULT_COUNTRY_CODE}{digits}"
+    # В E.164 не больше 15 цифр: более длинная строка - не номер телефона
+    if not digits or len(digits) > 15:
+        return ''
+    return f"+{digits}"
+
+
+def fill_phone_e164(apps, schema_editor):
+    NotificationUser = apps.get_model('notifications', 'NotificationUser')
+    last_id = 0
+    while True:
+        users = list(
+            NotificationUser.objects.filter(id__gt=last_id).order_by('id').only('id', 'phone')[:1000]
+        )
+        if not users:
+            break
+        for user in users:
+            user.phone_e164 = normalize_phone(user.phone)
+        NotificationUser.objects.bulk_update(users, ['phone_e164'])
+        last_id = users[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0012_broadcastchunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationuser',
+            name='phone_e164',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20),
+        ),
+        migrations.RunPython(fill_phone_e164, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0013_notificationuser_phone_e164'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelCircuitState',
+            fields=[
+                ('channel', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('state', models.CharField(choices=[('closed', 'Работает'), ('open', 'Отключен'), ('half_open', 'Проверка')], default='closed', max_length=10)),
+                ('reason', models.CharField(blank=True, max_length=200)),
+                ('opened_until', models.DateTimeField(blank=True, null=True)),
+                ('changed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Состояние канала доставки',
+                'verbose_name_plural': 'Состояния каналов доставки',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0014_channelcircuitstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramWebhookUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('update_id', models.BigIntegerField(unique=True)),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Обновление Telegram',
+                'verbose_name_plural': 'Обновления Telegram',
+            },
+        ),
+    ]
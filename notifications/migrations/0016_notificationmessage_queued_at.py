@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0015_telegramwebhookupdate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationmessage',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
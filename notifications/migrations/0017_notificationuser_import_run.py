@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0016_notificationmessage_queued_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationuser',
+            name='import_run',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
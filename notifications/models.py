@@ -1,6 +1,11 @@
-from django.db import models
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models.functions import Lower, Trim
 from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
+from datetime import timedelta
+import hashlib
 import json
 
 
@@ -22,18 +27,86 @@ class NotificationUser(models.Model):
     email = models.EmailField()
     phone = models.CharField(max_length=20)
     telegram = models.CharField(max_length=100)
+    # Нормализованный username (без @, в нижнем регистре) для поиска одним сравнением по индексу
+    telegram_username = models.CharField(max_length=100, blank=True, db_index=True, editable=False)
     telegram_chat_id = models.BigIntegerField(null=True, blank=True)  # Автоматически собираемый chat_id
+    # Телефон в формате E.164 - по нему одинаковые номера разных пользователей получают одно SMS
+    phone_e164 = models.CharField(max_length=20, blank=True, db_index=True, editable=False)
     group = models.ForeignKey(UserGroup, on_delete=models.CASCADE, related_name='users')
     is_active = models.BooleanField(default=True)
+    # Отпечаток импортируемых полей: импорт пропускает пользователей, у которых он не изменился
+    import_hash = models.CharField(max_length=64, blank=True, editable=False)
+    # Последний полный импорт, в файле которого был пользователь: остальных он деактивирует
+    import_run = models.CharField(max_length=32, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"User {self.external_id} ({self.email})"
     
+    @staticmethod
+    def normalize_telegram(telegram: str) -> str:
+        """Username Telegram без @ и без учета регистра, как его сравнивает Telegram"""
+        return (telegram or '').strip().lstrip('@').lower()
+    
+    @staticmethod
+    def normalize_email(email: str) -> str:
+        """Email без учета регистра"""
+        return (email or '').strip().lower()
+    
+    @staticmethod
+    def normalize_phone(phone: str) -> str:
+        """
+        Телефон в формате E.164 (+79001234567)
+        
+        Номера без кода страны (8XXXXXXXXXX или 10 цифр) считаются номерами
+        страны PHONE_DEFAULT_COUNTRY_CODE. Если в номере больше 15 цифр,
+        возвращается пустая строка.
+        """
+        phone = (phone or '').strip()
+        digits = ''.join(ch for ch in phone if ch.isdigit())
+        if not digits:
+            return ''
+        
+        country_code = getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', '7')
+        if phone.startswith('+'):
+            # Уже в международном формате
+            pass
+        elif digits.startswith('00'):
+            digits = digits[2:]
+        elif len(digits) == 11 and digits.startswith('8') and country_code == '7':
+            digits = f"7{digits[1:]}"
+        elif len(digits) == 10:
+            digits = f"{country_code}{digits}"
+        # В E.164 не больше 15 цифр: более длинная строка - не номер телефона
+        if not digits or len(digits) > 15:
+            return ''
+        return f"+{digits}"
+    
+    @staticmethod
+    def make_import_hash(email, phone, telegram, group_id) -> str:
+        """Отпечаток полей, которые приходят из импорта"""
+        payload = json.dumps([email, phone, telegram, group_id], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def save(self, *args, **kwargs):
+        self.telegram_username = self.normalize_telegram(self.telegram)
+        self.phone_e164 = self.normalize_phone(self.phone)
+        self.import_hash = self.make_import_hash(self.email, self.phone, self.telegram, self.group_id)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'telegram_username', 'phone_e164', 'import_hash'}
+        super().save(*args, **kwargs)
+    
     class Meta:
         verbose_name = "Пользователь уведомлений"
         verbose_name_plural = "Пользователи уведомлений"
+        indexes = [
+            # Получатели рассылки по группам: group_id IN (...) AND is_active=True
+            models.Index(fields=['group', 'is_active'], name='notif_user_group_active_idx'),
+            # Получатели рассылки всем: только активные, в порядке id (нарезка на пакеты)
+            models.Index(fields=['id'], condition=models.Q(is_active=True), name='notif_user_active_idx'),
+        ]
 
 
 class NotificationMessage(models.Model):
@@ -48,14 +121,128 @@ class NotificationMessage(models.Model):
     target_groups = models.ManyToManyField(UserGroup, blank=True)
     send_to_all = models.BooleanField(default=False)
     delivery_methods = models.JSONField(default=list)  # ['email', 'sms', 'telegram']
+    # Порядок способов доставки для каждого пользователя по истории успешных доставок
+    smart_order = models.BooleanField(default=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     sent_at = models.DateTimeField(null=True, blank=True)
     is_sent = models.BooleanField(default=False)
+    # Когда рассылка принята к отправке (пакеты готовятся задачей plan_broadcast)
+    queued_at = models.DateTimeField(null=True, blank=True)
+    # Прогресс фоновой рассылки: сколько пакетов поставлено в очередь и сколько обработано
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_done = models.PositiveIntegerField(default=0)
+    # Каталог NDJSON лога доставки и количество записей в нем
+    log_path = models.CharField(max_length=500, blank=True)
+    log_records = models.PositiveIntegerField(default=0)
     
     def __str__(self):
         return f"{self.title} ({self.created_at})"
     
+    @property
+    def is_sending(self):
+        """Рассылка поставлена в очередь, но ещё не завершена"""
+        return (self.chunks_total > 0 or self.queued_at is not None) and not self.is_sent
+    
+    @property
+    def is_planning(self):
+        """Рассылка принята, но получатели еще не разбиты на пакеты"""
+        return self.queued_at is not None and self.chunks_total == 0 and not self.is_sent
+    
+    @staticmethod
+    def stalled_before():
+        """Рассылка, не продвигавшаяся с этого момента, считается прерванной"""
+        return timezone.now() - timedelta(seconds=getattr(settings, 'DELIVERY_IN_FLIGHT_TIMEOUT', 600))
+    
+    @staticmethod
+    def last_activity_subquery():
+        """Время последнего изменения необработанных пакетов рассылки (для annotate)"""
+        return models.Subquery(
+            BroadcastChunk.objects.filter(message=models.OuterRef('pk'))
+            .exclude(status=BroadcastChunk.DONE)
+            .order_by('-updated_at').values('updated_at')[:1]
+        )
+    
+    @property
+    def is_stalled(self):
+        """
+        Рассылка не завершена и ни один ее пакет не менялся дольше
+        DELIVERY_IN_FLIGHT_TIMEOUT: воркер упал или задачи потеряны.
+        Берет аннотацию last_activity (см. last_activity_subquery), если она есть.
+        """
+        if not self.is_sending:
+            return False
+        if self.is_planning:
+            # Пакетов еще нет: прервана, если задача plan_broadcast не закончила вовремя
+            return self.queued_at < self.stalled_before()
+        if hasattr(self, 'last_activity'):
+            last_activity = self.last_activity
+        else:
+            last_activity = NotificationMessage.objects.filter(id=self.id).annotate(
+                last_activity=self.last_activity_subquery()
+            ).values_list('last_activity', flat=True).first()
+        return last_activity is None or last_activity < self.stalled_before()
+    
+    @property
+    def stats(self):
+        """Счетчики доставки (MessageDeliveryStats) или None, если логов еще нет"""
+        try:
+            return self.delivery_stats
+        except ObjectDoesNotExist:
+            return None
+    
+    def get_delivery_progress(self):
+        """Количество получателей рассылки в каждом состоянии MessageDelivery"""
+        rows = self.deliveries.values('status').annotate(count=models.Count('id')).order_by()
+        progress = {status: 0 for status, _ in MessageDelivery.STATUS_CHOICES}
+        progress.update({row['status']: row['count'] for row in rows})
+        return progress
+    
+    def get_target_users(self):
+        """Активные пользователи, которым адресовано сообщение"""
+        users = NotificationUser.objects.filter(is_active=True)
+        if not self.send_to_all:
+            users = users.filter(group__in=self.target_groups.all())
+        return users
+    
+    def get_audience_stats(self):
+        """
+        Сводка по получателям, посчитанная в базе
+        
+        Returns:
+            (итоги, список итогов по группам) - в каждом total и количество
+            получателей с заполненными email, phone и telegram_chat_id.
+            В итогах также duplicates: сколько отправок по каждому каналу
+            не понадобится, потому что адрес повторяется у нескольких получателей
+            (адреса сравниваются так же, как при отправке), и duplicates_total -
+            сумма по способам доставки сообщения
+        """
+        counters = {
+            'total': models.Count('id'),
+            'email': models.Count('id', filter=~models.Q(email='')),
+            'phone': models.Count('id', filter=~models.Q(phone='')),
+            'telegram': models.Count('id', filter=models.Q(telegram_chat_id__isnull=False)),
+        }
+        groups = list(
+            self.get_target_users().values('group_id', 'group__name')
+            .annotate(**counters).order_by('group__name')
+        )
+        # У каждого пользователя есть группа, поэтому итоги - сумма по группам
+        totals = {field: sum(group[field] for group in groups) for field in counters}
+        
+        # Уникальные адреса считаются по всей аудитории: повторы бывают и между группами
+        unique = self.get_target_users().aggregate(
+            email=models.Count(Lower(Trim('email')), distinct=True, filter=~models.Q(email='')),
+            phone=models.Count('phone_e164', distinct=True, filter=~models.Q(phone_e164='')),
+            telegram=models.Count('telegram_chat_id', distinct=True),
+        )
+        totals['duplicates'] = {field: totals[field] - count for field, count in unique.items()}
+        channels = {'email': 'email', 'sms': 'phone', 'telegram': 'telegram'}
+        totals['duplicates_total'] = sum(
+            totals['duplicates'][channels[method]] for method in self.delivery_methods if method in channels
+        )
+        return totals, groups
+    
     class Meta:
         verbose_name = "Сообщение уведомления"
         verbose_name_plural = "Сообщения уведомлений"
@@ -89,3 +276,533 @@ class NotificationLog(models.Model):
         verbose_name = "Лог уведомления"
         verbose_name_plural = "Логи уведомлений"
         ordering = ['-sent_at']
+        # Индексы под keyset пагинацию логов (sent_at, id) с фильтрами и выборки по сообщению
+        indexes = [
+            models.Index(fields=['sent_at', 'id'], name='notif_log_sent_idx'),
+            models.Index(fields=['status', 'sent_at', 'id'], name='notif_log_status_sent_idx'),
+            models.Index(fields=['delivery_method', 'sent_at', 'id'], name='notif_log_method_sent_idx'),
+            models.Index(fields=['message', 'status'], name='notif_log_message_status_idx'),
+        ]
+
+
+class MessageDeliveryStats(models.Model):
+    """
+    Счетчики доставки сообщения
+    
+    Обновляются инкрементально при записи логов (см. NotificationLogBuffer),
+    поэтому статус сообщений показывается без агрегации NotificationLog.
+    Каждый получатель учитывается один раз, по своему последнему логу:
+    повторная отправка (resume_broadcast с retry_failed) заменяет вклад
+    прежнего лога, а не добавляет к нему.
+    Пересчитать по логам: manage.py rebuild_delivery_stats
+    """
+    CHANNELS = [method for method, _ in NotificationLog.DELIVERY_METHOD_CHOICES]
+    
+    message = models.OneToOneField(
+        NotificationMessage, on_delete=models.CASCADE, primary_key=True, related_name='delivery_stats'
+    )
+    total = models.PositiveIntegerField(default=0)
+    success = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # Сколько получателей доставлено (или не доставлено) через каждый канал
+    email = models.PositiveIntegerField(default=0)
+    sms = models.PositiveIntegerField(default=0)
+    telegram = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.message_id}: {self.success}/{self.total}"
+    
+    @staticmethod
+    def count_logs(logs, sign: int = 1, counters: dict = None) -> dict:
+        """Счетчики по списку логов: {message_id: {поле: количество}}"""
+        counters = {} if counters is None else counters
+        for log in logs:
+            counter = counters.setdefault(log.message_id, {'total': 0, 'success': 0, 'failed': 0})
+            counter['total'] += sign
+            if log.status in ('success', 'failed'):
+                counter[log.status] += sign
+            if log.delivery_method in MessageDeliveryStats.CHANNELS:
+                counter[log.delivery_method] = counter.get(log.delivery_method, 0) + sign
+        return counters
+    
+    @classmethod
+    def add_logs(cls, logs):
+        """
+        Учесть в счетчиках новые логи (одно UPDATE на сообщение)
+        
+        Вызывается до записи logs в базу: прежние логи тех же получателей
+        вычитаются из счетчиков, чтобы каждый получатель учитывался один раз.
+        """
+        # Внутри пакета у получателя учитывается последний лог
+        latest = {(log.message_id, log.user_id): log for log in logs}
+        counters = cls.count_logs(latest.values())
+        if not counters:
+            return
+        
+        for message_id in counters:
+            user_ids = [user_id for log_message_id, user_id in latest if log_message_id == message_id]
+            previous = {}
+            for log in (
+                NotificationLog.objects.filter(message_id=message_id, user_id__in=user_ids)
+                .order_by('id').only('message_id', 'user_id', 'status', 'delivery_method')
+            ):
+                previous[log.user_id] = log
+            cls.count_logs(previous.values(), sign=-1, counters=counters)
+        
+        cls.objects.bulk_create(
+            [cls(message_id=message_id) for message_id in counters], ignore_conflicts=True
+        )
+        now = timezone.now()
+        for message_id, counter in counters.items():
+            cls.objects.filter(message_id=message_id).update(
+                updated_at=now,
+                **{field: models.F(field) + value for field, value in counter.items() if value}
+            )
+    
+    @classmethod
+    def rebuild(cls, message_ids=None) -> int:
+        """Пересчитать счетчики по последним логам получателей. Returns количество сообщений"""
+        logs = NotificationLog.objects.all()
+        stats = cls.objects.all()
+        if message_ids is not None:
+            logs = logs.filter(message_id__in=message_ids)
+            stats = stats.filter(message_id__in=message_ids)
+        
+        latest_ids = logs.values('message_id', 'user_id').order_by().annotate(
+            latest_id=models.Max('id')
+        ).values('latest_id')
+        logs = NotificationLog.objects.filter(id__in=latest_ids)
+        
+        rows = logs.values('message_id').order_by('message_id').annotate(
+            total=models.Count('id'),
+            success=models.Count('id', filter=models.Q(status='success')),
+            failed=models.Count('id', filter=models.Q(status='failed')),
+            **{
+                channel: models.Count('id', filter=models.Q(delivery_method=channel))
+                for channel in cls.CHANNELS
+            }
+        )
+        objects = [cls(updated_at=timezone.now(), **row) for row in rows]
+        
+        # Сообщения без логов не должны сохранять старые счетчики
+        stats.exclude(message_id__in=[obj.message_id for obj in objects]).delete()
+        cls.objects.bulk_create(
+            objects,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['message'],
+            update_fields=['total', 'success', 'failed', *cls.CHANNELS, 'updated_at'],
+        )
+        return len(objects)
+    
+    class Meta:
+        verbose_name = "Статистика доставки"
+        verbose_name_plural = "Статистика доставки"
+
+
+class MessageDelivery(models.Model):
+    """
+    Состояние доставки сообщения одному получателю
+    
+    Строки создаются для всех получателей при постановке рассылки в очередь.
+    Пакет переводит своих получателей в in_flight перед отправкой и в done
+    или failed сразу после нее, поэтому после падения процесса видно, кому
+    сообщение уже доставлено, и рассылку можно продолжить (resume_broadcast).
+    """
+    PENDING = 'pending'
+    IN_FLIGHT = 'in_flight'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает'),
+        (IN_FLIGHT, 'Отправляется'),
+        (DONE, 'Доставлено'),
+        (FAILED, 'Не доставлено'),
+    ]
+    
+    message = models.ForeignKey(NotificationMessage, on_delete=models.CASCADE, related_name='deliveries')
+    user = models.ForeignKey(NotificationUser, on_delete=models.CASCADE, related_name='deliveries')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    delivery_method = models.CharField(max_length=20, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.message_id} -> {self.user_id}: {self.status}"
+    
+    @classmethod
+    def create_for(cls, message_id: int, user_ids, batch_size: int = 1000):
+        """
+        Создать ожидающие доставки для получателей рассылки
+        
+        Каждый пакет строк записывается своей транзакцией, чтобы не держать
+        блокировку записи на всю аудиторию; повторный вызов пропускает
+        уже созданные строки.
+        """
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), batch_size):
+            cls.objects.bulk_create(
+                [cls(message_id=message_id, user_id=user_id) for user_id in user_ids[start:start + batch_size]],
+                ignore_conflicts=True,
+            )
+    
+    @classmethod
+    def claim(cls, message_id: int, user_ids) -> list:
+        """
+        Перевести ожидающих получателей в in_flight
+        
+        Returns:
+            id пользователей, которых можно отправлять
+        """
+        pending = cls.objects.filter(message_id=message_id, user_id__in=user_ids, status=cls.PENDING)
+        with transaction.atomic():
+            if not connection.features.has_select_for_update:
+                # SQLite: транзакция начинается с записи, чтобы сразу взять блокировку записи.
+                # Переход от чтения к записи при параллельных воркерах дает "database is locked"
+                pending.update(status=cls.PENDING)
+            claimed = list(pending.select_for_update().values_list('user_id', flat=True))
+            if claimed:
+                cls.objects.filter(message_id=message_id, user_id__in=claimed).update(
+                    status=cls.IN_FLIGHT, updated_at=timezone.now()
+                )
+        return claimed
+    
+    @classmethod
+    def record_results(cls, message_id: int, results):
+        """
+        Отметить результаты отправки
+        
+        Args:
+            results: список (user_id, способ доставки, статус лога)
+        
+        Получатели с одинаковым результатом отмечаются одним UPDATE.
+        Отмечаются только получатели в in_flight: результат не затирает
+        состояние, выставленное после них другим воркером.
+        """
+        groups = {}
+        for user_id, method, status in results:
+            state = cls.DONE if status in ('success', 'partial') else cls.FAILED
+            groups.setdefault((state, method if method != 'none' else ''), []).append(user_id)
+        
+        now = timezone.now()
+        for (state, method), user_ids in groups.items():
+            cls.objects.filter(message_id=message_id, user_id__in=user_ids, status=cls.IN_FLIGHT).update(
+                status=state, delivery_method=method, updated_at=now
+            )
+    
+    class Meta:
+        verbose_name = "Доставка сообщения"
+        verbose_name_plural = "Доставки сообщений"
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'user'], name='notif_delivery_unique'),
+        ]
+        indexes = [
+            # Выборка получателей рассылки по состоянию (продолжение, прогресс)
+            models.Index(fields=['message', 'status', 'user'], name='notif_delivery_status_idx'),
+        ]
+
+
+class BroadcastChunk(models.Model):
+    """
+    Пакет получателей рассылки
+    
+    Пакеты создаются в базе при постановке рассылки в очередь и разбираются
+    воркерами (задачами Celery или run_broadcast_workers на любых хостах).
+    Воркер берет пакет в аренду до lease_expires_at; пакет упавшего воркера
+    после истечения аренды берет другой. Повторной отправке получателям
+    мешает MessageDelivery: отправляются только ожидающие получатели.
+    """
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает'),
+        (LEASED, 'В работе'),
+        (DONE, 'Обработан'),
+    ]
+    
+    message = models.ForeignKey(NotificationMessage, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    user_ids = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    lease_owner = models.CharField(max_length=200, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    # Сколько раз пакет брали в работу; служит версией строки при захвате без блокировок
+    attempts = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Рассылка {self.message_id}, пакет {self.index}: {self.status}"
+    
+    @classmethod
+    def create_for(cls, message_id: int, chunks, batch_size: int = 500):
+        """Создать пакеты рассылки (chunks - списки id пользователей)"""
+        cls.objects.bulk_create(
+            (cls(message_id=message_id, index=index, user_ids=user_ids) for index, user_ids in enumerate(chunks)),
+            batch_size=batch_size,
+        )
+    
+    @classmethod
+    def available(cls, now=None):
+        """Пакеты, которые можно взять: ожидающие и с истекшей арендой"""
+        now = now or timezone.now()
+        return cls.objects.filter(
+            models.Q(status=cls.PENDING) | models.Q(status=cls.LEASED, lease_expires_at__lt=now)
+        )
+    
+    @classmethod
+    def _lease(cls, chunks, owner: str, lease_seconds: int) -> int:
+        return chunks.update(
+            status=cls.LEASED,
+            lease_owner=owner,
+            lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds),
+            attempts=models.F('attempts') + 1,
+            updated_at=timezone.now(),
+        )
+    
+    @classmethod
+    def claim(cls, message_id: int, index: int, owner: str, lease_seconds: int):
+        """Взять в аренду конкретный пакет. Returns пакет или None, если его уже взяли"""
+        chunks = cls.available().filter(message_id=message_id, index=index)
+        if not cls._lease(chunks, owner, lease_seconds):
+            return None
+        return cls.objects.get(message_id=message_id, index=index)
+    
+    @classmethod
+    def claim_next(cls, owner: str, lease_seconds: int, message_id: int = None):
+        """
+        Взять в аренду следующий свободный пакет
+        
+        PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED - воркеры не ждут друг друга.
+        SQLite и другие базы без SKIP LOCKED: условный UPDATE по номеру попытки
+        (compare-and-set) - пакет достается тому, чей UPDATE изменил строку.
+        
+        Returns:
+            пакет или None, если свободных пакетов нет
+        """
+        chunks = cls.available()
+        if message_id is not None:
+            chunks = chunks.filter(message_id=message_id)
+        chunks = chunks.order_by('message_id', 'index')
+        
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                chunk = chunks.select_for_update(skip_locked=True).first()
+                if chunk is None:
+                    return None
+                cls._lease(cls.objects.filter(id=chunk.id), owner, lease_seconds)
+            chunk.refresh_from_db()
+            return chunk
+        
+        # Кандидатов несколько: пока один воркер пробует первый, другие берут следующие
+        for chunk_id, attempts in chunks.values_list('id', 'attempts')[:10]:
+            if cls._lease(cls.available().filter(id=chunk_id, attempts=attempts), owner, lease_seconds):
+                return cls.objects.get(id=chunk_id)
+        return None
+    
+    def renew(self, owner: str, lease_seconds: int) -> bool:
+        """
+        Продлить аренду, пока пакет отправляется
+        
+        Вместе с арендой обновляется время получателей пакета в in_flight:
+        они не считаются зависшими, пока владелец жив.
+        
+        Returns:
+            False, если аренду уже перехватили
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            renewed = BroadcastChunk.objects.filter(id=self.id, status=self.LEASED, lease_owner=owner).update(
+                lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now
+            )
+            if renewed:
+                MessageDelivery.objects.filter(
+                    message_id=self.message_id, user_id__in=self.user_ids, status=MessageDelivery.IN_FLIGHT
+                ).update(updated_at=now)
+        return bool(renewed)
+    
+    def defer(self, owner: str, until) -> bool:
+        """Отложить пакет: другие воркеры смогут взять его только после until"""
+        return bool(
+            BroadcastChunk.objects.filter(id=self.id, status=self.LEASED, lease_owner=owner)
+            .update(lease_owner='', lease_expires_at=until, updated_at=timezone.now())
+        )
+    
+    def complete(self, owner: str) -> bool:
+        """Отметить пакет обработанным. Returns False, если аренду уже перехватили"""
+        return bool(
+            BroadcastChunk.objects.filter(id=self.id, status=self.LEASED, lease_owner=owner)
+            .update(status=self.DONE, lease_expires_at=None, updated_at=timezone.now())
+        )
+    
+    def release(self, owner: str) -> bool:
+        """Вернуть пакет в очередь (ошибка обработки), чтобы его взял другой воркер"""
+        return bool(
+            BroadcastChunk.objects.filter(id=self.id, status=self.LEASED, lease_owner=owner)
+            .update(status=self.PENDING, lease_owner='', lease_expires_at=None, updated_at=timezone.now())
+        )
+    
+    class Meta:
+        verbose_name = "Пакет рассылки"
+        verbose_name_plural = "Пакеты рассылок"
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'index'], name='notif_chunk_unique'),
+        ]
+        indexes = [
+            # Поиск свободных пакетов воркерами
+            models.Index(fields=['status', 'lease_expires_at'], name='notif_chunk_status_idx'),
+        ]
+
+
+class TelegramCollectorState(models.Model):
+    """Состояние сбора chat_id: номер последнего обработанного обновления Telegram"""
+    last_update_id = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    # Состояние хранится в единственной строке
+    SINGLETON_ID = 1
+    
+    def __str__(self):
+        return f"Последнее обновление: {self.last_update_id}"
+    
+    @classmethod
+    def load(cls) -> 'TelegramCollectorState':
+        state, _ = cls.objects.get_or_create(id=cls.SINGLETON_ID)
+        return state
+    
+    @classmethod
+    def save_offset(cls, update_id: int):
+        """Запомнить обработанное обновление (номер только растет)"""
+        cls.objects.get_or_create(id=cls.SINGLETON_ID)
+        cls.objects.filter(
+            models.Q(last_update_id__isnull=True) | models.Q(last_update_id__lt=update_id),
+            id=cls.SINGLETON_ID,
+        ).update(last_update_id=update_id, updated_at=timezone.now())
+    
+    class Meta:
+        verbose_name = "Состояние сбора Telegram"
+        verbose_name_plural = "Состояние сбора Telegram"
+
+
+class TelegramWebhookUpdate(models.Model):
+    """
+    Обновление Telegram, принятое webhook и еще не обработанное
+    
+    Строка сохраняется до ответа Telegram, поэтому обновление не теряется,
+    если процесс упадет до обработки; после обработки строка удаляется.
+    """
+    update_id = models.BigIntegerField(unique=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Обновление {self.update_id}"
+    
+    class Meta:
+        verbose_name = "Обновление Telegram"
+        verbose_name_plural = "Обновления Telegram"
+
+
+class ChannelCircuitState(models.Model):
+    """
+    Общее состояние выключателя канала доставки (см. circuit.py)
+    
+    Одна строка на канал: ее читают и пишут все процессы (воркеры Celery,
+    воркеры рассылок, веб-интерфейс), поэтому отключение канала в одном
+    процессе сразу видят остальные.
+    """
+    STATES = [
+        ('closed', 'Работает'),
+        ('open', 'Отключен'),
+        ('half_open', 'Проверка'),
+    ]
+    
+    channel = models.CharField(max_length=20, primary_key=True)
+    state = models.CharField(max_length=10, choices=STATES, default='closed')
+    reason = models.CharField(max_length=200, blank=True)
+    opened_until = models.DateTimeField(null=True, blank=True)
+    changed_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.channel}: {self.state}"
+    
+    class Meta:
+        verbose_name = "Состояние канала доставки"
+        verbose_name_plural = "Состояния каналов доставки"
+
+
+class UserChannelPreference(models.Model):
+    """
+    История доставок пользователю по каналам
+    
+    Одна строка на пользователя: сколько попыток через каждый канал удалось и
+    не удалось. Счетчики увеличиваются после каждой отправки, а в режиме
+    smart_order по ним выбирается порядок fallback для пользователя.
+    """
+    CHANNELS = ['email', 'sms', 'telegram']
+    
+    user = models.OneToOneField(
+        NotificationUser, on_delete=models.CASCADE, primary_key=True, related_name='channel_preference'
+    )
+    email_success = models.PositiveIntegerField(default=0)
+    email_failed = models.PositiveIntegerField(default=0)
+    sms_success = models.PositiveIntegerField(default=0)
+    sms_failed = models.PositiveIntegerField(default=0)
+    telegram_success = models.PositiveIntegerField(default=0)
+    telegram_failed = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Каналы пользователя {self.user_id}"
+    
+    def success_rate(self, channel: str) -> float:
+        """Оценка вероятности доставки через канал (без истории - 0.5)"""
+        success = getattr(self, f"{channel}_success", 0)
+        failed = getattr(self, f"{channel}_failed", 0)
+        return (success + 1) / (success + failed + 2)
+    
+    def order(self, methods):
+        """Способы доставки по убыванию вероятности успеха (при равенстве - исходный порядок)"""
+        return sorted(methods, key=lambda method: -self.success_rate(method))
+    
+    @classmethod
+    def record_attempts(cls, attempts):
+        """
+        Прибавить к счетчикам результаты попыток доставки
+        
+        Args:
+            attempts: список (user_id, канал, успех)
+        
+        Пользователи с одинаковым набором приращений обновляются одним UPDATE,
+        поэтому число запросов зависит от числа сочетаний, а не пользователей.
+        """
+        increments = {}
+        for user_id, channel, success in attempts:
+            if channel not in cls.CHANNELS:
+                continue
+            field = f"{channel}_{'success' if success else 'failed'}"
+            counter = increments.setdefault(user_id, {})
+            counter[field] = counter.get(field, 0) + 1
+        if not increments:
+            return
+        
+        cls.objects.bulk_create(
+            [cls(user_id=user_id) for user_id in increments], ignore_conflicts=True
+        )
+        
+        groups = {}
+        for user_id, counter in increments.items():
+            groups.setdefault(tuple(sorted(counter.items())), []).append(user_id)
+        
+        now = timezone.now()
+        for counter, user_ids in groups.items():
+            cls.objects.filter(user_id__in=user_ids).update(
+                updated_at=now,
+                **{field: models.F(field) + value for field, value in counter}
+            )
+    
+    class Meta:
+        verbose_name = "Каналы пользователя"
+        verbose_name_plural = "Каналы пользователей"
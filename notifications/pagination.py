@@ -0,0 +1,116 @@
+import base64
+import hashlib
+from datetime import datetime
+from typing import Optional, Tuple
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+
+
+def encode_cursor(sent_at: datetime, pk: int) -> str:
+    """Курсор страницы: позиция записи в порядке (sent_at, id)"""
+    raw = f"{sent_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> Optional[Tuple[datetime, int]]:
+    """Разобрать курсор, None если он поврежден"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        sent_at, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(sent_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """
+    Страница keyset пагинации по (sent_at, id) от новых к старым
+
+    В отличие от Paginator не выполняет COUNT(*) и OFFSET: страница
+    выбирается условием по ключу последней записи, поэтому глубокие страницы
+    стоят столько же, сколько первая.
+    """
+
+    def __init__(self, object_list, has_next: bool, has_previous: bool):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    @property
+    def next_cursor(self) -> str:
+        last = self.object_list[-1]
+        return encode_cursor(last.sent_at, last.pk)
+
+    @property
+    def previous_cursor(self) -> str:
+        first = self.object_list[0]
+        return encode_cursor(first.sent_at, first.pk)
+
+    def has_other_pages(self) -> bool:
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_paginate(queryset, per_page: int, after: str = None, before: str = None) -> KeysetPage:
+    """
+    Выбрать страницу записей с полями sent_at и id
+
+    Args:
+        after: курсор - вернуть записи старше него (следующая страница)
+        before: курсор - вернуть записи новее него (предыдущая страница)
+    """
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before)
+
+    if before_key:
+        sent_at, pk = before_key
+        rows = list(
+            queryset.filter(Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, id__gt=pk))
+            .order_by('sent_at', 'id')[:per_page + 1]
+        )
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        return KeysetPage(rows, has_next=True, has_previous=has_previous)
+
+    queryset = queryset.order_by('-sent_at', '-id')
+    if after_key:
+        sent_at, pk = after_key
+        queryset = queryset.filter(Q(sent_at__lt=sent_at) | Q(sent_at=sent_at, id__lt=pk))
+
+    rows = list(queryset[:per_page + 1])
+    return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=bool(after_key))
+
+
+def estimated_count(queryset, cache_key: str, timeout: int = 60) -> int:
+    """
+    Количество записей для отображения без COUNT(*) на каждый запрос
+
+    Для всей таблицы в PostgreSQL берется оценка планировщика (pg_class),
+    иначе точное значение кэшируется на timeout секунд.
+    """
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+
+    key = 'count:' + hashlib.md5(cache_key.encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
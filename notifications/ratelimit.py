@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не более capacity накопленных"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class TelegramRateLimiter:
+    """
+    Ограничитель частоты отправки в Telegram
+
+    Суммарная скорость бота и пауза после ответа 429 (retry_after) общие
+    для всех процессов и хранятся в кэше Django: счетчик отправок
+    увеличивается атомарным incr в окне текущей секунды, и в окно попадает
+    не больше global_rate отправок. Чтобы лимит действовал на все воркеры
+    Celery, CACHES должен быть общим (Redis, Memcached) - с LocMemCache
+    каждый процесс считает только свои отправки.
+
+    Корзины по chat_id (скорость отправки в один чат) хранятся в процессе:
+    получатели пакета рассылки принадлежат одному воркеру (см. BroadcastChunk).
+    Ограничитель потокобезопасен; из корутин используйте acquire_async.
+    """
+
+    CACHE_PREFIX = 'telegram_rate'
+
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1, max_chats: int = 10000):
+        self.global_limit = max(int(global_rate), 1)
+        self.per_chat_rate = per_chat_rate
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def _pause_key(self) -> str:
+        return f"{self.CACHE_PREFIX}:paused_until"
+
+    def _take_global_slot(self, now: float) -> float:
+        """Занять место в окне текущей секунды или вернуть время до следующего окна"""
+        window = int(now)
+        key = f"{self.CACHE_PREFIX}:{window}"
+        cache.add(key, 0, 2)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # Ключ истек между add и incr - окно уже прошло
+            return 0.0 if cache.add(key, 1, 2) else window + 1 - now
+        if count <= self.global_limit:
+            return 0.0
+        return window + 1 - now
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, capacity=1)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _try_acquire(self, chat_id) -> float:
+        """Забрать токены или вернуть время ожидания в секундах"""
+        now = time.time()
+        paused_until = cache.get(self._pause_key, 0.0)
+        if paused_until > now:
+            return paused_until - now
+
+        with self._lock:
+            chat_bucket = self._chat_bucket(chat_id)
+            wait = chat_bucket.delay(time.monotonic())
+            if wait > 0:
+                return wait
+
+            # Общий счетчик проверяем последним: занятое место не возвращается
+            wait = self._take_global_slot(now)
+            if wait > 0:
+                return wait
+
+            chat_bucket.consume()
+            return 0.0
+
+    def acquire(self, chat_id):
+        """Дождаться разрешения на отправку в chat_id (блокирует поток)"""
+        while True:
+            wait = self._try_acquire(chat_id)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, chat_id):
+        """Дождаться разрешения на отправку в chat_id без блокировки event loop"""
+        while True:
+            wait = self._try_acquire(chat_id)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Приостановить все отправки всех процессов (ответ 429 с retry_after)"""
+        paused_until = time.time() + seconds
+        if paused_until > cache.get(self._pause_key, 0.0):
+            cache.set(self._pause_key, paused_until, int(seconds) + 1)
+
+
+# Глобальный ограничитель для всех отправок в Telegram
+telegram_rate_limiter = TelegramRateLimiter(
+    global_rate=getattr(settings, 'TELEGRAM_GLOBAL_RATE_LIMIT', 30),
+    per_chat_rate=getattr(settings, 'TELEGRAM_PER_CHAT_RATE_LIMIT', 1),
+)
@@ -1,30 +1,45 @@
 import smtplib
 import json
 import logging
-import requests
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from django.conf import settings
+from django.core.cache import cache
 from telegram import Bot
 from telegram.error import TelegramError
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import asyncio
-from datetime import datetime
+import requests
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import queue
 import threading
 import time
 
+from .circuit import ProviderError, call_outcome, get_circuit_breaker
+from .http_client import get_http_session, get_provider_settings
+from .ratelimit import telegram_rate_limiter
+
 
 logger = logging.getLogger(__name__)
 
 
 class TelegramChatIdCollector:
-    """Сервис для автоматического сбора chat_id пользователей"""
+    """
+    Сервис для автоматического сбора chat_id пользователей
+    
+    Обновления читаются long polling запросами getUpdates: запрос ждет новых
+    сообщений до poll_timeout секунд. Номер последнего обработанного
+    обновления хранится в базе (TelegramCollectorState), поэтому после
+    перезапуска сбор продолжается с того же места. chat_id из пакета
+    обновлений записываются одним bulk_update.
+    """
     
     def __init__(self):
         self.bot_token = getattr(settings, 'TELEGRAM_BOT_TOKEN', '')
+        self.poll_timeout = getattr(settings, 'TELEGRAM_POLL_TIMEOUT', 30)
         self.running = False
         self.thread = None
-        self.last_update_id = None
     
     def start_collecting(self):
         """Запустить сбор chat_id в фоновом режиме"""
@@ -37,7 +52,7 @@ class TelegramChatIdCollector:
         logger.info("Telegram chat_id collector запущен")
     
     def stop_collecting(self):
-        """Остановить сбор"""
+        """Остановить сбор (текущий long polling запрос может завершиться позже)"""
         self.running = False
         if self.thread:
             self.thread.join(timeout=5)
@@ -47,76 +62,175 @@ class TelegramChatIdCollector:
         """Основной цикл сбора обновлений"""
         while self.running:
             try:
-                self._process_updates()
-                time.sleep(5)  # Проверяем каждые 5 секунд
+                # Запрос сам ждет новых сообщений, пауза между запросами не нужна
+                if self._process_updates(self.poll_timeout) is None:
+                    time.sleep(10)  # Telegram недоступен - ждем дольше
             except Exception as e:
                 logger.error(f"Ошибка в сборе chat_id: {e}")
                 time.sleep(10)  # При ошибке ждем дольше
+            finally:
+                # Поток живет долго: не держим соединение с базой между запросами
+                from django.db import close_old_connections
+                close_old_connections()
     
-    def _process_updates(self):
-        """Обработать новые сообщения"""
+    def _process_updates(self, timeout: int = 0) -> Optional[int]:
+        """
+        Получить и обработать новые сообщения
+        
+        Если Telegram недоступен или ответил ошибкой, сохраненный номер
+        обновления не меняется: те же обновления будут получены повторно.
+        
+        Args:
+            timeout: сколько секунд Telegram ждет новых сообщений (0 - ответить сразу)
+        
+        Returns:
+            количество полученных обновлений или None, если получить их не удалось
+        """
+        from .models import TelegramCollectorState
+        
+        url = f"https://api.telegram.org/bot{self.bot_token}/getUpdates"
+        params = {
+            'timeout': timeout,
+            'allowed_updates': json.dumps(['message']),
+        }
+        
+        state = TelegramCollectorState.load()
+        if state.last_update_id is not None:
+            params['offset'] = state.last_update_id + 1
+        
+        provider = get_provider_settings('telegram')
         try:
-            url = f"https://api.telegram.org/bot{self.bot_token}/getUpdates"
-            params = {}
-            
-            if self.last_update_id:
-                params['offset'] = self.last_update_id + 1
-            
-            response = requests.get(url, params=params, timeout=10)
-            
-            if response.status_code != 200:
-                return
-            
-            data = response.json()
-            if not data.get('ok'):
-                return
-            
-            updates = data.get('result', [])
-            
-            for update in updates:
-                self.last_update_id = update.get('update_id')
-                self._process_single_update(update)
-                
-        except Exception as e:
-            logger.error(f"Ошибка обработки обновлений: {e}")
+            response = get_http_session('telegram').get(
+                url, params=params,
+                # Ответ на long polling приходит не раньше, чем через timeout секунд
+                timeout=(provider['connect_timeout'], provider['read_timeout'] + timeout),
+            )
+            data = response.json() if response.status_code == 200 else None
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"getUpdates: {e}")
+            return None
+        
+        if data is None:
+            logger.error(f"getUpdates вернул HTTP {response.status_code}")
+            return None
+        
+        if not isinstance(data, dict) or not data.get('ok'):
+            description = data.get('description') if isinstance(data, dict) else None
+            logger.error(f"getUpdates: {description or 'неизвестная ошибка'}")
+            return None
+        
+        updates = [update for update in data.get('result') or [] if isinstance(update, dict)]
+        update_ids = [
+            update['update_id'] for update in updates
+            if isinstance(update.get('update_id'), int) and not isinstance(update['update_id'], bool)
+        ]
+        if updates:
+            self.process_updates(updates)
+        if update_ids:
+            TelegramCollectorState.save_offset(max(update_ids))
+        return len(updates)
     
-    def _process_single_update(self, update):
-        """Обработать одно обновление"""
-        try:
-            if 'message' not in update:
-                return
-            
-            message = update['message']
-            chat = message.get('chat', {})
-            chat_id = chat.get('id')
-            username = chat.get('username', '')
-            
-            if not chat_id:
-                return
-            
-            # Ищем пользователя по username
-            if username:
-                from .models import NotificationUser
-                from django.db import models
-                
-                users = NotificationUser.objects.filter(
-                    models.Q(telegram=f"@{username}") | 
-                    models.Q(telegram=username)
-                )
-                
-                for user in users:
-                    if user.telegram_chat_id != chat_id:
-                        user.telegram_chat_id = chat_id
-                        user.save()
-                        logger.info(f"Обновлен chat_id для {user.external_id}: {chat_id}")
-                        
-        except Exception as e:
-            logger.error(f"Ошибка обработки сообщения: {e}")
+    @staticmethod
+    def _extract_chat(update: Dict):
+        """(username, chat_id) из обновления с сообщением или None"""
+        message = update.get('message') if isinstance(update, dict) else None
+        if not isinstance(message, dict):
+            return None
+        chat = message.get('chat')
+        if not isinstance(chat, dict):
+            return None
+        chat_id = chat.get('id')
+        username = chat.get('username')
+        if isinstance(chat_id, bool) or not isinstance(chat_id, int) or not chat_id:
+            return None
+        if not isinstance(username, str) or not username:
+            return None
+        return username, chat_id
+    
+    def process_updates(self, updates: List[Dict]) -> int:
+        """
+        Записать chat_id пользователей из пакета обновлений
+        
+        Returns:
+            количество пользователей с обновленным chat_id
+        """
+        from .models import NotificationUser
+        
+        # Для каждого username берем chat_id из последнего обновления
+        chat_ids = {}
+        for update in updates:
+            chat = self._extract_chat(update)
+            if chat:
+                username, chat_id = chat
+                chat_ids[NotificationUser.normalize_telegram(username)] = chat_id
+        
+        if not chat_ids:
+            return 0
+        
+        changed = []
+        users = NotificationUser.objects.filter(telegram_username__in=list(chat_ids)).only(
+            'id', 'external_id', 'telegram_username', 'telegram_chat_id'
+        )
+        for user in users:
+            chat_id = chat_ids[user.telegram_username]
+            if user.telegram_chat_id != chat_id:
+                user.telegram_chat_id = chat_id
+                changed.append(user)
+                logger.info(f"Обновлен chat_id для {user.external_id}: {chat_id}")
+        
+        if changed:
+            NotificationUser.objects.bulk_update(changed, ['telegram_chat_id'], batch_size=500)
+        
+        telegram_chat_id_cache.set_many(chat_ids)
+        
+        return len(changed)
+
+
+class TelegramChatIdCache:
+    """
+    Кэш username -> chat_id в кэше Django
+    
+    Используется, когда в TelegramService передан username вместо chat_id.
+    Записи устаревают через ttl секунд. Коллектор и webhook записывают новый
+    chat_id в тот же кэш, поэтому при общем CACHES (Redis, Memcached)
+    воркеры рассылки сразу видят его, а не старое значение из своей памяти.
+    """
+    
+    def __init__(self, ttl: float = 600, prefix: str = 'telegram_chat_id'):
+        self.ttl = ttl
+        self.prefix = prefix
+    
+    def _key(self, username: str) -> str:
+        return f"{self.prefix}:{username.lstrip('@').lower()}"
+    
+    def get(self, username: str):
+        return cache.get(self._key(username))
+    
+    def set(self, username: str, chat_id: int):
+        cache.set(self._key(username), chat_id, self.ttl)
+    
+    def set_many(self, chat_ids: Dict[str, int]):
+        cache.set_many({self._key(username): chat_id for username, chat_id in chat_ids.items()}, self.ttl)
+    
+    def invalidate(self, username: str):
+        cache.delete(self._key(username))
 
 
 # Глобальный экземпляр коллектора
 telegram_collector = TelegramChatIdCollector()
 
+# Кэш chat_id для отправки по username
+telegram_chat_id_cache = TelegramChatIdCache(
+    ttl=getattr(settings, 'TELEGRAM_CHAT_ID_CACHE_TTL', 600),
+)
+
+
+def _http_error(status_code: int, error_msg: str) -> str:
+    """Ответы 5xx и 429 - сбой провайдера, остальные - ошибка запроса для получателя"""
+    if status_code >= 500 or status_code == 429:
+        return ProviderError(error_msg)
+    return error_msg
+
 
 class NotificationService:
     """Базовый класс для сервисов уведомлений"""
@@ -129,12 +243,142 @@ class NotificationService:
         raise NotImplementedError
 
 
+class _PooledSMTPConnection:
+    """SMTP соединение из пула со счетчиком отправленных писем"""
+    
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.sent = 0
+    
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """
+    Пул авторизованных SMTP соединений
+    
+    Соединения остаются открытыми между отправками, поэтому STARTTLS и AUTH
+    выполняются один раз на соединение, а не на каждое письмо. Соединение
+    закрывается после max_messages писем, разорванное соединение
+    переоткрывается автоматически.
+    """
+    
+    # Ошибки, после которых соединение считается разорванным
+    BROKEN_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+    
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 size: int = 5, max_messages: int = 100, timeout: int = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+    
+    def _connect(self) -> _PooledSMTPConnection:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.starttls()
+            server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return _PooledSMTPConnection(server)
+    
+    def _acquire(self) -> _PooledSMTPConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+    
+    def _release(self, conn: _PooledSMTPConnection):
+        if conn.sent >= self.max_messages:
+            conn.close()
+        else:
+            self._idle.put(conn)
+    
+    def _is_broken(self, error: Exception) -> bool:
+        if isinstance(error, self.BROKEN_CONNECTION_ERRORS):
+            return True
+        # 421 - сервер закрывает соединение
+        return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421
+    
+    def send_message(self, msg):
+        """Отправить письмо через свободное соединение пула"""
+        with self._slots:
+            conn = self._acquire()
+            try:
+                conn.server.send_message(msg)
+            except Exception as e:
+                if not self._is_broken(e):
+                    # Письмо отклонено, но соединение рабочее
+                    self._release(conn)
+                    raise
+                
+                logger.info(f"SMTP соединение разорвано ({e}), переподключение")
+                conn.close()
+                conn = self._connect()
+                try:
+                    conn.server.send_message(msg)
+                except Exception as retry_error:
+                    if self._is_broken(retry_error):
+                        conn.close()
+                    else:
+                        self._release(conn)
+                    raise
+            
+            conn.sent += 1
+            self._release(conn)
+    
+    def close_all(self):
+        """Закрыть все простаивающие соединения"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+
+_smtp_pool = None
+_smtp_pool_lock = threading.Lock()
+
+
+def get_smtp_pool() -> SMTPConnectionPool:
+    """Общий для процесса пул SMTP соединений"""
+    global _smtp_pool
+    
+    with _smtp_pool_lock:
+        if _smtp_pool is None:
+            _smtp_pool = SMTPConnectionPool(
+                host=getattr(settings, 'EMAIL_HOST', 'smtp.gmail.com'),
+                port=getattr(settings, 'EMAIL_PORT', 587),
+                username=getattr(settings, 'EMAIL_HOST_USER', ''),
+                password=getattr(settings, 'EMAIL_HOST_PASSWORD', ''),
+                size=getattr(settings, 'EMAIL_POOL_SIZE', 5),
+                max_messages=getattr(settings, 'EMAIL_MAX_MESSAGES_PER_CONNECTION', 100),
+                timeout=getattr(settings, 'EMAIL_TIMEOUT', 30),
+            )
+            atexit.register(_smtp_pool.close_all)
+        return _smtp_pool
+
+
 class EmailService(NotificationService):
     """Сервис отправки email уведомлений"""
     
+    # Коды SMTP, означающие проблему адреса получателя, а не сервера
+    RECIPIENT_ERROR_CODES = (550, 551, 552, 553)
+    
     def __init__(self):
-        self.smtp_server = getattr(settings, 'EMAIL_HOST', 'smtp.gmail.com')
-        self.smtp_port = getattr(settings, 'EMAIL_PORT', 587)
         self.username = getattr(settings, 'EMAIL_HOST_USER', '')
         self.password = getattr(settings, 'EMAIL_HOST_PASSWORD', '')
         self.from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', self.username)
@@ -151,11 +395,7 @@ class EmailService(NotificationService):
             
             msg.attach(MIMEText(message, 'plain', 'utf-8'))
             
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.username, self.password)
-            server.send_message(msg)
-            server.quit()
+            get_smtp_pool().send_message(msg)
             
             logger.info(f"Email отправлен успешно на {recipient}")
             return True, ""
@@ -163,7 +403,17 @@ class EmailService(NotificationService):
         except Exception as e:
             error_msg = f"Ошибка отправки email: {str(e)}"
             logger.error(error_msg)
-            return False, error_msg
+            return False, error_msg if self._is_recipient_error(e) else ProviderError(error_msg)
+    
+    def _is_recipient_error(self, error: Exception) -> bool:
+        """Письмо отклонено из-за адреса получателя"""
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return True
+        return (
+            isinstance(error, smtplib.SMTPResponseException)
+            and not isinstance(error, smtplib.SMTPSenderRefused)
+            and error.smtp_code in self.RECIPIENT_ERROR_CODES
+        )
 
 
 class SMSService(NotificationService):
@@ -173,6 +423,7 @@ class SMSService(NotificationService):
         self.api_url = getattr(settings, 'SMS_API_URL', '')
         self.api_key = getattr(settings, 'SMS_API_KEY', '')
         self.sender = getattr(settings, 'SMS_SENDER', 'NotifySystem')
+        self.batch_size = getattr(settings, 'SMS_BATCH_SIZE', 100)
     
     def send(self, recipient: str, message: str, subject: str = "") -> Tuple[bool, str]:
         try:
@@ -188,7 +439,7 @@ class SMSService(NotificationService):
                 'json': 1
             }
             
-            response = requests.post(self.api_url, data=data, timeout=30)
+            response = get_http_session('sms').post(self.api_url, data=data)
             
             if response.status_code == 200:
                 result = response.json()
@@ -196,18 +447,92 @@ class SMSService(NotificationService):
                     logger.info(f"SMS отправлен успешно на {recipient}")
                     return True, ""
                 else:
+                    # Общий статус запроса: ошибки номера приходят в поле sms
                     error_msg = f"SMS API ошибка: {result.get('status_text', 'Неизвестная ошибка')}"
                     logger.error(error_msg)
-                    return False, error_msg
+                    return False, ProviderError(error_msg)
             else:
                 error_msg = f"HTTP ошибка: {response.status_code}"
                 logger.error(error_msg)
-                return False, error_msg
+                return False, _http_error(response.status_code, error_msg)
                 
         except Exception as e:
             error_msg = f"Ошибка отправки SMS: {str(e)}"
             logger.error(error_msg)
-            return False, error_msg
+            return False, ProviderError(error_msg)
+    
+    @staticmethod
+    def _normalize_phone(phone: str) -> str:
+        """Номер в формате ответа SMS.ru: только цифры"""
+        return ''.join(ch for ch in phone if ch.isdigit())
+    
+    def send_batch(self, recipients: List[str], message: str, subject: str = "") -> List[Tuple[bool, str]]:
+        """
+        Отправить одинаковое SMS многим номерам
+        
+        Номера отправляются пакетами до batch_size в одном запросе к API
+        (список номеров через запятую в поле to).
+        
+        Returns:
+            Список (success, error_message) в порядке recipients
+        """
+        if not self.api_url or not self.api_key:
+            return [(False, "SMS настройки не сконфигурированы")] * len(recipients)
+        
+        results = []
+        for start in range(0, len(recipients), self.batch_size):
+            results.extend(self._send_batch_request(recipients[start:start + self.batch_size], message))
+        return results
+    
+    def _send_batch_request(self, recipients: List[str], message: str) -> List[Tuple[bool, str]]:
+        numbers = [self._normalize_phone(recipient) for recipient in recipients]
+        
+        try:
+            data = {
+                'api_id': self.api_key,
+                'to': ','.join(dict.fromkeys(number for number in numbers if number)),
+                'msg': message,
+                'from': self.sender,
+                'json': 1
+            }
+            
+            response = get_http_session('sms').post(self.api_url, data=data)
+            
+            if response.status_code != 200:
+                error_msg = _http_error(response.status_code, f"HTTP ошибка: {response.status_code}")
+                logger.error(error_msg)
+                return [(False, error_msg)] * len(recipients)
+            
+            result = response.json()
+            if result.get('status') != 'OK':
+                # Запрос отклонен целиком (ключ, баланс) - это сбой провайдера, а не номеров
+                error_msg = ProviderError(f"SMS API ошибка: {result.get('status_text', 'Неизвестная ошибка')}")
+                logger.error(error_msg)
+                return [(False, error_msg)] * len(recipients)
+            
+        except Exception as e:
+            error_msg = ProviderError(f"Ошибка отправки SMS: {str(e)}")
+            logger.error(error_msg)
+            return [(False, error_msg)] * len(recipients)
+        
+        # Статусы по каждому номеру: {"79991234567": {"status": "OK", ...}}
+        statuses = result.get('sms', {})
+        results = []
+        for number in numbers:
+            item = statuses.get(number)
+            if item is None and len(number) == 11 and number.startswith('8'):
+                item = statuses.get('7' + number[1:])
+            
+            if item is None:
+                results.append((False, "SMS API не вернул статус для номера"))
+            elif item.get('status') == 'OK':
+                results.append((True, ""))
+            else:
+                results.append((False, f"SMS API ошибка: {item.get('status_text', 'Неизвестная ошибка')}"))
+        
+        success_count = sum(1 for success, _ in results if success)
+        logger.info(f"SMS пакет отправлен: успешно {success_count}/{len(recipients)}")
+        return results
 
 
 class TelegramService(NotificationService):
@@ -227,25 +552,28 @@ class TelegramService(NotificationService):
             if not self.bot:
                 return False, "Telegram бот не сконфигурирован"
             
-            # Если передан username, ищем chat_id в базе
-            if recipient.startswith('@') or not recipient.isdigit():
-                from .models import NotificationUser
-                from django.db import models
+            # Если передан username, ищем chat_id в кэше или в базе
+            if recipient.startswith('@') or not recipient.lstrip('-').isdigit():
+                chat_id = telegram_chat_id_cache.get(recipient)
                 
-                # Ищем пользователя по telegram username
-                try:
-                    user = NotificationUser.objects.get(
-                        models.Q(telegram=recipient) | 
-                        models.Q(telegram=recipient.lstrip('@'))
+                if chat_id is None:
+                    from .models import NotificationUser
+                    
+                    # Ищем пользователя по нормализованному telegram username
+                    chat_ids = list(
+                        NotificationUser.objects.filter(
+                            telegram_username=NotificationUser.normalize_telegram(recipient)
+                        ).values_list('telegram_chat_id', flat=True)[:2]
                     )
                     
-                    if not user.telegram_chat_id:
-                        return False, f"Chat ID не найден для {recipient}. Пользователь должен написать боту."
+                    if not chat_ids:
+                        return False, f"Пользователь {recipient} не найден в базе данных."
                     
-                    chat_id = user.telegram_chat_id
+                    chat_id = next((value for value in chat_ids if value), None)
+                    if not chat_id:
+                        return False, f"Chat ID не найден для {recipient}. Пользователь должен написать боту."
                     
-                except NotificationUser.DoesNotExist:
-                    return False, f"Пользователь {recipient} не найден в базе данных."
+                    telegram_chat_id_cache.set(recipient, chat_id)
             else:
                 # Если передан числовой chat_id
                 try:
@@ -256,9 +584,7 @@ class TelegramService(NotificationService):
             # Формируем полное сообщение
             full_message = f"*{subject}*\n\n{message}" if subject else message
 
-            # Используем синхронную отправку через requests
-            import requests
-            
+            # Отправляем через общую keep-alive сессию Telegram
             url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
             data = {
                 'chat_id': chat_id,
@@ -266,7 +592,21 @@ class TelegramService(NotificationService):
                 'parse_mode': 'Markdown'
             }
             
-            response = requests.post(url, json=data)
+            max_attempts = getattr(settings, 'TELEGRAM_MAX_RETRY_AFTER_ATTEMPTS', 3) + 1
+            for attempt in range(max_attempts):
+                telegram_rate_limiter.acquire(chat_id)
+                response = get_http_session('telegram').post(url, json=data)
+                
+                if response.status_code != 429:
+                    break
+                
+                # Превышен лимит Telegram: ждем retry_after и повторяем, это не ошибка доставки
+                retry_after = self._get_retry_after(response)
+                telegram_rate_limiter.pause(retry_after)
+                logger.warning(
+                    f"Telegram ограничил частоту отправки, повтор через {retry_after} с "
+                    f"(chat_id: {chat_id}, попытка {attempt + 1}/{max_attempts})"
+                )
             
             if response.status_code == 200:
                 logger.info(f"Telegram сообщение отправлено успешно на chat_id: {chat_id}")
@@ -274,21 +614,42 @@ class TelegramService(NotificationService):
             else:
                 error_msg = f"Ошибка API Telegram: {response.status_code} - {response.text}"
                 logger.error(error_msg)
-                return False, error_msg
+                # 400/403 - чат не найден или бот заблокирован пользователем
+                return False, _http_error(response.status_code, error_msg)
             
         except TelegramError as e:
             error_msg = f"Telegram ошибка: {str(e)}"
             logger.error(error_msg)
-            return False, error_msg
+            return False, ProviderError(error_msg)
         except Exception as e:
             error_msg = f"Ошибка отправки Telegram: {str(e)}"
             logger.error(error_msg)
-            return False, error_msg
+            return False, ProviderError(error_msg)
+
+
+    @staticmethod
+    def _get_retry_after(response) -> float:
+        """Время ожидания из ответа 429 (parameters.retry_after)"""
+        try:
+            return float(response.json().get('parameters', {}).get('retry_after', 1))
+        except (ValueError, AttributeError):
+            return 1.0
+
+
+# Ошибка доставки, когда канал отключен выключателем (см. circuit.py)
+CIRCUIT_OPEN_ERROR = "канал временно отключен после серии ошибок"
 
 
 class NotificationDeliveryService:
     """Главный сервис доставки уведомлений с поддержкой fallback"""
     
+    # Количество одновременных отправок по каждому каналу для send_many
+    DEFAULT_CONCURRENCY = {
+        'email': 5,
+        'sms': 20,
+        'telegram': 25,
+    }
+    
     def __init__(self):
         self.services = {
             'email': EmailService(),
@@ -296,13 +657,37 @@ class NotificationDeliveryService:
             'telegram': TelegramService(),
         }
     
+    @staticmethod
+    def _get_recipient(method: str, user_data: Dict):
+        """Адрес пользователя для способа доставки"""
+        from .models import NotificationUser
+        
+        if method == 'email':
+            return NotificationUser.normalize_email(user_data.get('email'))
+        elif method == 'sms':
+            return NotificationUser.normalize_phone(user_data.get('phone'))
+        elif method == 'telegram':
+            # Известный chat_id избавляет TelegramService от поиска по username
+            chat_id = user_data.get('telegram_chat_id')
+            return str(chat_id) if chat_id else user_data.get('telegram')
+        return None
+    
+    @staticmethod
+    def _address_key(method: str, recipient: str) -> str:
+        """Ключ адреса для дедупликации: одинаковые адреса разных пользователей совпадают"""
+        from .models import NotificationUser
+        
+        if method == 'telegram':
+            return NotificationUser.normalize_telegram(recipient)
+        return recipient
+    
     def send_notification(self, user_data: Dict, message: str, subject: str, 
                          delivery_methods: List[str]) -> Tuple[str, str, str]:
         """
         Отправить уведомление пользователю с поддержкой fallback
         
         Args:
-            user_data: Данные пользователя (email, phone, telegram)
+            user_data: Данные пользователя (email, phone, telegram, telegram_chat_id)
             message: Текст сообщения
             subject: Тема сообщения
             delivery_methods: Список способов доставки ['email', 'sms', 'telegram']
@@ -324,20 +709,22 @@ class NotificationDeliveryService:
             service = self.services[method]
             
             # Определяем получателя в зависимости от способа доставки
-            recipient = None
-            if method == 'email':
-                recipient = user_data.get('email')
-            elif method == 'sms':
-                recipient = user_data.get('phone')
-            elif method == 'telegram':
-                recipient = user_data.get('telegram')
+            recipient = self._get_recipient(method, user_data)
             
             if not recipient:
                 errors.append(f"Отсутствует {method} для пользователя")
                 continue
             
+            # Канал, который сейчас не работает, пропускаем без ожидания таймаута
+            breaker = get_circuit_breaker(method)
+            if not breaker.allow():
+                errors.append(f"{method}: {CIRCUIT_OPEN_ERROR}")
+                continue
+            
             # Пытаемся отправить
+            started = time.monotonic()
             success, error = service.send(recipient, message, subject)
+            breaker.record(call_outcome(success, error), time.monotonic() - started)
             
             if success:
                 return method, 'success', ''
@@ -346,57 +733,211 @@ class NotificationDeliveryService:
         
         # Если ничего не сработало
         return 'none', 'failed', '; '.join(errors)
+    
+    async def send_many(self, recipients: List[Dict], message: str, subject: str,
+                        delivery_methods: List[str],
+                        concurrency: Dict[str, int] = None,
+                        methods_by_recipient: List[List[str]] = None,
+                        attempts: List[Tuple[int, str, bool]] = None) -> List[Tuple[str, str, str]]:
+        """
+        Отправить уведомление многим пользователям одновременно
+        
+        Для каждого пользователя сохраняется тот же порядок fallback, что и в
+        send_notification. Способы доставки перебираются волнами: сначала всем
+        отправляется первым способом, затем тем, кому не удалось, - следующим.
+        Внутри волны отправки идут параллельно с ограничением по каналу, а
+        сервисы с send_batch (SMS) получают получателей пакетами.
+        На один адрес (email без учета регистра, телефон в E.164, Telegram)
+        каждый способ отправляет один раз, результат получают все
+        пользователи с этим адресом.
+        
+        Args:
+            recipients: Список данных пользователей (email, phone, telegram, telegram_chat_id)
+            concurrency: Лимиты одновременных отправок по каналам
+            methods_by_recipient: Свой порядок способов для каждого получателя
+                (вместо delivery_methods) - на каждой волне способы разных
+                получателей отправляются параллельно
+            attempts: Если передан, в него дописываются выполненные попытки
+                (индекс получателя, способ, успех)
+        
+        Returns:
+            Список (delivery_method_used, status, error_message) в порядке recipients
+        """
+        limits = {
+            **self.DEFAULT_CONCURRENCY,
+            **getattr(settings, 'DELIVERY_CONCURRENCY', {}),
+            **(concurrency or {}),
+        }
+        semaphores = {method: asyncio.Semaphore(limits.get(method, 1)) for method in self.services}
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(
+            max_workers=sum(limits.get(method, 1) for method in self.services),
+            thread_name_prefix='notify',
+        )
+        
+        async def call(method: str, func, *args):
+            async with semaphores[method]:
+                # Выключатель мог сработать, пока отправка ждала очереди
+                return await loop.run_in_executor(
+                    executor, _call_in_thread, _call_guarded, get_circuit_breaker(method), func, *args
+                )
+        
+        async def send_wave(method: str, addresses: List[str]) -> List[Tuple[bool, str]]:
+            service = self.services[method]
+            skipped = (False, CIRCUIT_OPEN_ERROR)
+            
+            if hasattr(service, 'send_batch'):
+                batch_size = getattr(service, 'batch_size', 100)
+                batches = [addresses[i:i + batch_size] for i in range(0, len(addresses), batch_size)]
+                batch_results = await asyncio.gather(
+                    *(call(method, service.send_batch, batch, message, subject) for batch in batches)
+                )
+                return [
+                    result
+                    for batch, batch_result in zip(batches, batch_results)
+                    for result in (batch_result or [skipped] * len(batch))
+                ]
+            
+            outcomes = await asyncio.gather(
+                *(call(method, service.send, address, message, subject) for address in addresses)
+            )
+            return [outcome or skipped for outcome in outcomes]
+        
+        results: List[Tuple[str, str, str]] = [None] * len(recipients)
+        errors = [[] for _ in recipients]
+        pending = list(range(len(recipients)))
+        
+        if methods_by_recipient is None:
+            methods_by_recipient = [delivery_methods] * len(recipients)
+        
+        # Результаты отправок по (способ, адрес) для дедупликации
+        sent: Dict[Tuple[str, str], Tuple[bool, str]] = {}
+        
+        async def run_wave(method: str, indexes: List[int]):
+            """Отправить способом method получателям indexes"""
+            # Канал отключен выключателем - получатели сразу переходят к следующему способу
+            breaker = get_circuit_breaker(method)
+            if await loop.run_in_executor(executor, _call_in_thread, breaker.is_open):
+                for index in indexes:
+                    errors[index].append(f"{method}: {CIRCUIT_OPEN_ERROR}")
+                return
+            
+            # Получатели с одним адресом получают одну отправку
+            addresses: Dict[str, str] = {}
+            members: Dict[str, List[int]] = {}
+            for index in indexes:
+                recipient = self._get_recipient(method, recipients[index])
+                if recipient:
+                    key = self._address_key(method, recipient)
+                    addresses.setdefault(key, recipient)
+                    members.setdefault(key, []).append(index)
+                else:
+                    errors[index].append(f"Отсутствует {method} для пользователя")
+            
+            # Адрес, на который этот способ уже отправлял в прошлых волнах, не отправляется повторно
+            to_send = [key for key in members if (method, key) not in sent]
+            outcomes = await send_wave(method, [addresses[key] for key in to_send])
+            wave_outcomes = dict(zip(to_send, outcomes))
+            sent.update(
+                ((method, key), outcome) for key, outcome in wave_outcomes.items()
+                if outcome[1] != CIRCUIT_OPEN_ERROR
+            )
+            
+            for key, address_indexes in members.items():
+                success, error = wave_outcomes.get(key) or sent[(method, key)]
+                for index in address_indexes:
+                    if attempts is not None and error != CIRCUIT_OPEN_ERROR:
+                        attempts.append((index, method, success))
+                    if success:
+                        results[index] = (method, 'success', '')
+                    else:
+                        errors[index].append(f"{method}: {error}")
+        
+        try:
+            step = 0
+            while pending:
+                # Волна: каждый получатель пробует свой очередной способ
+                waves: Dict[str, List[int]] = {}
+                for index in pending:
+                    methods = methods_by_recipient[index]
+                    if step >= len(methods):
+                        continue
+                    method = methods[step]
+                    if method not in self.services:
+                        errors[index].append(f"Неизвестный способ доставки: {method}")
+                        continue
+                    waves.setdefault(method, []).append(index)
+                
+                if waves:
+                    await asyncio.gather(*(run_wave(method, indexes) for method, indexes in waves.items()))
+                
+                step += 1
+                pending = [
+                    index for index in pending
+                    if results[index] is None and step < len(methods_by_recipient[index])
+                ]
+        finally:
+            executor.shutdown(wait=False)
+        
+        for index, result in enumerate(results):
+            if result is None:
+                results[index] = ('none', 'failed', '; '.join(errors[index]))
+        
+        return results
+    
+    def send_many_sync(self, recipients: List[Dict], message: str, subject: str,
+                       delivery_methods: List[str],
+                       concurrency: Dict[str, int] = None,
+                       methods_by_recipient: List[List[str]] = None,
+                       attempts: List[Tuple[int, str, bool]] = None) -> List[Tuple[str, str, str]]:
+        """Синхронная обертка над send_many для Celery задач и скриптов"""
+        return asyncio.run(
+            self.send_many(
+                recipients, message, subject, delivery_methods, concurrency,
+                methods_by_recipient, attempts
+            )
+        )
 
 
-def load_users_from_json(file_path: str) -> List[Dict]:
-    """Загрузить пользователей из JSON файла"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка загрузки пользователей из JSON: {e}")
-        return []
-
-
-def save_users_to_json(file_path: str, users: List[Dict]) -> bool:
-    """Сохранить пользователей в JSON файл"""
-    try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(users, f, ensure_ascii=False, indent=2)
+def _result_outcome(result) -> Optional[bool]:
+    """
+    Результат вызова сервиса для выключателя (см. circuit.call_outcome)
+    
+    Пакет SMS считается одной отправкой: удачной, если принят хотя бы один
+    номер, и неудачной, только если отказал сам провайдер.
+    """
+    if not isinstance(result, list):
+        return call_outcome(*result)
+    outcomes = [call_outcome(success, error) for success, error in result]
+    if True in outcomes:
         return True
-    except Exception as e:
-        logger.error(f"Ошибка сохранения пользователей в JSON: {e}")
-        return False
+    return False if False in outcomes else None
 
 
-def create_notification_log(log_data: List[Dict], file_name: str = None) -> str:
+def _call_guarded(breaker, func, *args):
     """
-    Создать лог файл с результатами отправки уведомлений
-    
-    Args:
-        log_data: Список словарей с данными о доставке
-        file_name: Имя файла (если None, создается автоматически)
+    Вызвать сервис через выключатель канала (в потоке пула send_many)
     
-    Returns:
-        Путь к созданному файлу
+    Выключатель хранит состояние в базе, поэтому allow() и record() нельзя
+    вызывать в потоке цикла событий. Возвращает None, если канал отключен.
     """
-    if not file_name:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_name = f"notification_log_{timestamp}.json"
+    if not breaker.allow():
+        return None
+    started = time.monotonic()
+    outcome = False
+    try:
+        result = func(*args)
+        outcome = _result_outcome(result)
+        return result
+    finally:
+        breaker.record(outcome, time.monotonic() - started)
+
+
+def _call_in_thread(func, *args):
+    """Вызвать метод сервиса в рабочем потоке и закрыть открытые потоком соединения с БД"""
+    from django.db import connections
     
     try:
-        log_path = f"logs/{file_name}"
-        
-        # Создаем директорию если не существует
-        import os
-        os.makedirs(os.path.dirname(log_path), exist_ok=True)
-        
-        with open(log_path, 'w', encoding='utf-8') as f:
-            json.dump(log_data, f, ensure_ascii=False, indent=2, default=str)
-        
-        logger.info(f"Лог файл создан: {log_path}")
-        return log_path
-        
-    except Exception as e:
-        logger.error(f"Ошибка создания лог файла: {e}")
-        return ""
+        return func(*args)
+    finally:
+        connections.close_all()
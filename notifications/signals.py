@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .dashboard import dashboard_cache
+from .models import NotificationLog, NotificationMessage, NotificationUser, UserGroup
+
+
+@receiver([post_save, post_delete], sender=NotificationUser, dispatch_uid='dashboard_user_changed')
+def user_changed(sender, **kwargs):
+    # Вместе с пользователем каскадно удаляются его логи
+    dashboard_cache.invalidate('users', 'logs')
+
+
+@receiver([post_save, post_delete], sender=UserGroup, dispatch_uid='dashboard_group_changed')
+def group_changed(sender, **kwargs):
+    dashboard_cache.invalidate('groups')
+
+
+@receiver([post_save, post_delete], sender=NotificationMessage, dispatch_uid='dashboard_message_changed')
+def message_changed(sender, **kwargs):
+    dashboard_cache.invalidate('messages', 'logs')
+
+
+# Только post_save: обработчик post_delete запретил бы Django удалять логи одним
+# запросом при каскадном удалении пользователей и сообщений
+@receiver(post_save, sender=NotificationLog, dispatch_uid='dashboard_log_created')
+def log_created(sender, **kwargs):
+    dashboard_cache.invalidate('messages', 'logs')
@@ -0,0 +1,526 @@
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from celery import shared_task
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .dashboard import dashboard_cache
+from .delivery_log import DeliveryLogWriter, NotificationLogBuffer, delivery_log_path
+from .models import (
+    BroadcastChunk, MessageDelivery, NotificationMessage, NotificationUser, UserChannelPreference
+)
+from .services import NotificationDeliveryService
+
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_broadcast(message: NotificationMessage) -> bool:
+    """
+    Принять рассылку к отправке
+
+    Получатели разбиваются на пакеты задачей plan_broadcast после фиксации
+    транзакции, поэтому запрос не зависит от размера аудитории.
+
+    Returns:
+        False, если сообщение уже отправлено или отправляется
+    """
+    with transaction.atomic():
+        claimed = NotificationMessage.objects.filter(
+            id=message.id, is_sent=False, chunks_total=0, queued_at__isnull=True
+        ).update(queued_at=timezone.now())
+        if claimed:
+            transaction.on_commit(lambda: plan_broadcast.delay(message.id))
+
+    if claimed:
+        logger.info(f"Рассылка {message.id} принята к отправке")
+    return bool(claimed)
+
+
+@shared_task(ignore_result=True)
+def plan_broadcast(message_id: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбить рассылку на пакеты и поставить их в очередь
+
+    Строки MessageDelivery создаются пакетами вне общей транзакции; если
+    задача упала, повторный запуск (продолжение рассылки) досоздаст их.
+
+    Returns:
+        (количество пакетов, количество получателей) или None,
+        если рассылка уже разбита на пакеты, отправлена или удалена
+    """
+    message = NotificationMessage.objects.filter(id=message_id, is_sent=False, chunks_total=0).first()
+    if message is None:
+        return None
+
+    chunks = plan_chunks(message.get_target_users(), message.delivery_methods)
+    user_ids = [user_id for chunk in chunks for user_id in chunk]
+
+    # Состояние доставки каждому получателю - по нему рассылку можно продолжить после сбоя
+    MessageDelivery.create_for(message.id, user_ids)
+
+    with transaction.atomic():
+        pending = NotificationMessage.objects.filter(id=message.id, is_sent=False, chunks_total=0)
+        if chunks:
+            claimed = pending.update(
+                chunks_total=len(chunks),
+                chunks_done=0,
+                log_path=delivery_log_path(message.id),
+                log_records=0,
+            )
+        else:
+            # Получателей нет - отправлять нечего
+            claimed = pending.update(is_sent=True, sent_at=timezone.now())
+
+        if not claimed:
+            return None
+        _queue_chunks(message.id, chunks)
+
+    logger.info(
+        f"Рассылка {message.id} поставлена в очередь: {len(user_ids)} получателей, {len(chunks)} пакетов"
+    )
+    return len(chunks), len(user_ids)
+
+
+def resume_broadcast(message: NotificationMessage, retry_failed: bool = False) -> Optional[Tuple[int, int]]:
+    """
+    Продолжить прерванную рассылку
+
+    Если рассылка прервалась до разбиения на пакеты, заново запускается
+    plan_broadcast. Иначе в очередь ставятся только получатели, которым сообщение еще не доставлено:
+    ожидающие и зависшие в in_flight (процесс упал во время отправки), а с
+    retry_failed - и неудачные. Продолжить можно только прерванную рассылку:
+    ни один ее необработанный пакет и ни один получатель в in_flight не
+    обновлялись дольше DELIVERY_IN_FLIGHT_TIMEOUT, и аренда пакетов истекла.
+
+    Returns:
+        (количество пакетов, количество получателей) или None,
+        если продолжать нечего или рассылка еще выполняется
+    """
+    now = timezone.now()
+    stalled_before = NotificationMessage.stalled_before()
+    deliveries = MessageDelivery.objects.filter(message_id=message.id)
+    chunks = BroadcastChunk.objects.filter(message_id=message.id)
+
+    with transaction.atomic():
+        # Блокируем сообщение, чтобы две попытки продолжения не поставили пакеты дважды
+        message = NotificationMessage.objects.select_for_update().get(id=message.id)
+
+        if message.is_planning:
+            # Пакеты еще не созданы: разбиение запускается заново, если прежнее прервалось
+            if not message.is_stalled:
+                return None
+            NotificationMessage.objects.filter(id=message.id).update(queued_at=now)
+            transaction.on_commit(lambda: plan_broadcast.delay(message.id))
+            logger.info(f"Рассылка {message.id}: разбиение на пакеты запущено заново")
+            return 0, 0
+
+        if (
+            deliveries.filter(status=MessageDelivery.IN_FLIGHT, updated_at__gte=stalled_before).exists()
+            or chunks.exclude(status=BroadcastChunk.DONE).filter(updated_at__gte=stalled_before).exists()
+            or chunks.filter(status=BroadcastChunk.LEASED, lease_expires_at__gte=now).exists()
+        ):
+            # Пакеты еще отправляются или ждут своей очереди
+            return None
+
+        deliveries.filter(status=MessageDelivery.IN_FLIGHT).update(status=MessageDelivery.PENDING)
+        if retry_failed:
+            deliveries.filter(status=MessageDelivery.FAILED).update(status=MessageDelivery.PENDING)
+
+        remaining = plan_chunks(NotificationUser.objects.filter(
+            deliveries__message_id=message.id, deliveries__status=MessageDelivery.PENDING
+        ), message.delivery_methods)
+        if not remaining:
+            return None
+
+        # Старые пакеты заменяются пакетами из оставшихся получателей
+        chunks.delete()
+        chunks = remaining
+        user_ids = [user_id for chunk in chunks for user_id in chunk]
+        NotificationMessage.objects.filter(id=message.id).update(
+            is_sent=False,
+            sent_at=None,
+            chunks_total=len(chunks),
+            chunks_done=0,
+            log_path=message.log_path or delivery_log_path(message.id),
+        )
+        _queue_chunks(message.id, chunks)
+
+    logger.info(
+        f"Рассылка {message.id} продолжена: {len(user_ids)} получателей, {len(chunks)} пакетов"
+    )
+    return len(chunks), len(user_ids)
+
+
+def _address_keys(delivery_methods: List[str], email: str, phone_e164: str,
+                  telegram_username: str, telegram_chat_id) -> List[str]:
+    """Адреса пользователя по способам рассылки в том виде, в каком их сравнивает send_many"""
+    telegram = str(telegram_chat_id) if telegram_chat_id else telegram_username
+    keys = [
+        ('email', NotificationUser.normalize_email(email)),
+        ('sms', phone_e164),
+        ('telegram', telegram),
+    ]
+    return [
+        f"{channel}:{address}" for channel, address in keys
+        if address and channel in delivery_methods
+    ]
+
+
+def plan_chunks(users, delivery_methods: List[str]) -> List[List[int]]:
+    """
+    Разбить получателей на пакеты по BROADCAST_CHUNK_SIZE
+
+    Пользователи, связанные общим адресом (email без учета регистра, телефон
+    в E.164, Telegram) в одном из способов доставки delivery_methods, попадают
+    в один пакет: внутри пакета send_many отправляет на адрес один раз и
+    записывает результат всем этим пользователям.
+    Группа связанных пользователей не растет больше BROADCAST_CHUNK_SIZE:
+    общий ящик или номер-заглушка не собирает в один пакет большую часть
+    аудитории, а пользователи сверх предела отправляются в других пакетах
+    (без дедупликации между ними).
+
+    Returns:
+        списки id пользователей не длиннее BROADCAST_CHUNK_SIZE;
+        порядок - по наименьшему id в группе
+    """
+    chunk_size = getattr(settings, 'BROADCAST_CHUNK_SIZE', 100)
+
+    # Система непересекающихся множеств: пользователь -> представитель группы
+    parent: Dict[int, int] = {}
+    size: Dict[int, int] = {}
+
+    def find(user_id: int) -> int:
+        while parent[user_id] != user_id:
+            parent[user_id] = parent[parent[user_id]]
+            user_id = parent[user_id]
+        return user_id
+
+    owners: Dict[str, int] = {}
+    rows = users.order_by('id').values_list(
+        'id', 'email', 'phone_e164', 'telegram_username', 'telegram_chat_id'
+    )
+    for user_id, *address in rows.iterator(chunk_size=2000):
+        parent[user_id] = user_id
+        size[user_id] = 1
+        for key in _address_keys(delivery_methods, *address):
+            owner = owners.setdefault(key, user_id)
+            if owner == user_id:
+                continue
+            # Представителем остается пользователь с меньшим id
+            root, other = sorted((find(owner), find(user_id)))
+            if root == other or size[root] + size[other] > chunk_size:
+                continue
+            parent[other] = root
+            size[root] += size.pop(other)
+
+    groups: Dict[int, List[int]] = {}
+    for user_id in parent:
+        groups.setdefault(find(user_id), []).append(user_id)
+
+    chunks, current = [], []
+    for members in groups.values():
+        if current and len(current) + len(members) > chunk_size:
+            chunks.append(current)
+            current = []
+        current.extend(members)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _queue_chunks(message_id: int, chunks: List[List[int]]):
+    """
+    Создать пакеты рассылки в базе
+
+    При BROADCAST_EXECUTOR = 'celery' на каждый пакет ставится задача Celery
+    (после фиксации текущей транзакции), при 'workers' пакеты разбирают
+    воркеры run_broadcast_workers.
+    """
+    BroadcastChunk.create_for(message_id, chunks)
+
+    # update() не вызывает сигналы
+    transaction.on_commit(lambda: dashboard_cache.invalidate('messages'))
+
+    if getattr(settings, 'BROADCAST_EXECUTOR', 'celery') != 'celery':
+        return
+
+    # Задачи уходят в брокер только после фиксации транзакции
+    for index in range(len(chunks)):
+        transaction.on_commit(
+            lambda index=index: send_message_chunk.delay(message_id, index)
+        )
+
+
+def deliver_to_users(message: NotificationMessage, users,
+                     log_buffer: NotificationLogBuffer = None,
+                     log_file: DeliveryLogWriter = None,
+                     track_deliveries: bool = False) -> Tuple[int, int]:
+    """
+    Отправить сообщение списку пользователей
+
+    Отправки выполняются параллельно через NotificationDeliveryService.send_many,
+    записи NotificationLog пишутся пакетно через log_buffer, а подробности
+    доставки дописываются в NDJSON лог log_file (если передан).
+    В режиме smart_order каждый пользователь получает способы в порядке
+    своих UserChannelPreference; результаты всех попыток добавляются к ним.
+    С track_deliveries результаты сразу после отправки отмечаются в MessageDelivery
+
+    Returns:
+        (успешно, всего)
+    """
+    if log_buffer is None:
+        with NotificationLogBuffer() as log_buffer:
+            return deliver_to_users(message, users, log_buffer, log_file, track_deliveries)
+
+    delivery_service = NotificationDeliveryService()
+
+    users = list(users)
+    recipients = [
+        {
+            'email': user.email,
+            'phone': user.phone,
+            'telegram': user.telegram,
+            'telegram_chat_id': user.telegram_chat_id,
+        }
+        for user in users
+    ]
+
+    methods_by_recipient = None
+    if message.smart_order:
+        preferences = UserChannelPreference.objects.in_bulk([user.id for user in users])
+        methods_by_recipient = [
+            preferences[user.id].order(message.delivery_methods) if user.id in preferences
+            else message.delivery_methods
+            for user in users
+        ]
+
+    attempts = []
+    results = delivery_service.send_many_sync(
+        recipients,
+        message=message.content,
+        subject=message.title,
+        delivery_methods=message.delivery_methods,
+        methods_by_recipient=methods_by_recipient,
+        attempts=attempts
+    )
+
+    if track_deliveries:
+        # Отмечаем до записи логов: после сбоя получатель не должен получить сообщение повторно
+        MessageDelivery.record_results(
+            message.id, [(user.id, method, status) for user, (method, status, _) in zip(users, results)]
+        )
+
+    UserChannelPreference.record_attempts(
+        (users[index].id, method, success) for index, method, success in attempts
+    )
+
+    success_count = 0
+
+    for user, (delivery_method, status, error_message) in zip(users, results):
+        # Сохраняем лог в базу данных
+        log_buffer.add(
+            message=message,
+            user=user,
+            delivery_method=delivery_method if delivery_method != 'none' else 'failed',
+            status=status,
+            error_message=error_message
+        )
+
+        # Дописываем в лог файл
+        if log_file is not None:
+            log_file.write({
+                'user_id': user.external_id,
+                'email': user.email,
+                'delivery_method': delivery_method,
+                'status': status,
+                'error_message': error_message,
+                'timestamp': timezone.now().isoformat()
+            })
+
+        if status == 'success':
+            success_count += 1
+
+    return success_count, len(users)
+
+
+def _complete_chunk(message_id: int):
+    """Отметить пакет обработанным и закрыть рассылку после последнего пакета"""
+    NotificationMessage.objects.filter(id=message_id).update(chunks_done=F('chunks_done') + 1)
+    finished = NotificationMessage.objects.filter(
+        id=message_id,
+        is_sent=False,
+        chunks_done__gte=F('chunks_total'),
+    ).update(is_sent=True, sent_at=timezone.now())
+
+    if finished:
+        dashboard_cache.invalidate('messages')
+        logger.info(f"Рассылка {message_id} завершена")
+
+
+class LeaseHeartbeat:
+    """
+    Продление аренды пакета в фоновом потоке, пока идет отправка
+
+        with LeaseHeartbeat(chunk, owner, lease_seconds):
+            ...
+
+    Аренда продлевается каждую треть lease_seconds, поэтому долгая отправка
+    (медленный провайдер, повторы) не отдает пакет другому воркеру.
+    """
+
+    def __init__(self, chunk: BroadcastChunk, owner: str, lease_seconds: int):
+        self.chunk = chunk
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.interval = max(lease_seconds / 3, 1)
+        self.lost = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'lease-{self.chunk.id}')
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    renewed = self.chunk.renew(self.owner, self.lease_seconds)
+                except DatabaseError as e:
+                    logger.warning(f"Рассылка {self.chunk.message_id}, пакет {self.chunk.index}: аренда не продлена: {e}")
+                    continue
+                if not renewed:
+                    self.lost = True
+                    logger.warning(f"Рассылка {self.chunk.message_id}, пакет {self.chunk.index}: аренду перехватили")
+                    return
+        finally:
+            connection.close()
+
+
+def process_chunk(chunk: BroadcastChunk, owner: str, lease_seconds: int = None) -> Tuple[int, int]:
+    """
+    Отправить пакет, взятый в аренду воркером owner
+
+    Пока пакет отправляется, аренда продлевается (LeaseHeartbeat). Если пакет
+    взят повторно, а получатели предыдущего владельца еще не зависли дольше
+    DELIVERY_IN_FLIGHT_TIMEOUT, он их, возможно, еще отправляет: пакет
+    откладывается до этого срока, а не засчитывается.
+
+    Returns:
+        (успешно, всего)
+    """
+    message = NotificationMessage.objects.get(id=chunk.message_id)
+    lease_seconds = lease_seconds or getattr(settings, 'BROADCAST_LEASE_SECONDS', 300)
+    timeout = timedelta(seconds=getattr(settings, 'DELIVERY_IN_FLIGHT_TIMEOUT', 600))
+    in_flight = MessageDelivery.objects.filter(
+        message_id=message.id, user_id__in=chunk.user_ids, status=MessageDelivery.IN_FLIGHT
+    )
+
+    if chunk.attempts > 1:
+        # Аренда предыдущего владельца истекла: зависших получателей возвращаем в очередь
+        reset = in_flight.filter(updated_at__lt=timezone.now() - timeout).update(status=MessageDelivery.PENDING)
+        if reset:
+            logger.warning(
+                f"Рассылка {message.id}, пакет {chunk.index}: взят повторно, "
+                f"{reset} получателей возвращены в очередь"
+            )
+
+    success_count = total_count = 0
+    busy_until = None
+    try:
+        # Отправляем только получателей, которым сообщение еще не отправлялось
+        claimed = MessageDelivery.claim(message.id, chunk.user_ids)
+        if claimed:
+            with LeaseHeartbeat(chunk, owner, lease_seconds):
+                success_count, total_count = _send_chunk(message, chunk, claimed)
+        else:
+            logger.info(f"Рассылка {message.id}, пакет {chunk.index}: получатели уже обработаны")
+
+        if chunk.attempts > 1:
+            # Свои получатели уже отмечены: в in_flight остались только чужие
+            busy_until = in_flight.aggregate(last=Max('updated_at'))['last']
+    except Exception:
+        # Пакет возвращается в очередь; неотмеченных получателей вернет следующая попытка
+        chunk.release(owner)
+        raise
+
+    if busy_until is not None:
+        retry_at = busy_until + timeout
+        if chunk.defer(owner, retry_at):
+            logger.warning(
+                f"Рассылка {message.id}, пакет {chunk.index}: предыдущий владелец еще отправляет, "
+                f"пакет отложен до {retry_at:%H:%M:%S}"
+            )
+            if getattr(settings, 'BROADCAST_EXECUTOR', 'celery') == 'celery':
+                send_message_chunk.apply_async((message.id, chunk.index), eta=retry_at)
+        return success_count, total_count
+
+    # Пакет засчитывается один раз, даже если его аренду успели перехватить
+    if chunk.complete(owner):
+        _complete_chunk(message.id)
+    else:
+        logger.warning(f"Рассылка {message.id}, пакет {chunk.index}: аренда истекла до завершения")
+
+    return success_count, total_count
+
+
+def _send_chunk(message: NotificationMessage, chunk: BroadcastChunk, claimed: List[int]) -> Tuple[int, int]:
+    """Отправить сообщение получателям пакета, отмеченным in_flight"""
+    users = list(NotificationUser.objects.filter(id__in=claimed, is_active=True).order_by('id'))
+
+    inactive = set(claimed) - {user.id for user in users}
+    if inactive:
+        MessageDelivery.record_results(message.id, [(user_id, 'none', 'failed') for user_id in inactive])
+
+    log_file = DeliveryLogWriter(message.log_path or delivery_log_path(message.id))
+
+    try:
+        with log_file:
+            success_count, total_count = deliver_to_users(
+                message, users, log_file=log_file, track_deliveries=True
+            )
+
+        logger.info(
+            f"Рассылка {message.id}, пакет {chunk.index}: успешно {success_count}/{total_count}. "
+            f"Лог: {log_file.directory}"
+        )
+    finally:
+        NotificationMessage.objects.filter(id=message.id).update(
+            log_records=F('log_records') + log_file.records
+        )
+
+    return success_count, total_count
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=3, default_retry_delay=30)
+def send_message_chunk(self, message_id: int, chunk_index: int):
+    """Отправить сообщение одному пакету получателей"""
+    owner = f"celery:{socket.gethostname()}:{os.getpid()}"
+    lease_seconds = getattr(settings, 'BROADCAST_LEASE_SECONDS', 300)
+
+    chunk = BroadcastChunk.claim(message_id, chunk_index, owner, lease_seconds)
+    if chunk is None:
+        # Пакет уже обработан, взят воркером или рассылка удалена
+        logger.info(f"Рассылка {message_id}, пакет {chunk_index}: уже обрабатывается или обработан")
+        return
+
+    try:
+        process_chunk(chunk, owner, lease_seconds)
+    except Exception as e:
+        # Пакет уже возвращен в очередь: повторяем задачу, после исчерпания попыток
+        # его возьмут воркеры или продолжение рассылки
+        logger.error(f"Рассылка {message_id}, пакет {chunk_index}: {e}")
+        raise self.retry(exc=e)
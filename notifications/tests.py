@@ -1,3 +1,1675 @@
-from django.test import TestCase
+import gzip
+import html
+import io
+import importlib
+import json
+import os
+import smtplib
+import tempfile
+import unittest
+from datetime import timedelta
 
-# Create your tests here.
+import requests
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock
+
+from .circuit import CircuitBreaker, ProviderError, call_outcome, get_channel_states
+from .delivery_log import DeliveryLogWriter, NotificationLogBuffer
+from .importers import UserImporter, import_users_stream, iter_json_array
+from .middleware import QueryRecorder
+from .pagination import keyset_paginate
+from .ratelimit import TelegramRateLimiter, TokenBucket
+from .webhooks import TelegramUpdateBuffer
+from .workers import BroadcastWorker
+
+from .models import (
+    BroadcastChunk, ChannelCircuitState, MessageDelivery, MessageDeliveryStats, NotificationLog, NotificationMessage,
+    NotificationUser, TelegramCollectorState, TelegramWebhookUpdate, UserChannelPreference, UserGroup
+)
+from .services import (
+    CIRCUIT_OPEN_ERROR, EmailService, NotificationDeliveryService, SMSService, SMTPConnectionPool,
+    TelegramChatIdCache, TelegramChatIdCollector, TelegramService
+)
+from .tasks import (
+    deliver_to_users, enqueue_broadcast, plan_broadcast, plan_chunks, resume_broadcast, send_message_chunk
+)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN есть только в SQLite')
+class QueryPlanTests(TestCase):
+    """Горячие запросы должны идти по индексу, а не полным сканированием таблицы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = UserGroup.objects.create(name='Группа')
+        cls.admin = User.objects.create_user('admin', password='admin')
+        cls.message = NotificationMessage.objects.create(
+            title='Тест', content='Текст', created_by=cls.admin, delivery_methods=['email']
+        )
+        cls.message.target_groups.add(cls.group)
+        cls.user = NotificationUser.objects.create(
+            external_id=1, email='user@example.com', phone='+70000000000',
+            telegram='@Some_User', group=cls.group
+        )
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotRegex(plan, r'SCAN notifications_notificationuser(?! USING)')
+
+    def test_telegram_username_is_normalized(self):
+        self.assertEqual(self.user.telegram_username, 'some_user')
+
+    def test_target_users_of_groups(self):
+        queryset = self.message.get_target_users().order_by('id').values_list('id', flat=True)
+        self.assertUsesIndex(queryset, 'notif_user_group_active_idx')
+
+    def test_target_users_send_to_all(self):
+        self.message.send_to_all = True
+        queryset = self.message.get_target_users().order_by('id').values_list('id', flat=True)
+        self.assertUsesIndex(queryset, 'notif_user_active_idx')
+
+    def test_telegram_lookup(self):
+        queryset = NotificationUser.objects.filter(
+            telegram_username=NotificationUser.normalize_telegram('@SOME_USER')
+        ).values_list('telegram_chat_id', flat=True)
+        self.assertEqual(list(queryset), [None])
+        self.assertUsesIndex(queryset, 'telegram_username')
+
+    def test_user_list_group_filter(self):
+        queryset = NotificationUser.objects.select_related('group').filter(group_id=self.group.id)
+        self.assertUsesIndex(queryset, 'group_id')
+
+    def test_logs_keyset_page(self):
+        queryset = NotificationLog.objects.filter(status='success').order_by('-sent_at', '-id')[:51]
+        self.assertIn('notif_log_status_sent_idx', queryset.explain())
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Фиксированный бюджет SQL запросов для каждой страницы
+
+    Данных создается по несколько штук каждого вида, поэтому запрос на строку
+    (N+1) виден и как превышение бюджета, и как повтор шаблона запроса.
+    """
+
+    # Повторы одного шаблона допустимы до этого числа (админка дважды считает COUNT)
+    DUPLICATE_THRESHOLD = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.groups = [
+            UserGroup.objects.create(name=f'Группа {index}') for index in range(3)
+        ]
+        cls.users = [
+            NotificationUser.objects.create(
+                external_id=index, email=f'user{index}@example.com', phone=f'+7900000000{index}',
+                telegram=f'@user{index}', group=cls.groups[index % 3], is_active=index % 4 != 0
+            )
+            for index in range(9)
+        ]
+        cls.messages = []
+        for index in range(4):
+            message = NotificationMessage.objects.create(
+                title=f'Сообщение {index}', content='Текст', created_by=cls.admin,
+                delivery_methods=['email', 'sms']
+            )
+            message.target_groups.add(*cls.groups[:2])
+            cls.messages.append(message)
+        NotificationLog.objects.bulk_create([
+            NotificationLog(message=message, user=user, delivery_method='email', status='success')
+            for message in cls.messages
+            for user in cls.users
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def assertQueryBudget(self, url, budget):
+        with QueryRecorder() as recorder:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLessEqual(
+            recorder.count, budget,
+            f'{url}: {recorder.count} запросов при бюджете {budget}:\n' +
+            '\n'.join(query['sql'] for query in recorder.queries)
+        )
+        self.assertEqual(recorder.duplicates(self.DUPLICATE_THRESHOLD), {}, url)
+        return recorder
+
+    def test_pages(self):
+        user, group, message = self.users[1], self.groups[0], self.messages[0]
+        budgets = [
+            ('dashboard', {}, 9),
+            ('user_list', {}, 6),
+            ('user_create', {}, 3),
+            ('user_edit', {'user_id': user.id}, 4),
+            ('user_delete', {'user_id': user.id}, 4),
+            ('import_users', {}, 2),
+            ('group_list', {}, 3),
+            ('group_create', {}, 2),
+            ('group_edit', {'group_id': group.id}, 4),
+            ('group_delete', {'group_id': group.id}, 5),
+            ('message_list', {}, 5),
+            ('message_create', {}, 3),
+            ('message_send', {'message_id': message.id}, 7),
+            ('logs', {}, 4),
+        ]
+        for name, kwargs, budget in budgets:
+            with self.subTest(name):
+                self.assertQueryBudget(reverse(name, kwargs=kwargs), budget)
+
+    def test_logs_filtered(self):
+        self.assertQueryBudget(reverse('logs') + '?status=success&method=email', 4)
+
+    def test_dashboard_is_cached(self):
+        self.assertQueryBudget(reverse('dashboard'), 9)
+        # Повторно остаются запросы сессии, пользователя и состояния каналов
+        self.assertQueryBudget(reverse('dashboard'), 3)
+
+    def test_bulk_action(self):
+        selected = ','.join(str(user.id) for user in self.users)
+        with QueryRecorder() as recorder:
+            response = self.client.post(
+                reverse('bulk_action'), {'action': 'deactivate', 'selected_users': selected}
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertLessEqual(recorder.count, 5)
+
+    def test_admin_changelists(self):
+        for model in admin.site._registry:
+            opts = model._meta
+            with self.subTest(opts.label):
+                self.assertQueryBudget(
+                    reverse(f'admin:{opts.app_label}_{opts.model_name}_changelist'), 6
+                )
+
+
+class KeysetPaginationTests(TestCase):
+    """Keyset пагинация логов по (sent_at, id): переходы вперед и назад без пропусков"""
+
+    def setUp(self):
+        group = UserGroup.objects.create(name='Группа')
+        user = NotificationUser.objects.create(external_id=1, email='user@example.com', group=group)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        message = NotificationMessage.objects.create(
+            title='Тема', content='Текст', delivery_methods=['email'], created_by=self.admin
+        )
+        NotificationLog.objects.bulk_create([
+            NotificationLog(message=message, user=user, delivery_method='email', status='success')
+            for _ in range(7)
+        ])
+        # Несколько записей с одинаковым sent_at: порядок между ними задает id
+        base = timezone.now()
+        logs = list(NotificationLog.objects.order_by('id'))
+        for log, minutes in zip(logs, (1, 2, 2, 2, 3, 4, 4)):
+            NotificationLog.objects.filter(id=log.id).update(sent_at=base + timedelta(minutes=minutes))
+        self.ids = [log.id for log in reversed(logs)]
+
+    def page(self, **cursor):
+        return keyset_paginate(NotificationLog.objects.all(), 3, **cursor)
+
+    def test_next_and_previous_pages(self):
+        first = self.page()
+        self.assertEqual([log.id for log in first], self.ids[:3])
+        self.assertEqual((first.has_previous, first.has_next), (False, True))
+
+        second = self.page(after=first.next_cursor)
+        self.assertEqual([log.id for log in second], self.ids[3:6])
+        self.assertEqual((second.has_previous, second.has_next), (True, True))
+
+        last = self.page(after=second.next_cursor)
+        self.assertEqual([log.id for log in last], self.ids[6:])
+        self.assertEqual((last.has_previous, last.has_next), (True, False))
+
+        # Назад - те же страницы в том же порядке
+        back = self.page(before=last.previous_cursor)
+        self.assertEqual([log.id for log in back], self.ids[3:6])
+        self.assertEqual((back.has_previous, back.has_next), (True, True))
+
+        back = self.page(before=back.previous_cursor)
+        self.assertEqual([log.id for log in back], self.ids[:3])
+        self.assertEqual((back.has_previous, back.has_next), (False, True))
+
+    def test_broken_cursor_opens_first_page(self):
+        self.assertEqual([log.id for log in self.page(after='не курсор')], self.ids[:3])
+
+    def test_links_keep_filters(self):
+        # На странице логов по 50 записей
+        log = NotificationLog.objects.first()
+        NotificationLog.objects.bulk_create([
+            NotificationLog(message=log.message, user=log.user, delivery_method='email', status='success')
+            for _ in range(50)
+        ])
+        self.client.force_login(self.admin)
+
+        response = self.client.get(reverse('logs'), {'status': 'success', 'method': 'email'})
+        page_obj = response.context['page_obj']
+        content = html.unescape(response.content.decode())
+        self.assertIn(f'?after={page_obj.next_cursor}&status=success&method=email', content)
+        self.assertNotIn('?before=', content)
+
+        response = self.client.get(reverse('logs'), {'after': page_obj.next_cursor, 'status': 'success'})
+        page_obj = response.context['page_obj']
+        content = html.unescape(response.content.decode())
+        self.assertEqual(len(page_obj), 7)
+        self.assertIn(f'?before={page_obj.previous_cursor}&status=success', content)
+        self.assertNotIn('?after=', content)
+
+
+@mock.patch('notifications.views.PREVIEW_SAMPLE_SIZE', 5)
+class MessagePreviewTests(TestCase):
+    """Превью рассылки: сводка считается в базе, получатели показываются страницами"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(self.admin)
+        self.groups = [UserGroup.objects.create(name=name) for name in ('Альфа', 'Бета')]
+        self.message = NotificationMessage.objects.create(
+            title='Тема', content='Текст', delivery_methods=['email', 'sms'], created_by=self.admin
+        )
+        self.message.target_groups.add(*self.groups)
+        self.add_users(8)
+
+    def add_users(self, count):
+        start = NotificationUser.objects.count()
+        NotificationUser.objects.bulk_create([
+            NotificationUser(
+                external_id=index, email=f'user{index}@example.com',
+                phone='' if index % 2 else f'+7900000{index:04d}', group=self.groups[index % 3 == 0]
+            )
+            for index in range(start, start + count)
+        ])
+
+    def preview(self, **params):
+        with QueryRecorder() as recorder:
+            response = self.client.get(reverse('message_send', args=[self.message.id]), params)
+        self.assertEqual(response.status_code, 200)
+        return response, recorder.count
+
+    def test_sample_is_paged(self):
+        response, _ = self.preview()
+        ids = list(NotificationUser.objects.order_by('id').values_list('id', flat=True))
+        self.assertEqual([user.id for user in response.context['sample_users']], ids[:5])
+        self.assertEqual(response.context['sample_next'], ids[4])
+        self.assertTrue(response.context['sample_is_first'])
+
+        response, _ = self.preview(after=ids[4])
+        self.assertEqual([user.id for user in response.context['sample_users']], ids[5:])
+        self.assertIsNone(response.context['sample_next'])
+        self.assertFalse(response.context['sample_is_first'])
+
+    def test_aggregates(self):
+        response, _ = self.preview()
+
+        audience = response.context['audience']
+        self.assertEqual((audience['total'], audience['email'], audience['phone']), (8, 8, 4))
+        self.assertEqual(response.context['total_recipients'], 8)
+        self.assertEqual(
+            [(group['group__name'], group['total']) for group in response.context['audience_groups']],
+            [('Альфа', 5), ('Бета', 3)]
+        )
+
+    def test_query_count_does_not_depend_on_audience(self):
+        _, small = self.preview()
+        self.add_users(100)
+        response, large = self.preview()
+
+        self.assertEqual(response.context['audience']['total'], 108)
+        self.assertEqual(len(response.context['sample_users']), 5)
+        self.assertEqual(small, large)
+
+
+class AudienceStatsTests(TestCase):
+    """Сводка по получателям рассылки считается агрегатами в базе"""
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.alpha, self.beta, self.other = [
+            UserGroup.objects.create(name=name) for name in ('Альфа', 'Бета', 'Другая')
+        ]
+        users = [
+            (self.alpha, 'a@example.com', '+79000000001', 101),
+            (self.alpha, 'b@example.com', '', None),
+            (self.beta, ' A@Example.com', '89000000001', 101),
+            (self.beta, '', '+79000000003', None),
+            (self.other, 'c@example.com', '+79000000004', 104),
+        ]
+        for index, (group, email, phone, chat_id) in enumerate(users):
+            NotificationUser.objects.create(
+                external_id=index, email=email, phone=phone, telegram_chat_id=chat_id, group=group
+            )
+        # Неактивные пользователи в сводку не попадают
+        NotificationUser.objects.create(
+            external_id=99, email='a@example.com', phone='+79000000001', group=self.alpha, is_active=False
+        )
+        self.message = NotificationMessage.objects.create(
+            title='Тема', content='Текст', delivery_methods=['email', 'telegram'], created_by=self.author
+        )
+        self.message.target_groups.add(self.alpha, self.beta)
+
+    def test_totals_and_groups(self):
+        totals, groups = self.message.get_audience_stats()
+
+        self.assertEqual(
+            [(group['group__name'], group['total'], group['email'], group['phone'], group['telegram'])
+             for group in groups],
+            [('Альфа', 2, 2, 1, 1), ('Бета', 2, 1, 2, 1)]
+        )
+        self.assertEqual(
+            {field: totals[field] for field in ('total', 'email', 'phone', 'telegram')},
+            {'total': 4, 'email': 3, 'phone': 3, 'telegram': 2}
+        )
+        # Повторы между группами: email без учета регистра и пробелов, телефон в E.164, chat_id
+        self.assertEqual(totals['duplicates'], {'email': 1, 'phone': 1, 'telegram': 1})
+        # Считаются только способы доставки сообщения (email и telegram)
+        self.assertEqual(totals['duplicates_total'], 2)
+
+    def test_send_to_all(self):
+        self.message.send_to_all = True
+
+        totals, groups = self.message.get_audience_stats()
+
+        self.assertEqual([group['group__name'] for group in groups], ['Альфа', 'Бета', 'Другая'])
+        self.assertEqual(totals['total'], 5)
+
+    def test_empty_audience(self):
+        self.message.target_groups.clear()
+
+        totals, groups = self.message.get_audience_stats()
+
+        self.assertEqual(groups, [])
+        self.assertEqual(totals['total'], 0)
+        self.assertEqual(totals['duplicates_total'], 0)
+
+
+class JsonArrayImportTests(unittest.TestCase):
+    """Потоковый разбор JSON массива при импорте пользователей"""
+
+    def parse(self, text, **kwargs):
+        return list(iter_json_array(io.StringIO(text), chunk_size=8, **kwargs))
+
+    def test_items_across_chunks(self):
+        self.assertEqual(self.parse('[{"id": 1}, {"id": 2}]'), [{'id': 1}, {'id': 2}])
+
+    def test_malformed_arrays_are_rejected(self):
+        for text in ('[{"id": 1},]', '[,{"id": 1}]', '[{"id": x}]', '[{"id": 1} {"id": 2}]'):
+            with self.subTest(text), self.assertRaises(ValueError):
+                self.parse(text)
+
+    def test_item_size_is_limited(self):
+        with self.assertRaises(ValueError):
+            self.parse('[{"id": "' + 'x' * 1000 + '"}]', max_item_size=100)
+
+
+class UserImportTests(TestCase):
+    """Импорт пользователей: запись изменений и деактивация отсутствующих в полном снимке"""
+
+    def setUp(self):
+        self.group = UserGroup.objects.create(name='Старая')
+        for external_id in range(1, 5):
+            NotificationUser.objects.create(
+                external_id=external_id, email=f'user{external_id}@example.com',
+                phone=f'+7900000000{external_id}', telegram=f'@user{external_id}', group=self.group
+            )
+
+    def record(self, external_id, **fields):
+        return {
+            'id': external_id, 'email': f'user{external_id}@example.com', 'phone': f'+7900000000{external_id}',
+            'telegram': f'@user{external_id}', 'group': 'Старая', **fields,
+        }
+
+    def run_import(self, records, **kwargs):
+        data = '\n'.join(json.dumps(record, ensure_ascii=False) for record in records)
+        return import_users_stream(io.BytesIO(data.encode()), 'ndjson', **kwargs)
+
+    def active_ids(self):
+        return set(NotificationUser.objects.filter(is_active=True).values_list('external_id', flat=True))
+
+    def test_delta_keeps_missing_users(self):
+        # Пользователь 1 без изменений, 2 - перенесен в новую группу, 5 - новый
+        result = self.run_import([self.record(1), self.record(2, group='Новая'), self.record(5)])
+
+        self.assertEqual((result.created, result.updated, result.unchanged), (1, 1, 1))
+        self.assertEqual(result.deactivated, 0)
+        self.assertEqual(self.active_ids(), {1, 2, 3, 4, 5})
+        self.assertEqual(NotificationUser.objects.get(external_id=2).group.name, 'Новая')
+        self.assertFalse(NotificationUser.objects.exclude(import_run='').exists())
+
+    def test_full_snapshot_deactivates_missing_users(self):
+        NotificationUser.objects.filter(external_id=4).update(is_active=False)
+        records = [
+            self.record(1),
+            self.record(2, phone='+79110000002'),
+            # Запись с ошибкой: пользователь в снимке есть, деактивировать его нельзя
+            self.record(3, email=''),
+            self.record(4),
+            self.record(5),
+        ]
+
+        result = self.run_import(records, batch_size=2, full_snapshot=True)
+
+        self.assertEqual((result.created, result.updated, result.unchanged), (1, 2, 1))
+        self.assertEqual(result.error_count, 1)
+        self.assertEqual(self.active_ids(), {1, 2, 3, 4, 5})
+        self.assertEqual(result.deactivated, 0)
+
+        # Следующий снимок без пользователей 2 и 3: деактивируются они, пометки прошлого импорта не мешают
+        result = self.run_import([self.record(1), self.record(4), self.record(5)], full_snapshot=True)
+
+        self.assertEqual(result.unchanged, 3)
+        self.assertEqual(result.deactivated, 2)
+        self.assertEqual(self.active_ids(), {1, 4, 5})
+
+    def test_failed_batch_users_are_not_deactivated(self):
+        with mock.patch.object(NotificationUser.objects, 'bulk_create', side_effect=OperationalError('locked')):
+            result = self.run_import([self.record(1, phone='+79110000001'), self.record(2)], full_snapshot=True)
+
+        self.assertEqual(result.error_count, 2)
+        self.assertEqual(result.deactivated, 2)
+        self.assertEqual(self.active_ids(), {1, 2})
+
+    def test_batch_query_count_does_not_depend_on_size(self):
+        queries = {}
+        for size, start in ((5, 100), (50, 1000)):
+            importer = UserImporter(full_snapshot=True)
+            rows = [self.record(external_id, group=f'Группа {size}') for external_id in range(start, start + size)]
+            with QueryRecorder() as created:
+                importer.import_batch(rows)
+
+            # Половина пакета изменилась, половина - нет
+            rows = [
+                self.record(external_id, group=f'Группа {size}', **({'phone': '+79110000000'} if external_id % 2 else {}))
+                for external_id in range(start, start + size)
+            ]
+            with QueryRecorder() as updated:
+                importer.import_batch(rows)
+
+            result = importer.result
+            self.assertEqual(
+                (result.created, result.updated, result.unchanged, result.error_count),
+                (size, size // 2, size - size // 2, 0)
+            )
+            queries[size] = (created.count, updated.count)
+
+        self.assertEqual(queries[5], queries[50])
+
+    def test_truncated_file_skips_deactivation(self):
+        data = io.BytesIO(json.dumps([self.record(1)]).encode()[:-1])
+
+        result = import_users_stream(data, 'json', full_snapshot=True)
+
+        self.assertTrue(result.aborted)
+        self.assertEqual(result.deactivated, 0)
+        self.assertEqual(self.active_ids(), {1, 2, 3, 4})
+
+
+class TelegramRateLimitTests(TestCase):
+    """Ограничение частоты Telegram: общий лимит бота и пауза после 429 видны всем процессам"""
+
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        clock = mock.patch('notifications.ratelimit.time')
+        self.clock = clock.start()
+        self.addCleanup(clock.stop)
+        self.clock.time.side_effect = lambda: self.now
+        self.clock.monotonic.side_effect = lambda: self.now
+
+    def test_token_bucket_refills_up_to_capacity(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        bucket.updated_at = self.now
+        for _ in range(2):
+            self.assertEqual(bucket.delay(self.now), 0)
+            bucket.consume()
+        self.assertEqual(bucket.delay(self.now), 0.5)
+
+        bucket.delay(self.now + 10)
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_global_limit_is_shared_between_processes(self):
+        # Два ограничителя с общим кэшем - как два воркера Celery
+        first, second = TelegramRateLimiter(global_rate=2), TelegramRateLimiter(global_rate=2)
+
+        self.assertEqual(first._try_acquire(1), 0)
+        self.assertEqual(second._try_acquire(2), 0)
+        self.now += 0.25
+        self.assertEqual(second._try_acquire(3), 0.75)
+
+        self.now += 0.75
+        self.assertEqual(first._try_acquire(3), 0)
+
+    def test_per_chat_limit(self):
+        limiter = TelegramRateLimiter(global_rate=30, per_chat_rate=1)
+
+        self.assertEqual(limiter._try_acquire(1), 0)
+        self.assertEqual(limiter._try_acquire(1), 1)
+        self.assertEqual(limiter._try_acquire(2), 0)
+
+    def test_pause_is_shared_between_processes(self):
+        first, second = TelegramRateLimiter(), TelegramRateLimiter()
+
+        first.pause(5)
+        first.pause(1)
+        self.assertEqual(second._try_acquire(1), 5)
+
+        self.now += 5
+        self.assertEqual(second._try_acquire(1), 0)
+
+    @override_settings(TELEGRAM_MAX_RETRY_AFTER_ATTEMPTS=3)
+    def test_retry_after_pauses_and_repeats_send(self):
+        limited = mock.Mock(status_code=429)
+        limited.json.return_value = {'ok': False, 'parameters': {'retry_after': 3}}
+        service = TelegramService()
+        service.bot = mock.Mock()
+
+        with mock.patch('notifications.services.get_http_session') as session, \
+                mock.patch('notifications.services.telegram_rate_limiter') as limiter:
+            session.return_value.post.side_effect = [limited, limited, mock.Mock(status_code=200)]
+            self.assertEqual(service.send('123', 'Текст'), (True, ''))
+
+        self.assertEqual(limiter.acquire.call_args_list, [mock.call(123)] * 3)
+        self.assertEqual(limiter.pause.call_args_list, [mock.call(3.0)] * 2)
+
+
+class TelegramChatIdCacheTests(TestCase):
+    """Отправка по username использует chat_id, собранный в любом процессе"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = NotificationUser.objects.create(
+            external_id=1, email='user@example.com', phone='+79000000001', telegram='@User',
+            telegram_chat_id=111, group=UserGroup.objects.create(name='Группа')
+        )
+        self.service = TelegramService()
+        self.service.bot = mock.Mock()
+
+    def sent_chat_ids(self):
+        with mock.patch('notifications.services.get_http_session') as session:
+            session.return_value.post.return_value = mock.Mock(status_code=200)
+            self.assertEqual(self.service.send('@user', 'Текст'), (True, ''))
+        return session.return_value.post.call_args.kwargs['json']['chat_id']
+
+    def test_collected_chat_id_is_used(self):
+        # У воркера рассылки и у коллектора свои экземпляры кэша, как в разных процессах
+        worker_cache, collector_cache = TelegramChatIdCache(), TelegramChatIdCache()
+        with mock.patch('notifications.services.telegram_chat_id_cache', worker_cache):
+            self.assertEqual(self.sent_chat_ids(), 111)
+
+        # Пользователь сменил аккаунт: chat_id собран в другом процессе (webhook, collect_telegram_ids)
+        with mock.patch('notifications.services.telegram_chat_id_cache', collector_cache):
+            updated = TelegramChatIdCollector().process_updates([
+                {'update_id': 1, 'message': {'chat': {'id': 222, 'username': 'User'}}}
+            ])
+        self.assertEqual(updated, 1)
+
+        with mock.patch('notifications.services.telegram_chat_id_cache', worker_cache):
+            self.assertEqual(self.sent_chat_ids(), 222)
+
+
+class TelegramCollectorTests(TestCase):
+    """Сбор chat_id через getUpdates: номер последнего обновления хранится в базе"""
+
+    def setUp(self):
+        self.user = NotificationUser.objects.create(
+            external_id=1, email='user@example.com', phone='+79000000001', telegram='@user',
+            group=UserGroup.objects.create(name='Группа')
+        )
+        session = mock.patch('notifications.services.get_http_session')
+        self.addCleanup(session.stop)
+        self.get = session.start().return_value.get
+
+    def respond(self, *updates):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'ok': True, 'result': list(updates)}
+        return response
+
+    def sent_offsets(self):
+        return [call.kwargs['params'].get('offset') for call in self.get.call_args_list]
+
+    def test_offset_is_persisted(self):
+        self.get.side_effect = [
+            self.respond(
+                {'update_id': 5, 'message': {'chat': {'id': 111, 'username': 'user'}}},
+                {'update_id': 6, 'message': 'не сообщение'},
+            ),
+            self.respond(),
+        ]
+
+        # Каждый вызов - как новый процесс: номер обновления читается из базы
+        self.assertEqual(TelegramChatIdCollector()._process_updates(), 2)
+        self.assertEqual(TelegramChatIdCollector()._process_updates(), 0)
+
+        self.assertEqual(self.sent_offsets(), [None, 7])
+        self.assertEqual(TelegramCollectorState.load().last_update_id, 6)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.telegram_chat_id, 111)
+
+        # Номер только растет
+        TelegramCollectorState.save_offset(3)
+        self.assertEqual(TelegramCollectorState.load().last_update_id, 6)
+
+    def test_network_error_keeps_offset(self):
+        TelegramCollectorState.save_offset(10)
+        self.get.side_effect = [
+            requests.ConnectionError('нет сети'),
+            mock.Mock(status_code=502),
+            self.respond({'update_id': 11, 'message': {'chat': {'id': 111, 'username': 'user'}}}),
+        ]
+        collector = TelegramChatIdCollector()
+
+        self.assertIsNone(collector._process_updates())
+        self.assertIsNone(collector._process_updates())
+        self.assertEqual(TelegramCollectorState.load().last_update_id, 10)
+
+        self.assertEqual(collector._process_updates(), 1)
+        self.assertEqual(self.sent_offsets(), [11, 11, 11])
+        self.assertEqual(TelegramCollectorState.load().last_update_id, 11)
+
+    def test_collect_once_reports_network_error(self):
+        self.get.side_effect = requests.Timeout('timeout')
+
+        with self.assertRaises(CommandError):
+            call_command('collect_telegram_ids', '--once', stdout=io.StringIO())
+        self.assertIsNone(TelegramCollectorState.load().last_update_id)
+
+
+@override_settings(TELEGRAM_WEBHOOK_SECRET='test-secret')
+class TelegramWebhookTests(TestCase):
+    """Обновления Telegram, присланные на webhook, обновляют chat_id пользователей"""
+
+    HEADER = 'HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN'
+
+    def setUp(self):
+        group = UserGroup.objects.create(name='Группа')
+        self.user = NotificationUser.objects.create(
+            external_id=1, email='user@example.com', phone='+70000000000',
+            telegram='@Some_User', group=group
+        )
+        # Пакет из двух обновлений обрабатывается в запросе, меньше - явным flush()
+        self.buffer = TelegramUpdateBuffer(batch_size=2, background=False)
+        patcher = mock.patch('notifications.views.telegram_update_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_update(self, update_id, username, chat_id, secret='test-secret'):
+        update = {'update_id': update_id, 'message': {'chat': {'id': chat_id, 'username': username}}}
+        return self.client.post(
+            reverse('telegram_webhook'), json.dumps(update),
+            content_type='application/json', **{self.HEADER: secret}
+        )
+
+    def test_updates_are_processed_in_batches(self):
+        self.assertEqual(self.post_update(1, 'some_user', 111).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.telegram_chat_id)
+
+        self.assertEqual(self.post_update(2, 'other_user', 222).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.telegram_chat_id, 111)
+
+    def test_update_is_saved_before_response(self):
+        self.assertEqual(self.post_update(1, 'some_user', 111).status_code, 200)
+        # Telegram повторяет обновление, если не дождался ответа
+        self.assertEqual(self.post_update(1, 'some_user', 111).status_code, 200)
+        self.assertEqual(list(TelegramWebhookUpdate.objects.values_list('update_id', flat=True)), [1])
+
+        with mock.patch('notifications.services.telegram_collector.process_updates', side_effect=OperationalError):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertTrue(TelegramWebhookUpdate.objects.exists())
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertFalse(TelegramWebhookUpdate.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.telegram_chat_id, 111)
+
+    def test_malformed_update_does_not_block_queue(self):
+        TelegramWebhookUpdate.objects.create(update_id=1, payload={'update_id': 1, 'message': 'oops'})
+        self.post_update(2, 'some_user', 111)
+
+        with mock.patch.object(TelegramChatIdCollector, '_extract_chat', side_effect=[AttributeError, AttributeError, ('some_user', 111)]):
+            self.assertEqual(self.buffer.flush(), 2)
+
+        self.assertFalse(TelegramWebhookUpdate.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.telegram_chat_id, 111)
+
+    def test_malformed_chat_is_ignored(self):
+        for update in (
+            {'update_id': 1, 'message': 'oops'},
+            {'update_id': 1, 'message': {'chat': []}},
+            {'update_id': 1, 'message': {'chat': {'id': '111', 'username': 'user'}}},
+            {'update_id': 1, 'message': {'chat': {'id': 111, 'username': 5}}},
+        ):
+            with self.subTest(update):
+                self.assertIsNone(TelegramChatIdCollector._extract_chat(update))
+
+    def test_wrong_update_types_are_rejected(self):
+        for update in ({'update_id': '1'}, {'update_id': True}, {'update_id': 1, 'message': 'oops'}):
+            with self.subTest(update):
+                response = self.client.post(
+                    reverse('telegram_webhook'), json.dumps(update),
+                    content_type='application/json', **{self.HEADER: 'test-secret'}
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(TelegramWebhookUpdate.objects.exists())
+
+    def test_wrong_secret_is_rejected(self):
+        self.assertEqual(self.post_update(1, 'some_user', 111, secret='wrong').status_code, 403)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_invalid_payload_is_rejected(self):
+        response = self.client.post(
+            reverse('telegram_webhook'), 'not json',
+            content_type='application/json', **{self.HEADER: 'test-secret'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(TELEGRAM_WEBHOOK_SECRET='')
+    def test_disabled_without_secret(self):
+        self.assertEqual(self.post_update(1, 'some_user', 111).status_code, 404)
+
+
+class BroadcastFixtureMixin:
+    """
+    Общие данные тестов рассылки: автор, группа, users_count пользователей
+
+    Отправка email и SMS перехватывается: отправленное копится в self.sent
+    парами (способ, адрес), результат email задает email_result, SMS
+    доставляются всегда.
+    """
+
+    users_count = 5
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user('author')
+        self.group = UserGroup.objects.create(name='Группа')
+        self.users = [
+            NotificationUser.objects.create(
+                external_id=i, email=f'user{i}@example.com', phone=f'+7000000000{i}', group=self.group
+            )
+            for i in range(self.users_count)
+        ]
+        self.sent = []
+        self.start_patchers(
+            mock.patch.object(EmailService, 'send', self.send_email),
+            mock.patch.object(SMSService, 'send_batch', self.send_sms),
+        )
+
+    def start_patchers(self, *patchers):
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create_message(self, **fields):
+        return NotificationMessage.objects.create(
+            title='Тема', content='Текст', send_to_all=True, created_by=self.author, **fields
+        )
+
+    def email_result(self, to):
+        return True, ''
+
+    def send_email(self, to, message, subject):
+        self.sent.append(('email', to))
+        return self.email_result(to)
+
+    def send_sms(self, phones, message, subject):
+        self.sent.extend(('sms', phone) for phone in phones)
+        return [(True, '')] * len(phones)
+
+    def sent_to(self, method='email'):
+        return [address for sent_method, address in self.sent if sent_method == method]
+
+
+class SmartOrderTests(BroadcastFixtureMixin, TestCase):
+    """Режим smart_order: порядок способов по истории доставок пользователя"""
+
+    users_count = 3
+
+    def setUp(self):
+        super().setUp()
+        self.message = self.create_message(delivery_methods=['email', 'sms'], smart_order=True)
+
+    def email_result(self, to):
+        return to != 'user1@example.com', 'Ошибка'
+
+    def test_preferred_channel_is_tried_first(self):
+        UserChannelPreference.objects.create(user=self.users[0], email_failed=5, sms_success=3)
+
+        self.assertEqual(deliver_to_users(self.message, self.users), (3, 3))
+
+        # Первому пользователю email не отправлялся, второму - отправлен и не дошел
+        self.assertNotIn(('email', 'user0@example.com'), self.sent)
+        self.assertIn(('email', 'user1@example.com'), self.sent)
+        self.assertEqual(
+            list(NotificationLog.objects.order_by('user__external_id').values_list('delivery_method', flat=True)),
+            ['sms', 'sms', 'email']
+        )
+
+    def test_preferences_are_updated_incrementally(self):
+        deliver_to_users(self.message, self.users)
+        deliver_to_users(self.message, self.users)
+
+        preference = UserChannelPreference.objects.get(user=self.users[1])
+        # Вторая рассылка начинает с SMS: email больше не пробуется
+        self.assertEqual((preference.email_failed, preference.sms_success), (1, 2))
+        self.assertEqual(preference.order(['email', 'sms']), ['sms', 'email'])
+
+
+class NotificationLogBufferTests(TestCase):
+    """Буфер логов: запись пакетами и сохранение записей при ошибке"""
+
+    def setUp(self):
+        group = UserGroup.objects.create(name='Группа')
+        self.users = [
+            NotificationUser.objects.create(external_id=index, email=f'user{index}@example.com', group=group)
+            for index in range(3)
+        ]
+        self.message = NotificationMessage.objects.create(
+            title='Тема', content='Текст', delivery_methods=['email'], created_by=User.objects.create_user('author')
+        )
+
+    def add(self, log_buffer, user):
+        log_buffer.add(message=self.message, user=user, delivery_method='email', status='success')
+
+    def logs(self):
+        return NotificationLog.objects.filter(message=self.message).count()
+
+    def test_flush_by_batch_size(self):
+        log_buffer = NotificationLogBuffer(batch_size=2, flush_interval=60)
+        self.add(log_buffer, self.users[0])
+        self.assertEqual(self.logs(), 0)
+
+        self.add(log_buffer, self.users[1])
+        self.assertEqual(self.logs(), 2)
+        self.assertEqual(log_buffer.written, 2)
+
+    def test_flush_by_interval(self):
+        with mock.patch('notifications.delivery_log.time') as clock:
+            clock.monotonic.return_value = 100
+            log_buffer = NotificationLogBuffer(batch_size=10, flush_interval=2)
+            self.add(log_buffer, self.users[0])
+            self.assertEqual(self.logs(), 0)
+
+            clock.monotonic.return_value = 102
+            self.add(log_buffer, self.users[1])
+        self.assertEqual(self.logs(), 2)
+
+    def test_failed_flush_keeps_records(self):
+        log_buffer = NotificationLogBuffer(batch_size=10, flush_interval=60)
+        self.add(log_buffer, self.users[0])
+
+        with mock.patch.object(NotificationLog.objects, 'bulk_create', side_effect=OperationalError('locked')):
+            with self.assertRaises(OperationalError):
+                log_buffer.flush()
+        self.assertEqual(self.logs(), 0)
+        # Счетчики откатываются вместе с логами
+        self.assertFalse(MessageDeliveryStats.objects.filter(message=self.message, total__gt=0).exists())
+
+        self.add(log_buffer, self.users[1])
+        self.assertEqual(log_buffer.flush(), 2)
+        self.assertEqual(self.logs(), 2)
+        self.assertEqual(MessageDeliveryStats.objects.get(message=self.message).total, 2)
+
+    def test_exit_on_error_flushes_pending_records(self):
+        with self.assertRaises(RuntimeError):
+            with NotificationLogBuffer(batch_size=10, flush_interval=60) as log_buffer:
+                self.add(log_buffer, self.users[0])
+                raise RuntimeError('сбой отправки')
+
+        self.assertEqual(self.logs(), 1)
+
+    def test_failed_flush_does_not_hide_original_error(self):
+        with mock.patch.object(NotificationLog.objects, 'bulk_create', side_effect=OperationalError('locked')), \
+                self.assertLogs('notifications.delivery_log', 'ERROR'), \
+                self.assertRaises(RuntimeError):
+            with NotificationLogBuffer(batch_size=10, flush_interval=60) as log_buffer:
+                self.add(log_buffer, self.users[0])
+                raise RuntimeError('сбой отправки')
+
+        # Без исходной ошибки сбой записи не скрывается
+        with mock.patch.object(NotificationLog.objects, 'bulk_create', side_effect=OperationalError('locked')), \
+                self.assertRaises(OperationalError):
+            with NotificationLogBuffer(batch_size=10, flush_interval=60) as log_buffer:
+                self.add(log_buffer, self.users[0])
+
+
+class DeliveryLogWriterTests(unittest.TestCase):
+    """NDJSON лог доставки: сжатие, ротация по размеру и дозапись после перезапуска"""
+
+    def setUp(self):
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        self.directory = log_dir.name
+
+    def read_parts(self, writer):
+        records = []
+        for name in sorted(os.listdir(writer.directory)):
+            path = os.path.join(writer.directory, name)
+            opener = gzip.open if name.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8') as log_file:
+                records.extend(json.loads(line) for line in log_file)
+            self.assertTrue(name.startswith(writer.prefix), name)
+        return records
+
+    def test_compression(self):
+        for compression, extension in ((None, '.ndjson'), ('gzip', '.ndjson.gz')):
+            with self.subTest(compression):
+                directory = os.path.join(self.directory, str(compression))
+                with DeliveryLogWriter(directory, compression=compression) as writer:
+                    writer.write({'user_id': 1, 'status': 'success'})
+
+                self.assertEqual(os.listdir(directory), [f'{writer.prefix}_0000{extension}'])
+                self.assertEqual(self.read_parts(writer), [{'user_id': 1, 'status': 'success'}])
+
+    def test_zstd_falls_back_to_gzip(self):
+        with mock.patch('notifications.delivery_log._zstd_available', return_value=False):
+            writer = DeliveryLogWriter(self.directory, compression='zstd')
+        self.assertEqual(writer.extension, '.ndjson.gz')
+
+        with self.assertRaises(ValueError):
+            DeliveryLogWriter(self.directory, compression='bz2')
+
+    def test_rotation_by_size(self):
+        with DeliveryLogWriter(self.directory, compression=None, max_bytes=100) as writer:
+            for user_id in range(10):
+                writer.write({'user_id': user_id, 'status': 'success'})
+
+        self.assertEqual(writer.records, 10)
+        self.assertGreater(len(os.listdir(self.directory)), 1)
+        for name in os.listdir(self.directory):
+            # Файл ротируется после первой записи сверх max_bytes
+            self.assertLess(os.path.getsize(os.path.join(self.directory, name)), 100 + 40)
+        self.assertEqual([record['user_id'] for record in self.read_parts(writer)], list(range(10)))
+
+    def test_reopened_writer_appends_to_last_part(self):
+        with DeliveryLogWriter(self.directory, compression='gzip', max_bytes=10 ** 6) as writer:
+            writer.write({'user_id': 1})
+        with DeliveryLogWriter(self.directory, compression='gzip', max_bytes=10 ** 6) as writer:
+            writer.write({'user_id': 2})
+
+        # Несколько gzip потоков в одном файле читаются как один
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertEqual(self.read_parts(writer), [{'user_id': 1}, {'user_id': 2}])
+
+    def test_part_name_includes_host(self):
+        with mock.patch('notifications.delivery_log.socket.gethostname', return_value='worker_1.local'):
+            writer = DeliveryLogWriter(self.directory, compression=None)
+
+        self.assertTrue(writer.prefix.startswith(f'part_worker-1.local-{os.getpid()}-'), writer.prefix)
+
+
+class DeliveryStatsTests(TestCase):
+    """Счетчики доставки учитывают каждого получателя один раз, по последнему логу"""
+
+    def setUp(self):
+        group = UserGroup.objects.create(name='Группа')
+        self.users = [
+            NotificationUser.objects.create(
+                external_id=index, email=f'user{index}@example.com', phone=f'+7900000000{index}', group=group
+            )
+            for index in range(3)
+        ]
+        self.message = NotificationMessage.objects.create(
+            title='Тема', content='Текст', delivery_methods=['email', 'sms'],
+            created_by=User.objects.create_user('author')
+        )
+
+    def write_logs(self, *results):
+        with NotificationLogBuffer() as log_buffer:
+            for user, method, status in results:
+                log_buffer.add(message=self.message, user=user, delivery_method=method, status=status)
+
+    def stats(self):
+        stats = MessageDeliveryStats.objects.get(message=self.message)
+        return {
+            field: getattr(stats, field)
+            for field in ('total', 'success', 'failed', 'email', 'sms', 'telegram')
+        }
+
+    def test_retry_replaces_previous_result(self):
+        first, second, third = self.users
+        self.write_logs((first, 'email', 'success'), (second, 'email', 'failed'), (third, 'sms', 'failed'))
+        self.assertEqual(
+            self.stats(), {'total': 3, 'success': 1, 'failed': 2, 'email': 2, 'sms': 1, 'telegram': 0}
+        )
+
+        # Повтор неудачных (retry_failed): второй доставлен по SMS, третий снова не доставлен
+        self.write_logs((second, 'sms', 'success'), (third, 'sms', 'failed'))
+        expected = {'total': 3, 'success': 2, 'failed': 1, 'email': 1, 'sms': 2, 'telegram': 0}
+        self.assertEqual(self.stats(), expected)
+        self.assertEqual(NotificationLog.objects.filter(message=self.message).count(), 5)
+
+        # Пересчет по логам дает те же счетчики
+        MessageDeliveryStats.objects.filter(message=self.message).update(total=0, success=0, failed=0)
+        self.assertEqual(MessageDeliveryStats.rebuild([self.message.id]), 1)
+        self.assertEqual(self.stats(), expected)
+
+    def test_repeated_recipient_in_one_batch(self):
+        self.write_logs((self.users[0], 'email', 'failed'), (self.users[0], 'sms', 'success'))
+
+        self.assertEqual(
+            self.stats(), {'total': 1, 'success': 1, 'failed': 0, 'email': 0, 'sms': 1, 'telegram': 0}
+        )
+
+    def test_rebuild_removes_stats_without_logs(self):
+        other = NotificationMessage.objects.create(
+            title='Другое', content='Текст', delivery_methods=['email'], created_by=self.message.created_by
+        )
+        MessageDeliveryStats.objects.create(message=other, total=5, success=5)
+        self.write_logs((self.users[0], 'email', 'success'))
+
+        self.assertEqual(MessageDeliveryStats.rebuild(), 1)
+        self.assertFalse(MessageDeliveryStats.objects.filter(message=other).exists())
+        self.assertEqual(self.stats()['total'], 1)
+
+
+class ResumableBroadcastTests(BroadcastFixtureMixin, TestCase):
+    """Прерванная рассылка продолжается только для недоставленных получателей"""
+
+    def setUp(self):
+        super().setUp()
+        self.message = self.create_message(delivery_methods=['email'])
+
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        self.start_patchers(
+            mock.patch.object(plan_broadcast, 'delay', side_effect=plan_broadcast),
+            # Пакеты выполняются в тесте вручную
+            mock.patch.object(send_message_chunk, 'delay'),
+        )
+        self.enterContext(self.settings(BROADCAST_CHUNK_SIZE=2, DELIVERY_LOG_DIR=log_dir.name))
+
+    def queued_chunks(self):
+        return [call.args for call in send_message_chunk.delay.call_args_list]
+
+    def crash_during(self, task_args):
+        """Пакет взят и получатели отмечены in_flight, но процесс упал до отправки и прошел час"""
+        chunk = BroadcastChunk.claim(*task_args, owner='crashed', lease_seconds=60)
+        MessageDelivery.claim(chunk.message_id, chunk.user_ids)
+        past = timezone.now() - timedelta(hours=1)
+        BroadcastChunk.objects.filter(id=chunk.id).update(lease_expires_at=past)
+        BroadcastChunk.objects.exclude(status=BroadcastChunk.DONE).update(updated_at=past)
+        MessageDelivery.objects.filter(status=MessageDelivery.IN_FLIGHT).update(updated_at=past)
+
+    def test_resume_skips_delivered_recipients(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(enqueue_broadcast(self.message))
+        self.assertEqual(plan_broadcast.delay.call_count, 1)
+        first, second, _ = self.queued_chunks()
+
+        # Первый пакет отправлен, второй упал посреди отправки, третий не начинался
+        send_message_chunk(*first)
+        self.crash_during(second)
+        self.assertEqual(len(self.sent), 2)
+
+        send_message_chunk.delay.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(resume_broadcast(self.message), (2, 3))
+        for chunk in self.queued_chunks():
+            send_message_chunk(*chunk)
+
+        self.assertEqual(sorted(self.sent_to()), sorted(user.email for user in self.users))
+        self.assertEqual(self.message.get_delivery_progress()[MessageDelivery.DONE], 5)
+        self.message.refresh_from_db()
+        self.assertTrue(self.message.is_sent)
+        self.assertIsNone(resume_broadcast(self.message))
+
+    def test_active_chunks_are_not_resumed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_broadcast(self.message)
+        BroadcastChunk.claim(*self.queued_chunks()[0], owner='worker', lease_seconds=60)
+
+        self.assertIsNone(resume_broadcast(self.message))
+
+    def test_send_request_only_queues_planning(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('message_send', args=[self.message.id]))
+
+        self.assertRedirects(response, reverse('message_list'))
+        self.assertFalse(MessageDelivery.objects.exists())
+        self.message.refresh_from_db()
+        self.assertTrue(self.message.is_planning)
+        self.assertFalse(enqueue_broadcast(self.message))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(plan_broadcast.delay.call_args.args, (self.message.id,))
+        self.assertEqual(MessageDelivery.objects.count(), 5)
+        self.assertEqual(len(self.queued_chunks()), 3)
+        # Повторный запуск задачи ничего не делает
+        self.assertIsNone(plan_broadcast(self.message.id))
+
+    def test_interrupted_planning_is_restarted(self):
+        with self.captureOnCommitCallbacks():
+            enqueue_broadcast(self.message)
+        self.assertIsNone(resume_broadcast(self.message))
+
+        NotificationMessage.objects.update(queued_at=timezone.now() - timedelta(hours=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(resume_broadcast(self.message), (0, 0))
+        self.assertEqual(len(self.queued_chunks()), 3)
+
+    def test_resume_only_stalled_broadcast(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_broadcast(self.message)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+        # Пакеты ждут своей очереди: продолжать рано
+        self.assertFalse(self.message.is_stalled)
+        self.assertNotContains(self.client.get(reverse('message_list')), 'Продолжить')
+        self.assertIsNone(resume_broadcast(self.message))
+
+        BroadcastChunk.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        self.message.refresh_from_db()
+        self.assertTrue(self.message.is_stalled)
+        self.assertContains(self.client.get(reverse('message_list')), 'Продолжить')
+        self.assertEqual(resume_broadcast(self.message), (3, 5))
+
+    def test_repeated_chunk_is_not_sent_twice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_broadcast(self.message)
+        chunk = self.queued_chunks()[0]
+
+        send_message_chunk(*chunk)
+        send_message_chunk(*chunk)
+
+        self.assertEqual(len(self.sent), 2)
+
+
+@override_settings(BROADCAST_EXECUTOR='workers', BROADCAST_CHUNK_SIZE=2)
+class BroadcastWorkerTests(BroadcastFixtureMixin, TestCase):
+    """Пакеты рассылки разбираются воркерами по аренде, каждый получатель - один раз"""
+
+    def setUp(self):
+        super().setUp()
+        self.message = self.create_message(delivery_methods=['email'])
+
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        self.start_patchers(mock.patch.object(plan_broadcast, 'delay', side_effect=plan_broadcast))
+        self.enterContext(self.settings(DELIVERY_LOG_DIR=log_dir.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_broadcast(self.message)
+
+    def test_workers_claim_different_chunks(self):
+        first = BroadcastChunk.claim_next('worker-1', lease_seconds=60)
+        second = BroadcastChunk.claim_next('worker-2', lease_seconds=60)
+
+        self.assertNotEqual(first.index, second.index)
+        self.assertEqual(BroadcastChunk.available().count(), 1)
+
+    def expire_lease(self, chunk):
+        BroadcastChunk.objects.filter(id=chunk.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    def run_workers(self):
+        workers = [BroadcastWorker(f'worker-{i}', lease_seconds=60) for i in range(2)]
+        while any([worker.run_once() for worker in workers]):
+            pass
+
+    def test_expired_lease_is_reclaimed(self):
+        chunk = BroadcastChunk.claim_next('crashed', lease_seconds=60)
+        MessageDelivery.claim(self.message.id, chunk.user_ids)
+        self.expire_lease(chunk)
+        # Воркер упал давно: его получатели зависли в in_flight
+        MessageDelivery.objects.filter(status=MessageDelivery.IN_FLIGHT).update(
+            updated_at=timezone.now() - timedelta(hours=1)
+        )
+
+        self.run_workers()
+
+        self.assertEqual(sorted(self.sent_to()), [f'user{i}@example.com' for i in range(5)])
+        self.assertFalse(chunk.complete('crashed'))
+        self.message.refresh_from_db()
+        self.assertTrue(self.message.is_sent)
+        self.assertEqual(self.message.chunks_done, 3)
+
+    def test_lease_expires_while_owner_is_sending(self):
+        chunk = BroadcastChunk.claim_next('slow', lease_seconds=60)
+        claimed = MessageDelivery.claim(self.message.id, chunk.user_ids)
+        self.expire_lease(chunk)
+
+        # Пока первый владелец отправляет, пакет берет другой воркер
+        self.run_workers()
+        self.assertEqual(len(self.sent), 5 - len(claimed))
+        self.assertFalse(chunk.renew('slow', lease_seconds=60))
+        chunk.refresh_from_db()
+        self.assertEqual(chunk.lease_owner, '')
+        self.assertGreater(chunk.lease_expires_at, timezone.now())
+
+        # Первый владелец закончил: результаты записаны, но пакет засчитывает не он
+        MessageDelivery.record_results(self.message.id, [(user_id, 'email', 'success') for user_id in claimed])
+        self.assertFalse(chunk.complete('slow'))
+
+        self.expire_lease(chunk)
+        self.run_workers()
+
+        self.assertEqual(len(self.sent), 5 - len(claimed))
+        self.assertEqual(MessageDelivery.objects.filter(status=MessageDelivery.DONE).count(), 5)
+        self.message.refresh_from_db()
+        self.assertTrue(self.message.is_sent)
+        self.assertEqual(self.message.chunks_done, 3)
+
+
+class AddressDeduplicationTests(BroadcastFixtureMixin, TestCase):
+    """Пользователи с общим адресом получают одну отправку на этот адрес"""
+
+    users_count = 0
+
+    def setUp(self):
+        super().setUp()
+        self.users = [
+            NotificationUser.objects.create(external_id=1, email='Shared@Example.com', phone='+7 900 000-00-01', group=self.group),
+            NotificationUser.objects.create(external_id=2, email='shared@example.com', phone='89000000002', group=self.group),
+            NotificationUser.objects.create(external_id=3, email='', phone='9000000002', group=self.group),
+            NotificationUser.objects.create(external_id=4, email='other@example.com', phone='+79000000004', group=self.group),
+        ]
+        self.message = self.create_message(delivery_methods=['email', 'sms'])
+
+    def test_phone_is_normalized_to_e164(self):
+        self.assertEqual(
+            [user.phone_e164 for user in self.users],
+            ['+79000000001', '+79000000002', '+79000000002', '+79000000004']
+        )
+
+    def test_too_long_phone_is_not_normalized(self):
+        migration = importlib.import_module('notifications.migrations.0013_notificationuser_phone_e164')
+        field_length = NotificationUser._meta.get_field('phone_e164').max_length
+        phones = ['+' + '1' * 15, '+' + '1' * 16, '00' + '1' * 15, '00' + '1' * 16, '1' * 20, '8' * 11]
+
+        for phone in phones:
+            normalized = NotificationUser.normalize_phone(phone)
+            self.assertEqual(migration.normalize_phone(phone), normalized)
+            self.assertLessEqual(len(normalized), field_length)
+        self.assertEqual(
+            [NotificationUser.normalize_phone(phone) for phone in phones],
+            ['+' + '1' * 15, '', '+' + '1' * 15, '', '', '+7' + '8' * 10]
+        )
+
+    def test_one_send_per_address(self):
+        self.assertEqual(deliver_to_users(self.message, self.users), (4, 4))
+
+        # Третий пользователь без email получает SMS на номер второго - оно уже не нужно второму
+        self.assertEqual(
+            sorted(self.sent),
+            [('email', 'other@example.com'), ('email', 'shared@example.com'), ('sms', '+79000000002')]
+        )
+        self.assertEqual(NotificationLog.objects.filter(status='success').count(), 4)
+
+    def test_users_with_shared_address_are_planned_together(self):
+        other_group = UserGroup.objects.create(name='Другая группа')
+        for external_id in range(5, 8):
+            NotificationUser.objects.create(
+                external_id=external_id, email=f'user{external_id}@example.com',
+                phone=f'+7911000000{external_id}', group=other_group
+            )
+        late_duplicate = NotificationUser.objects.create(
+            external_id=8, email='OTHER@example.com', phone='', group=other_group
+        )
+
+        with self.settings(BROADCAST_CHUNK_SIZE=3):
+            chunks = plan_chunks(NotificationUser.objects.all(), self.message.delivery_methods)
+
+        ids = [user.id for user in self.users]
+        self.assertEqual(chunks[0], ids[:3])
+        self.assertIn([ids[3], late_duplicate.id], [chunk[:2] for chunk in chunks])
+        self.assertEqual(sorted(sum(chunks, [])), sorted(NotificationUser.objects.values_list('id', flat=True)))
+
+    def test_shared_placeholder_does_not_grow_chunk(self):
+        for external_id in range(5, 15):
+            NotificationUser.objects.create(
+                external_id=external_id, email=f'user{external_id}@example.com',
+                phone='+70000000000', group=self.group
+            )
+
+        with self.settings(BROADCAST_CHUNK_SIZE=4):
+            chunks = plan_chunks(NotificationUser.objects.all(), self.message.delivery_methods)
+
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 4)
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(sorted(sum(chunks, [])), sorted(NotificationUser.objects.values_list('id', flat=True)))
+
+    def test_only_message_channels_link_users(self):
+        users = NotificationUser.objects.all()
+        ids = [user.id for user in self.users]
+
+        # Первого и второго связывает только email, второго и третьего - только телефон
+        with self.settings(BROADCAST_CHUNK_SIZE=2):
+            self.assertEqual(plan_chunks(users, ['email']), [ids[:2], ids[2:]])
+            self.assertEqual(plan_chunks(users, ['sms']), [ids[:1], ids[1:3], ids[3:]])
+
+    def test_stats_normalize_email_like_sending(self):
+        NotificationUser.objects.create(external_id=5, email=' other@EXAMPLE.com ', phone='', group=self.group)
+        self.message.delivery_methods = ['email']
+
+        totals, _ = self.message.get_audience_stats()
+
+        self.assertEqual(totals['duplicates'], {'email': 2, 'phone': 1, 'telegram': 0})
+        self.assertEqual(totals['duplicates_total'], 2)
+
+    def test_preview_shows_saved_sends(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+        response = self.client.get(reverse('message_send', args=[self.message.id]))
+
+        self.assertEqual(response.context['audience']['duplicates'], {'email': 1, 'phone': 1, 'telegram': 0})
+        self.assertContains(response, 'экономит до 2 отправок')
+
+
+class SMTPConnectionPoolTests(unittest.TestCase):
+    """Пул SMTP: повторное использование соединений, лимит писем и переподключение"""
+
+    def setUp(self):
+        self.servers = []
+        smtp = mock.patch('notifications.services.smtplib.SMTP', side_effect=self.connect)
+        smtp.start()
+        self.addCleanup(smtp.stop)
+        self.pool = SMTPConnectionPool('smtp.example.com', 587, 'user', 'password', size=2, max_messages=2)
+
+    def connect(self, host, port, timeout):
+        server = mock.Mock()
+        self.servers.append(server)
+        return server
+
+    def test_connection_is_closed_after_max_messages(self):
+        for index in range(5):
+            self.pool.send_message(f'письмо {index}')
+
+        self.assertEqual(len(self.servers), 3)
+        self.assertEqual([server.send_message.call_count for server in self.servers], [2, 2, 1])
+        # Авторизация - один раз на соединение
+        self.assertEqual([server.login.call_count for server in self.servers], [1, 1, 1])
+        self.assertEqual([server.quit.called for server in self.servers], [True, True, False])
+
+    def test_broken_connection_is_reopened(self):
+        self.pool.send_message('первое')
+        self.servers[0].send_message.side_effect = smtplib.SMTPServerDisconnected('соединение закрыто')
+
+        self.pool.send_message('второе')
+        self.pool.send_message('третье')
+
+        self.assertEqual(len(self.servers), 2)
+        self.assertTrue(self.servers[0].quit.called)
+        self.assertEqual(
+            self.servers[1].send_message.call_args_list, [mock.call('второе'), mock.call('третье')]
+        )
+
+    def test_rejected_message_keeps_connection(self):
+        self.pool.send_message('первое')
+        self.servers[0].send_message.side_effect = [
+            smtplib.SMTPRecipientsRefused({'user@example.com': (550, b'No such user')}), None
+        ]
+
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            self.pool.send_message('отклонено')
+        self.pool.send_message('второе')
+
+        # Отклоненное письмо не считается отправленным: соединение закрыто после второго письма
+        self.assertEqual(len(self.servers), 1)
+        self.assertEqual(self.servers[0].send_message.call_count, 3)
+        self.assertTrue(self.servers[0].quit.called)
+
+    def test_failed_reconnect_is_not_pooled(self):
+        self.pool.send_message('первое')
+        self.servers[0].send_message.side_effect = smtplib.SMTPServerDisconnected()
+
+        def broken_server(*args, **kwargs):
+            # Новое соединение тоже закрывается сервером (421)
+            server = self.connect(*args, **kwargs)
+            server.send_message.side_effect = smtplib.SMTPResponseException(421, b'Service not available')
+            return server
+
+        with mock.patch('notifications.services.smtplib.SMTP', side_effect=broken_server):
+            with self.assertRaises(smtplib.SMTPResponseException):
+                self.pool.send_message('второе')
+
+        self.pool.send_message('третье')
+        self.assertEqual(len(self.servers), 3)
+        self.assertTrue(self.servers[1].quit.called)
+        self.servers[2].send_message.assert_called_once_with('третье')
+
+
+@override_settings(SMS_API_URL='https://sms.example.com/send', SMS_API_KEY='key', SMS_BATCH_SIZE=3)
+class SMSBatchTests(TestCase):
+    """Пакетная отправка SMS: статусы ответа сопоставляются с номерами по порядку"""
+
+    def setUp(self):
+        self.requests = []
+        self.responses = []
+        session = mock.patch('notifications.services.get_http_session')
+        self.addCleanup(session.stop)
+        session.start().return_value.post.side_effect = self.post
+
+    def post(self, url, data):
+        self.requests.append(data['to'])
+        response = mock.Mock(status_code=200)
+        response.json.return_value = self.responses.pop(0)
+        return response
+
+    def test_statuses_are_mapped_to_numbers(self):
+        self.responses.append({'status': 'OK', 'sms': {
+            '79000000001': {'status': 'OK'},
+            '79000000002': {'status': 'ERROR', 'status_text': 'Номер в стоп-листе'},
+        }})
+
+        results = SMSService().send_batch(['+7 900 000-00-01', '89000000002', '+79000000003'], 'Текст')
+
+        self.assertEqual(self.requests, ['79000000001,89000000002,79000000003'])
+        self.assertEqual(results, [
+            (True, ''),
+            (False, 'SMS API ошибка: Номер в стоп-листе'),
+            (False, 'SMS API не вернул статус для номера'),
+        ])
+        self.assertIsNone(call_outcome(*results[1]))
+
+    def test_duplicate_numbers_are_sent_once(self):
+        self.responses.append({'status': 'OK', 'sms': {'79000000001': {'status': 'OK'}}})
+
+        results = SMSService().send_batch(['+79000000001', '79000000001', ''], 'Текст')
+
+        self.assertEqual(self.requests, ['79000000001'])
+        self.assertEqual(results, [(True, ''), (True, ''), (False, 'SMS API не вернул статус для номера')])
+
+    def test_recipients_are_split_into_batches(self):
+        phones = [f'+7900000000{index}' for index in range(5)]
+        self.responses.append({'status': 'OK', 'sms': {phone[1:]: {'status': 'OK'} for phone in phones[:3]}})
+        self.responses.append({'status': 'ERROR', 'status_text': 'Недостаточно средств'})
+
+        results = SMSService().send_batch(phones, 'Текст')
+
+        self.assertEqual(self.requests, [','.join(phone[1:] for phone in phones[:3]), '79000000003,79000000004'])
+        self.assertEqual(results[:3], [(True, '')] * 3)
+        for success, error in results[3:]:
+            self.assertFalse(success)
+            self.assertIsInstance(error, ProviderError)
+            self.assertEqual(error, 'SMS API ошибка: Недостаточно средств')
+        self.assertFalse(call_outcome(*results[3]))
+
+
+class CircuitBreakerTests(TestCase):
+    """Выключатель канала: closed -> open -> half-open -> closed, состояние общее для процессов"""
+
+    def setUp(self):
+        self.now = timezone.now().timestamp()
+        clock = mock.patch('notifications.circuit.time')
+        self.clock = clock.start()
+        self.addCleanup(clock.stop)
+        self.clock.time.side_effect = lambda: self.now
+        self.clock.monotonic.side_effect = lambda: self.now
+
+    def make_breaker(self):
+        return CircuitBreaker('email', window=4, min_calls=4, open_seconds=60, half_open_calls=2)
+
+    def test_state_transitions(self):
+        breaker = self.make_breaker()
+        for success in (True, False, False, False):
+            self.assertTrue(breaker.allow())
+            breaker.record(success, 0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        # Другой процесс видит отключение через базу
+        self.assertTrue(self.make_breaker().is_open())
+        self.assertEqual(get_channel_states(['email'])['email']['state'], CircuitBreaker.OPEN)
+
+        # После open_seconds - пробные отправки, ошибка получателя их не расходует
+        self.now += 61
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record(None, 0.1)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(True, 0.1)
+        breaker.record(True, 0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(ChannelCircuitState.objects.get(channel='email').state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_opens_again(self):
+        breaker = self.make_breaker()
+        for _ in range(4):
+            breaker.record(False, 0.1)
+        self.now += 61
+        self.assertTrue(breaker.allow())
+        breaker.record(False, 0.1)
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_recipient_errors_are_neutral(self):
+        breaker = self.make_breaker()
+        for _ in range(10):
+            breaker.record(None, 0.1)
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertFalse(ChannelCircuitState.objects.exists())
+
+
+class SendManyTests(TransactionTestCase):
+    """send_many: порядок fallback по волнам и результат в порядке получателей"""
+
+    def setUp(self):
+        self.sent = []
+
+        def send_email(service, to, message, subject):
+            self.sent.append(('email', to))
+            return (False, 'ящик переполнен') if to.startswith('bad') else (True, '')
+
+        def send_sms(service, phones, message, subject):
+            self.sent.append(('sms', tuple(phones)))
+            return [(False, 'номер недоступен') if phone.endswith('2') else (True, '') for phone in phones]
+
+        def send_telegram(service, chat_id, message, subject):
+            self.sent.append(('telegram', chat_id))
+            return True, ''
+
+        for patcher in (
+            mock.patch.object(EmailService, 'send', send_email),
+            mock.patch.object(SMSService, 'send_batch', send_sms),
+            mock.patch.object(TelegramService, 'send', send_telegram),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.recipients = [
+            {'email': 'user0@example.com', 'phone': '+79000000000', 'telegram': '@user0'},
+            {'email': 'bad1@example.com', 'phone': '+79000000001', 'telegram': '@user1'},
+            {'email': 'bad2@example.com', 'phone': '+79000000002', 'telegram': '@user2', 'telegram_chat_id': 222},
+            {'email': 'bad3@example.com', 'phone': '', 'telegram': ''},
+        ]
+
+    def test_fallback_order_and_result_shape(self):
+        attempts = []
+        results = NotificationDeliveryService().send_many_sync(
+            self.recipients, 'Текст', 'Тема', ['email', 'sms', 'telegram'], attempts=attempts
+        )
+
+        self.assertEqual(results, [
+            ('email', 'success', ''),
+            ('sms', 'success', ''),
+            ('telegram', 'success', ''),
+            ('none', 'failed', 'email: ящик переполнен; Отсутствует sms для пользователя; '
+                               'Отсутствует telegram для пользователя'),
+        ])
+        # Волны по способам: следующий способ - только тем, кому не удалось, SMS - одним пакетом
+        self.assertEqual(sorted(self.sent[:4]), sorted(('email', user['email']) for user in self.recipients))
+        self.assertEqual(self.sent[4:], [('sms', ('+79000000001', '+79000000002')), ('telegram', '222')])
+        self.assertEqual(sorted(attempts), [
+            (0, 'email', True), (1, 'email', False), (1, 'sms', True),
+            (2, 'email', False), (2, 'sms', False), (2, 'telegram', True), (3, 'email', False),
+        ])
+
+    def test_methods_by_recipient(self):
+        results = NotificationDeliveryService().send_many_sync(
+            self.recipients[:3], 'Текст', 'Тема', ['email'],
+            methods_by_recipient=[['telegram', 'email'], ['email', 'sms'], ['fax', 'sms']],
+        )
+
+        self.assertEqual(results, [
+            ('telegram', 'success', ''),
+            ('sms', 'success', ''),
+            ('none', 'failed', 'Неизвестный способ доставки: fax; sms: номер недоступен'),
+        ])
+        # Первая волна: Telegram первому получателю параллельно с email второму
+        self.assertEqual(
+            sorted(self.sent[:2]), [('email', 'bad1@example.com'), ('telegram', '@user0')]
+        )
+
+
+class CircuitBreakerSendManyTests(BroadcastFixtureMixin, TransactionTestCase):
+    """send_many пропускает отключенный канал; выключатель работает в потоках пула"""
+
+    users_count = 0
+
+    def setUp(self):
+        super().setUp()
+        self.breakers = {}
+        self.start_patchers(mock.patch(
+            'notifications.services.get_circuit_breaker',
+            lambda method: self.breakers.setdefault(method, CircuitBreaker(method, min_calls=4)),
+        ))
+        self.email_error = ''
+        self.recipients = [
+            {'email': f'user{i}@example.com', 'phone': f'+7900000000{i}'} for i in range(5)
+        ] + [{'email': 'only-email@example.com'}]
+
+    def email_result(self, to):
+        return False, self.email_error
+
+    def send(self):
+        return NotificationDeliveryService().send_many_sync(self.recipients, 'Текст', 'Тема', ['email', 'sms'])
+
+    def test_open_channel_is_skipped(self):
+        ChannelCircuitState.objects.create(
+            channel='email', state=CircuitBreaker.OPEN, opened_until=timezone.now() + timedelta(minutes=1)
+        )
+
+        results = self.send()
+
+        self.assertNotIn('email', [method for method, _ in self.sent])
+        self.assertEqual([method for method, _, _ in results[:5]], ['sms'] * 5)
+        self.assertEqual(results[5][:2], ('none', 'failed'))
+        self.assertIn(CIRCUIT_OPEN_ERROR, results[5][2])
+
+    def test_only_provider_errors_open_channel(self):
+        self.email_error = 'Адрес не существует'
+        self.send()
+        self.assertEqual(self.breakers['email'].state, CircuitBreaker.CLOSED)
+
+        self.email_error = ProviderError('Connection refused')
+        self.send()
+        self.assertEqual(self.breakers['email'].state, CircuitBreaker.OPEN)
+        self.assertEqual(ChannelCircuitState.objects.get(channel='email').state, CircuitBreaker.OPEN)
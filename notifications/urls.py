@@ -23,7 +23,11 @@ urlpatterns = [
     path('messages/', views.message_list, name='message_list'),
     path('messages/create/', views.message_create, name='message_create'),
     path('messages/<int:message_id>/send/', views.message_send, name='message_send'),
+    path('messages/<int:message_id>/resume/', views.message_resume, name='message_resume'),
     
     # Логи
     path('logs/', views.logs, name='logs'),
+    
+    # Webhook Telegram (сбор chat_id без опроса)
+    path('telegram/webhook/', views.telegram_webhook, name='telegram_webhook'),
 ]
@@ -12,42 +12,46 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.http import JsonResponse, HttpResponse
 from django.core.paginator import Paginator
-from django.db import transaction
 from django.db import models
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views.generic import View
-from django.utils import timezone
+from django.conf import settings
+import hmac
 import json
 import os
+from urllib.parse import urlencode
 
 from .models import NotificationUser, UserGroup, NotificationMessage, NotificationLog
 from .forms import (
     NotificationUserForm, UserGroupForm, NotificationMessageForm,
     JsonUploadForm, BulkActionForm
 )
-from .services import (
-    NotificationDeliveryService, load_users_from_json, 
-    save_users_to_json, create_notification_log
-)
+from .circuit import get_channel_states
+from .dashboard import dashboard_cache, get_dashboard_context
+from .importers import detect_format, import_users_stream
+from .pagination import estimated_count, keyset_paginate
+from .tasks import enqueue_broadcast, resume_broadcast
+from .webhooks import telegram_update_buffer
+
+# Каналы доставки в порядке отображения
+CHANNEL_NAMES = [method for method, _ in NotificationMessage.DELIVERY_METHODS]
+
 
 @login_required
 def dashboard(request):
     """Главная панель управления"""
-    context = {
-        'total_users': NotificationUser.objects.filter(is_active=True).count(),
-        'total_groups': UserGroup.objects.count(),
-        'total_messages': NotificationMessage.objects.count(),
-        'recent_messages': NotificationMessage.objects.all()[:5],
-        'recent_logs': NotificationLog.objects.all()[:10],
-    }
+    # Показатели кэшируются и сбрасываются сигналами (см. signals.py)
+    context = get_dashboard_context()
+    # Состояние выключателей каналов читается из базы на каждый запрос
+    context['channel_states'] = get_channel_states(CHANNEL_NAMES)
     return render(request, 'notifications/dashboard.html', context)
 
 
 @login_required
 def user_list(request):
     """Список пользователей"""
-    users = NotificationUser.objects.select_related('group').all()
+    users = NotificationUser.objects.select_related('group').order_by('external_id')
     
     # Фильтрация
     group_filter = request.GET.get('group')
@@ -130,11 +134,10 @@ def user_delete(request, user_id):
 @login_required
 def group_list(request):
     """Список групп"""
-    groups = UserGroup.objects.all()
-    
-    # Добавляем количество пользователей в каждой группе
-    for group in groups:
-        group.user_count = group.users.filter(is_active=True).count()
+    # Количество активных пользователей считается в том же запросе
+    groups = UserGroup.objects.annotate(
+        user_count=models.Count('users', filter=models.Q(users__is_active=True))
+    )
     
     return render(request, 'notifications/group_list.html', {'groups': groups})
 
@@ -184,11 +187,16 @@ def group_delete(request, group_id):
     group = get_object_or_404(UserGroup, id=group_id)
     
     if request.method == 'POST':
-        group.delete()
+        # Каскадное удаление пользователей сбрасывает кэш один раз
+        with dashboard_cache.batch():
+            group.delete()
         messages.success(request, 'Группа успешно удалена')
         return redirect('group_list')
     
-    return render(request, 'notifications/group_delete.html', {'group': group})
+    return render(request, 'notifications/group_delete.html', {
+        'group': group,
+        'user_count': group.users.count(),
+    })
 
 
 @login_required
@@ -213,104 +221,81 @@ def message_create(request):
     })
 
 
+# Сколько получателей показывать на странице превью рассылки
+PREVIEW_SAMPLE_SIZE = 20
+
+
 @login_required
 def message_send(request, message_id):
     """Отправка сообщения"""
     message = get_object_or_404(NotificationMessage, id=message_id)
     
     if request.method == 'POST':
-        # Получаем целевых пользователей
-        if message.send_to_all:
-            target_users = NotificationUser.objects.filter(is_active=True)
-        else:
-            target_users = NotificationUser.objects.filter(
-                group__in=message.target_groups.all(),
-                is_active=True
-            )
-        
-        # Инициализируем сервис доставки
-        delivery_service = NotificationDeliveryService()
-        
-        # Список для логирования
-        log_data = []
-        success_count = 0
-        total_count = target_users.count()
-        
-        # Отправляем сообщения
-        for user in target_users:
-            user_data = {
-                'email': user.email,
-                'phone': user.phone,
-                'telegram': user.telegram,
-            }
-            
-            delivery_method, status, error_message = delivery_service.send_notification(
-                user_data=user_data,
-                message=message.content,
-                subject=message.title,
-                delivery_methods=message.delivery_methods
-            )
-            
-            # Сохраняем лог в базу данных
-            NotificationLog.objects.create(
-                message=message,
-                user=user,
-                delivery_method=delivery_method if delivery_method != 'none' else 'failed',
-                status=status,
-                error_message=error_message
+        # Пакеты готовятся и отправляются фоновыми задачами Celery, запрос сразу возвращается
+        if enqueue_broadcast(message):
+            messages.success(
+                request,
+                'Рассылка поставлена в очередь. Ход отправки виден в списке сообщений.'
             )
-            
-            # Добавляем в лог файл
-            log_data.append({
-                'user_id': user.external_id,
-                'email': user.email,
-                'delivery_method': delivery_method,
-                'status': status,
-                'error_message': error_message,
-                'timestamp': timezone.now().isoformat()
-            })
-            
-            if status == 'success':
-                success_count += 1
-        
-        # Создаем лог файл
-        log_file = create_notification_log(log_data)
-        
-        # Обновляем статус сообщения
-        message.is_sent = True
-        message.sent_at = timezone.now()
-        message.save()
-        
-        messages.success(
-            request,
-            f'Сообщение отправлено! Успешно: {success_count}/{total_count}. '
-            f'Лог файл: {log_file}'
-        )
+        else:
+            messages.warning(request, 'Сообщение уже отправлено или находится в процессе отправки')
         
         return redirect('message_list')
     
-    # Показываем превью
-    if message.send_to_all:
-        target_users = NotificationUser.objects.filter(is_active=True)
-    else:
-        target_users = NotificationUser.objects.filter(
-            group__in=message.target_groups.all(),
-            is_active=True
-        )
+    # Превью: сводка считается в базе, а из получателей показывается только
+    # небольшая страница, поэтому стоимость не зависит от размера аудитории
+    audience, audience_groups = message.get_audience_stats()
+    
+    sample = message.get_target_users().select_related('group').order_by('id')
+    after = request.GET.get('after', '')
+    if after.isdigit():
+        sample = sample.filter(id__gt=int(after))
+    sample_users = list(sample[:PREVIEW_SAMPLE_SIZE + 1])
     
     context = {
         'message': message,
-        'target_users': target_users,
-        'total_recipients': target_users.count(),
+        'audience': audience,
+        'audience_groups': audience_groups,
+        'total_recipients': audience['total'],
+        'sample_users': sample_users[:PREVIEW_SAMPLE_SIZE],
+        'sample_next': sample_users[PREVIEW_SAMPLE_SIZE - 1].id if len(sample_users) > PREVIEW_SAMPLE_SIZE else None,
+        'sample_is_first': not after.isdigit(),
     }
     
     return render(request, 'notifications/message_send.html', context)
 
 
+@login_required
+def message_resume(request, message_id):
+    """Продолжение прерванной рассылки (с retry_failed - и повтор неудачных доставок)"""
+    message = get_object_or_404(NotificationMessage, id=message_id)
+    
+    if request.method == 'POST':
+        queued = resume_broadcast(message, retry_failed=request.POST.get('retry_failed') == '1')
+        
+        if queued is None:
+            messages.warning(request, 'Продолжать нечего: все получатели обработаны или рассылка еще выполняется')
+        elif queued == (0, 0):
+            messages.success(request, 'Разбиение рассылки на пакеты запущено заново')
+        else:
+            chunks_count, total_count = queued
+            messages.success(
+                request,
+                f'Рассылка продолжена: {total_count} получателей, {chunks_count} пакетов'
+            )
+    
+    return redirect('message_list')
+
+
 @login_required
 def message_list(request):
     """Список сообщений"""
-    messages_qs = NotificationMessage.objects.select_related('created_by').all()
+    messages_qs = NotificationMessage.objects.select_related(
+        'created_by', 'delivery_stats'
+    ).prefetch_related('target_groups').annotate(
+        # Продолжить можно только прерванную рассылку (NotificationMessage.is_stalled)
+        last_activity=NotificationMessage.last_activity_subquery()
+    )
     
     paginator = Paginator(messages_qs, 20)
     page_number = request.GET.get('page')
@@ -321,51 +306,31 @@ def message_list(request):
 
 @login_required
 def import_users(request):
-    """Импорт пользователей из JSON"""
+    """Импорт пользователей из JSON, NDJSON или CSV"""
     if request.method == 'POST':
         form = JsonUploadForm(request.POST, request.FILES)
         if form.is_valid():
-            json_file = form.cleaned_data['json_file']
+            upload = form.cleaned_data['json_file']
             
             try:
-                content = json_file.read().decode('utf-8')
-                users_data = json.loads(content)
-                
-                imported_count = 0
-                errors = []
-                
-                with transaction.atomic():
-                    for user_data in users_data:
-                        try:
-                            # Получаем или создаем группу
-                            group, created = UserGroup.objects.get_or_create(
-                                name=user_data['group'],
-                                defaults={'description': f'Группа {user_data["group"]}'}
-                            )
-                            
-                            # Создаем или обновляем пользователя
-                            user, created = NotificationUser.objects.update_or_create(
-                                external_id=user_data['id'],
-                                defaults={
-                                    'email': user_data['email'],
-                                    'phone': user_data['phone'],
-                                    'telegram': user_data['telegram'],
-                                    'group': group,
-                                    'is_active': True,
-                                }
-                            )
-                            imported_count += 1
-                            
-                        except Exception as e:
-                            errors.append(f"Пользователь ID {user_data.get('id', '?')}: {str(e)}")
+                # Файл читается потоково и записывается пакетами
+                result = import_users_stream(
+                    upload,
+                    detect_format(upload.name),
+                    full_snapshot=form.cleaned_data['full_snapshot']
+                )
                 
-                if errors:
+                if result.errors:
                     messages.warning(
                         request,
-                        f'Импортировано {imported_count} пользователей. Ошибки: {"; ".join(errors[:5])}'
+                        f'Импортировано {result.imported} пользователей ({result.summary()}). '
+                        f'Ошибок: {result.error_count}: {"; ".join(result.errors[:5])}'
                     )
                 else:
-                    messages.success(request, f'Успешно импортировано {imported_count} пользователей')
+                    messages.success(
+                        request,
+                        f'Успешно импортировано {result.imported} пользователей ({result.summary()})'
+                    )
                 
                 return redirect('user_list')
                 
@@ -389,20 +354,25 @@ def bulk_action(request):
             
             users = NotificationUser.objects.filter(id__in=selected_users)
             
-            if action == 'activate':
-                users.update(is_active=True)
-                messages.success(request, f'Активировано {users.count()} пользователей')
-            elif action == 'deactivate':
-                users.update(is_active=False)
-                messages.success(request, f'Деактивировано {users.count()} пользователей')
-            elif action == 'delete':
-                count = users.count()
-                users.delete()
-                messages.success(request, f'Удалено {count} пользователей')
-            elif action == 'change_group':
-                new_group = form.cleaned_data['new_group']
-                users.update(group=new_group)
-                messages.success(request, f'Изменена группа для {users.count()} пользователей')
+            # update() не вызывает сигналы, а delete() вызывает их на каждого пользователя:
+            # кэш главной панели сбрасывается один раз
+            with dashboard_cache.batch():
+                if action == 'activate':
+                    users.update(is_active=True)
+                    messages.success(request, f'Активировано {users.count()} пользователей')
+                elif action == 'deactivate':
+                    users.update(is_active=False)
+                    messages.success(request, f'Деактивировано {users.count()} пользователей')
+                elif action == 'delete':
+                    count = users.count()
+                    users.delete()
+                    messages.success(request, f'Удалено {count} пользователей')
+                elif action == 'change_group':
+                    new_group = form.cleaned_data['new_group']
+                    # Сбрасываем отпечаток импорта: update() не вызывает save()
+                    users.update(group=new_group, import_hash='')
+                    messages.success(request, f'Изменена группа для {users.count()} пользователей')
+                dashboard_cache.invalidate('users', 'logs')
     
     return redirect('user_list')
 
@@ -421,15 +391,56 @@ def logs(request):
     if method_filter:
         logs = logs.filter(delivery_method=method_filter)
     
-    # Пагинация
-    paginator = Paginator(logs, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset пагинация: без COUNT(*) и OFFSET по всей таблице
+    page_obj = keyset_paginate(
+        logs, 50,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    
+    # Параметры фильтров для ссылок пагинации
+    filter_params = {key: value for key, value in (('status', status_filter), ('method', method_filter)) if value}
     
     context = {
         'page_obj': page_obj,
+        'total_count': estimated_count(logs, f'logs:{status_filter}:{method_filter}'),
+        'filter_query': urlencode(filter_params),
         'status_choices': NotificationLog.STATUS_CHOICES,
         'method_choices': NotificationLog.DELIVERY_METHOD_CHOICES,
     }
     
     return render(request, 'notifications/logs.html', context)
+
+
+@csrf_exempt
+def telegram_webhook(request):
+    """
+    Прием обновлений Telegram (webhook)
+    
+    Запрос проверяется по заголовку X-Telegram-Bot-Api-Secret-Token, обновление
+    сохраняется в очередь пакетной обработки, и после этого Telegram получает ответ.
+    """
+    secret = getattr(settings, 'TELEGRAM_WEBHOOK_SECRET', '')
+    if not secret:
+        return HttpResponse(status=404)
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+    
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(token.encode(), secret.encode()):
+        return HttpResponse(status=403)
+    
+    try:
+        update = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return HttpResponse(status=400)
+    if not isinstance(update, dict):
+        return HttpResponse(status=400)
+    update_id = update.get('update_id')
+    if isinstance(update_id, bool) or not isinstance(update_id, int):
+        return HttpResponse(status=400)
+    if not isinstance(update.get('message', {}), dict):
+        return HttpResponse(status=400)
+    
+    telegram_update_buffer.add(update)
+    return JsonResponse({'ok': True})
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramUpdateBuffer:
+    """
+    Очередь обновлений, полученных через webhook Telegram
+
+    Webhook сохраняет обновление в таблицу TelegramWebhookUpdate и только
+    после этого отвечает Telegram. Очередь обрабатывается пакетами той же
+    логикой, что и long polling (TelegramChatIdCollector.process_updates):
+    когда накопилось batch_size обновлений - в запросе, который его заполнил,
+    иначе фоновым потоком не позже чем через flush_interval секунд.
+    Обработанные обновления удаляются из таблицы; если обработка не удалась
+    или процесс перезапустился, они обрабатываются при следующем flush().
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None, background: bool = True):
+        self.batch_size = batch_size or getattr(settings, 'TELEGRAM_WEBHOOK_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval or getattr(settings, 'TELEGRAM_WEBHOOK_FLUSH_INTERVAL', 1.0)
+        # False - обновления обрабатываются только явным flush()
+        self.background = background
+        self._added = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, update: Dict):
+        """Сохранить обновление в очередь (повтор того же update_id игнорируется)"""
+        from .models import TelegramWebhookUpdate
+
+        _, created = TelegramWebhookUpdate.objects.get_or_create(
+            update_id=update['update_id'], defaults={'payload': update}
+        )
+        if not created:
+            return
+
+        with self._lock:
+            self._added += 1
+            full = self._added >= self.batch_size
+            if not full and self.background:
+                self._ensure_thread()
+        if full:
+            self.flush()
+        else:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Обработать сохраненные обновления. Returns количество обработанных обновлений"""
+        from .models import TelegramWebhookUpdate
+        from .services import telegram_collector
+
+        processed = 0
+        with self._flush_lock:
+            with self._lock:
+                self._added = 0
+
+            while True:
+                rows = list(TelegramWebhookUpdate.objects.order_by('update_id')[:self.batch_size])
+                if not rows:
+                    break
+
+                try:
+                    updated = telegram_collector.process_updates([row.payload for row in rows])
+                except DatabaseError as e:
+                    # База недоступна: обновления остаются в таблице до следующей обработки
+                    logger.error(f"Ошибка обработки {len(rows)} обновлений Telegram: {e}")
+                    break
+                except Exception as e:
+                    # Пакет с испорченным обновлением разбирается по одному, чтобы оно не держало очередь
+                    logger.error(f"Ошибка обработки {len(rows)} обновлений Telegram: {e}")
+                    try:
+                        updated = self._process_one_by_one(rows)
+                    except DatabaseError as e:
+                        logger.error(f"Ошибка обработки обновлений Telegram: {e}")
+                        break
+
+                TelegramWebhookUpdate.objects.filter(id__in=[row.id for row in rows]).delete()
+                processed += len(rows)
+                logger.info(f"Webhook Telegram: обработано обновлений {len(rows)}, обновлено chat_id {updated}")
+
+        return processed
+
+    def _process_one_by_one(self, rows) -> int:
+        """Обработать обновления по одному; обновления с ошибкой пропускаются (остаются в логе)"""
+        from .services import telegram_collector
+
+        updated = 0
+        for row in rows:
+            try:
+                updated += telegram_collector.process_updates([row.payload])
+            except DatabaseError:
+                raise
+            except Exception as e:
+                logger.error(f"Обновление Telegram {row.update_id} пропущено: {e}; {row.payload!r}")
+        return updated
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait()
+            # Собираем обновления, пришедшие за интервал, в один пакет
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+# Глобальная очередь обновлений webhook
+telegram_update_buffer = TelegramUpdateBuffer()
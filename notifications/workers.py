@@ -0,0 +1,70 @@
+import logging
+import os
+import socket
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import BroadcastChunk
+from .tasks import process_chunk
+
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastWorker:
+    """
+    Воркер рассылок: берет пакеты BroadcastChunk из базы и отправляет их
+
+    Несколько воркеров (процессы на одном или разных хостах) разбирают
+    пакеты одной рассылки параллельно: каждый пакет берется в аренду на
+    lease_seconds, пакеты упавших воркеров после истечения аренды берут
+    остальные.
+
+        worker = BroadcastWorker()
+        worker.run(exit_when_idle=True)
+    """
+
+    def __init__(self, name: str = None, message_id: int = None,
+                 lease_seconds: int = None, poll_interval: float = None):
+        self.owner = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.message_id = message_id
+        self.lease_seconds = lease_seconds or getattr(settings, 'BROADCAST_LEASE_SECONDS', 300)
+        self.poll_interval = poll_interval or getattr(settings, 'BROADCAST_WORKER_POLL_INTERVAL', 2.0)
+        self._stopped = threading.Event()
+        self.processed = 0
+
+    def run_once(self) -> bool:
+        """Обработать один пакет. Returns False, если свободных пакетов нет"""
+        chunk = BroadcastChunk.claim_next(self.owner, self.lease_seconds, self.message_id)
+        if chunk is None:
+            return False
+
+        try:
+            process_chunk(chunk, self.owner, self.lease_seconds)
+        except Exception as e:
+            logger.error(f"Воркер {self.owner}: ошибка пакета {chunk.index} рассылки {chunk.message_id}: {e}")
+        self.processed += 1
+        return True
+
+    def run(self, exit_when_idle: bool = False) -> int:
+        """Обрабатывать пакеты до stop() (или до конца очереди). Returns количество пакетов"""
+        logger.info(f"Воркер рассылок {self.owner} запущен")
+        while not self._stopped.is_set():
+            try:
+                found = self.run_once()
+            finally:
+                close_old_connections()
+
+            if not found:
+                if exit_when_idle:
+                    break
+                self._stopped.wait(self.poll_interval)
+
+        logger.info(f"Воркер рассылок {self.owner} остановлен, обработано пакетов: {self.processed}")
+        return self.processed
+
+    def stop(self):
+        """Остановиться после текущего пакета"""
+        self._stopped.set()